@@ -11,19 +11,39 @@ A Chess Mentor module that:
 - Provides move quality feedback to the GUI
 """
 
+import asyncio
+import concurrent.futures
 import chess
 import chess.engine
+import chess.polyglot
 import os
+import sys
+import json
+import time
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Try to import Google Generative AI
 try:
     import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
     GEMINI_AVAILABLE = True
+    # Errors that fail again with the same key and model, unlike network,
+    # quota or server errors
+    GEMINI_PERMANENT_ERRORS = (
+        google_exceptions.Unauthenticated,
+        google_exceptions.PermissionDenied,
+        google_exceptions.NotFound,
+        google_exceptions.InvalidArgument,
+    )
 except ImportError:
     GEMINI_AVAILABLE = False
+    GEMINI_PERMANENT_ERRORS = ()
     logging.warning("google-generativeai not installed. AI explanations will be disabled.")
 
 # Load environment variables
@@ -33,34 +53,365 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+# Try a small list of likely-available models (based on list_models)
+GEMINI_CANDIDATE_MODELS = [
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-flash-latest',
+    'models/gemini-2.0-flash',
+    'models/gemini-pro-latest',
+]
+
+
+# One cached engine evaluation: score is the engine PovScore, pv the
+# principal variation and depth the search depth that produced them.
+# lines maps the root moves of the same MultiPV search to their PovScore.
+EvalEntry = namedtuple('EvalEntry', ['score', 'pv', 'depth', 'lines'], defaults=(None,))
+
+# Finished background analysis of a user move, text is ready for the GUI.
+MentorResult = namedtuple('MentorResult', ['job_id', 'san', 'text'])
+
+
+class MentorCancelled(Exception):
+    """Raised inside an analysis that was interrupted by ChessMentor.stop()"""
+
+
+def is_iteration_done(info, num_lines):
+    """Whether info is the last line of a MultiPV iteration
+
+    The engine sends the lines of an iteration in order, so when the last
+    one arrives every line has the depth of that iteration.
+    """
+    return (info.get('multipv', 1) == num_lines and 'pv' in info and
+            'upperbound' not in info and 'lowerbound' not in info)
+
+
+class EvalCache:
+    """Bounded position evaluation cache keyed by Zobrist hash.
+
+    Entries are replaced depth-first: a shallower result never overwrites a
+    deeper one for the same position. An entry is replaced as a whole, so
+    its score and lines always come from one search. When the cache is full
+    the least recently used entry is evicted. Searches store their results
+    from the engine loop, so all methods take a lock.
+    """
+
+    def __init__(self, max_entries=50000):
+        """
+        Args:
+            max_entries: Maximum number of positions kept in the cache
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, board, depth):
+        """
+        Look up the evaluation of a position
+
+        Args:
+            board: chess.Board object
+            depth: Minimum depth the stored result must have
+
+        Returns:
+            EvalEntry, or None if there is no entry at least as deep as depth
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.depth < depth:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, board):
+        """Returns the entry of a position at any depth, without counting it"""
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, board, score, pv, depth, lines=None):
+        """
+        Store the evaluation of a position
+
+        Args:
+            board: chess.Board object
+            score: chess.engine.PovScore from the engine
+            pv: List of chess.Move, the principal variation
+            depth: Depth the engine reached
+            lines: Optional dict of root move to PovScore, from the search
+                that gave score
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        entry = EvalEntry(score, list(pv or []), depth, dict(lines) if lines else None)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None and old.depth > depth:
+                # Keep the deeper result
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class ExplanationCache:
+    """Two-tier cache of move explanations
+
+    An in-memory LRU sits in front of an SQLite file, so explanations of
+    common moves survive restarts and are shared by everyone using the same
+    file. Keys are (FEN without move clocks, UCI move, quality bucket).
+    Entries older than ttl_sec are ignored and the file is trimmed to
+    max_rows, least recently used first.
+    """
+
+    def __init__(self, db_file='pecg_explanations.sqlite3', max_memory=2000,
+                 max_rows=200000, ttl_sec=90 * 24 * 3600):
+        """
+        Args:
+            db_file: SQLite file, None keeps the cache in memory only
+            max_memory: Number of explanations kept in memory
+            max_rows: Number of explanations kept in the file
+            ttl_sec: Age in seconds after which an explanation is stale
+        """
+        self.max_memory = max_memory
+        self.max_rows = max_rows
+        self.ttl_sec = ttl_sec
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.hit_time = 0.0
+        self.miss_time = 0.0
+
+        if db_file:
+            try:
+                self._db = sqlite3.connect(db_file, check_same_thread=False)
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS explanation ('
+                    'fen TEXT, move TEXT, bucket TEXT, text TEXT, '
+                    'created REAL, accessed REAL, '
+                    'PRIMARY KEY (fen, move, bucket))'
+                )
+                self._db.execute(
+                    'CREATE INDEX IF NOT EXISTS explanation_accessed '
+                    'ON explanation (accessed)'
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Explanation cache file {db_file} disabled: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(board, move, quality):
+        """Returns the cache key of a move explained at a quality"""
+        fen = ' '.join(board.fen().split()[:4])
+        return fen, move.uci(), quality
+
+    def get(self, key):
+        """
+        Look up an explanation
+
+        Args:
+            key: tuple from make_key()
+
+        Returns:
+            str, or None on a miss
+        """
+        t1 = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and now - item[1] <= self.ttl_sec:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.hit_time += time.perf_counter() - t1
+                return item[0]
+
+            text = None
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        'SELECT text, created FROM explanation '
+                        'WHERE fen = ? AND move = ? AND bucket = ?', key
+                    ).fetchone()
+                    if row is not None and now - row[1] <= self.ttl_sec:
+                        text = row[0]
+                        self._db.execute(
+                            'UPDATE explanation SET accessed = ? '
+                            'WHERE fen = ? AND move = ? AND bucket = ?', (now, *key)
+                        )
+                        self._db.commit()
+                        self._remember(key, text, row[1])
+                except sqlite3.Error as e:
+                    logger.warning(f"Explanation cache read failed: {e}")
+
+            if text is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self.hit_time += time.perf_counter() - t1
+            return text
+
+    def put(self, key, text, miss_latency=0.0):
+        """
+        Store an explanation
+
+        Args:
+            key: tuple from make_key()
+            text: The explanation
+            miss_latency: Seconds it took to get the explanation from the API
+        """
+        now = time.time()
+        with self._lock:
+            self.miss_time += miss_latency
+            self._remember(key, text, now)
+            if self._db is None:
+                return
+
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO explanation VALUES (?, ?, ?, ?, ?, ?)',
+                    (*key, text, now, now)
+                )
+                self._puts += 1
+                if self._puts % 100 == 1:
+                    self._evict(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Explanation cache write failed: {e}")
+
+    def stats(self):
+        """
+        Returns:
+            dict of hit, miss and latency counters; saved_sec estimates the
+            API time saved by hits at the average miss latency
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            avg_miss = self.miss_time / self.misses if self.misses else 0.0
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'avg_hit_ms': 1000 * self.hit_time / hits if hits else 0.0,
+                'avg_miss_ms': 1000 * avg_miss,
+                'saved_sec': hits * avg_miss,
+            }
+
+    def close(self):
+        """Close the SQLite file"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, text, created):
+        self._memory[key] = (text, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """Delete stale rows and trim the file to max_rows"""
+        self._db.execute('DELETE FROM explanation WHERE created < ?', (now - self.ttl_sec,))
+        count = self._db.execute('SELECT COUNT(*) FROM explanation').fetchone()[0]
+        if count > self.max_rows:
+            self._db.execute(
+                'DELETE FROM explanation WHERE rowid IN ('
+                'SELECT rowid FROM explanation ORDER BY accessed LIMIT ?)',
+                (count - self.max_rows,)
+            )
+
+
 class ChessMentor:
     """AI Chess Mentor for move evaluation and explanation"""
 
-    def __init__(self, stockfish_path=None, use_gemini=True):
+    def __init__(self, stockfish_path=None, use_gemini=True, eval_cache_size=50000,
+                 single_search=True,
+                 explanation_cache_file='pecg_explanations.sqlite3',
+                 gemini_state_file='pecg_gemini_state.json',
+                 gemini_state_ttl_sec=7 * 24 * 3600, engine_provider=None,
+                 engine_submit=None):
         """
         Initialize Chess Mentor
 
         Args:
             stockfish_path: Path to Stockfish engine. If None, tries to find it.
             use_gemini: Whether to use Google Gemini for explanations
+            eval_cache_size: Number of positions kept in the evaluation cache
+            single_search: Grade a move from one MultiPV search of all moves
+                of the position before it instead of searching before and
+                after the move
+            explanation_cache_file: SQLite file of the explanation cache, None
+                keeps explanations in memory only
+            gemini_state_file: File remembering the Gemini model that worked,
+                None probes the models on every start
+            gemini_state_ttl_sec: Age in seconds after which models are probed again
+            engine_provider: Optional callable returning a running engine that
+                someone else owns, e.g. from the GUI engine pool. It is called
+                on first use, and no Stockfish process is started here.
+            engine_submit: Optional callable scheduling a coroutine on the
+                loop the engine runs on and returning its
+                concurrent.futures.Future, e.g. EngineOrchestrator.submit.
+                If None, searches run on the loop of the engine protocol.
         """
-        self.engine = None
+        self.engine_provider = engine_provider
+        self.engine_submit = engine_submit
+        self._own_engine = None
+        self.eval_cache = EvalCache(eval_cache_size)
+        self.explanation_cache = ExplanationCache(explanation_cache_file)
+        self.single_search = single_search
+        self._cancel = threading.Event()
+        self._future = None
+        self._future_lock = threading.Lock()
         self.stockfish_path = stockfish_path or self._find_stockfish()
         self.use_gemini = use_gemini and GEMINI_AVAILABLE
         self.gemini_model = None
+        self.gemini_state_file = gemini_state_file
+        self.gemini_state_ttl_sec = gemini_state_ttl_sec
+        self.gemini_wait_sec = 5
 
         # Initialize Stockfish engine
-        if self.stockfish_path and os.path.exists(self.stockfish_path):
+        if self.engine_provider is not None:
+            logger.info("Stockfish engine is provided on first use")
+        elif self.stockfish_path and os.path.exists(self.stockfish_path):
             try:
-                self.engine = chess.engine.SimpleEngine.popen_uci(self.stockfish_path)
+                self._own_engine = chess.engine.SimpleEngine.popen_uci(self.stockfish_path)
                 logger.info(f"Stockfish engine loaded: {self.stockfish_path}")
             except Exception as e:
                 logger.error(f"Failed to load Stockfish: {e}")
-                self.engine = None
+                self._own_engine = None
         else:
             logger.warning("Stockfish engine not found. Move evaluation disabled.")
 
-        # Initialize Gemini
+        # Initialize Gemini. Selecting a model may probe the network, so it
+        # runs on a startup thread and never delays the caller.
+        self._gemini_ready = threading.Event()
         if self.use_gemini:
             try:
                 api_key = os.getenv('GOOGLE_GEMINI_API_KEY')
@@ -69,35 +420,96 @@ class ChessMentor:
                     self.use_gemini = False
                 else:
                     genai.configure(api_key=api_key)
-
-                    # Try a small list of likely-available models (based on list_models)
-                    candidate_models = [
-                        'models/gemini-2.5-flash',
-                        'models/gemini-2.5-pro',
-                        'models/gemini-flash-latest',
-                        'models/gemini-2.0-flash',
-                        'models/gemini-pro-latest',
-                    ]
-
-                    self.gemini_model = None
-                    for model_name in candidate_models:
-                        try:
-                            test_model = genai.GenerativeModel(model_name)
-                            # Probe once to confirm availability
-                            test_model.generate_content("ok")
-                            self.gemini_model = test_model
-                            logger.info(f"Google Gemini initialized with model: {model_name}")
-                            break
-                        except Exception as model_err:
-                            logger.warning(f"Gemini model {model_name} failed: {model_err}")
-
-                    if not self.gemini_model:
-                        logger.error("No Gemini model could be initialized from candidate list")
-                        self.use_gemini = False
+                    threading.Thread(target=self._select_gemini_model,
+                                     name='gemini-select', daemon=True).start()
             except Exception as e:
                 logger.error(f"Failed to initialize Gemini: {e}")
                 self.use_gemini = False
 
+        if not self.use_gemini:
+            self._gemini_ready.set()
+
+    def _select_gemini_model(self):
+        """
+        Pick the Gemini model, in the background
+
+        A model that worked before is read from the state file and used
+        without probing while it is younger than gemini_state_ttl_sec.
+        Otherwise the candidates are probed in order and the first one that
+        answers is saved to the state file.
+        """
+        try:
+            model_name = self._load_gemini_state()
+            if model_name:
+                self.gemini_model = genai.GenerativeModel(model_name)
+                logger.info(f"Google Gemini initialized with saved model: {model_name}")
+                return
+
+            for model_name in GEMINI_CANDIDATE_MODELS:
+                try:
+                    test_model = genai.GenerativeModel(model_name)
+                    # Probe once to confirm availability
+                    test_model.generate_content("ok")
+                    self.gemini_model = test_model
+                    logger.info(f"Google Gemini initialized with model: {model_name}")
+                    self._save_gemini_state(model_name)
+                    break
+                except Exception as model_err:
+                    logger.warning(f"Gemini model {model_name} failed: {model_err}")
+
+            if not self.gemini_model:
+                logger.error("No Gemini model could be initialized from candidate list")
+                self.use_gemini = False
+        except Exception as e:
+            logger.error(f"Failed to initialize Gemini: {e}")
+            self.use_gemini = False
+        finally:
+            self._gemini_ready.set()
+
+    def _load_gemini_state(self):
+        """Returns the saved model name, or None if missing or expired"""
+        if not self.gemini_state_file:
+            return None
+        try:
+            with open(self.gemini_state_file, 'r') as json_file:
+                state = json.load(json_file)
+            if time.time() - state['time'] <= self.gemini_state_ttl_sec:
+                return state['model']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring Gemini state file: {e}")
+        return None
+
+    def _save_gemini_state(self, model_name):
+        if not self.gemini_state_file:
+            return
+        try:
+            with open(self.gemini_state_file, 'w') as h:
+                json.dump({'model': model_name, 'time': time.time()}, h, indent=4)
+        except OSError as e:
+            logger.warning(f"Failed to save Gemini state: {e}")
+
+    def _forget_gemini_state(self):
+        """The saved model failed, probe again on the next start"""
+        if not self.gemini_state_file:
+            return
+        try:
+            os.remove(self.gemini_state_file)
+        except OSError:
+            pass
+
+    @property
+    def engine(self):
+        """The engine used for evaluation, or None if there is none"""
+        if self.engine_provider is None:
+            return self._own_engine
+        try:
+            return self.engine_provider()
+        except Exception as e:
+            logger.error(f"Failed to get Stockfish engine: {e}")
+            return None
+
     def _find_stockfish(self):
         """Try to find Stockfish in common locations"""
         common_paths = [
@@ -141,24 +553,21 @@ class ChessMentor:
                 'explanation': 'Engine analysis not available'
             }
 
+        if self.single_search:
+            return self._evaluate_move_single(board, move, depth, time_limit)
+
         try:
             # Get evaluation before the move
-            info_before = self.engine.analyse(
-                board,
-                chess.engine.Limit(depth=depth, time=time_limit)
-            )
-            score_before = info_before.get('score')
+            info_before = self._analyse(board, depth, time_limit)
+            score_before = info_before.score
             logger.debug(f"Score before move: {score_before}")
 
             # Make the move and evaluate
             board_copy = board.copy()
             board_copy.push(move)
 
-            info_after = self.engine.analyse(
-                board_copy,
-                chess.engine.Limit(depth=depth, time=time_limit)
-            )
-            score_after = info_after.get('score')
+            info_after = self._analyse(board_copy, depth, time_limit)
+            score_after = info_after.score
             logger.debug(f"Score after move: {score_after}")
 
             # Calculate move quality
@@ -169,12 +578,58 @@ class ChessMentor:
 
             return {
                 'score': score_after,
-                'mate': info_after.get('mate'),
+                'mate': score_after.relative.mate() if score_after is not None else None,
+                'quality': quality,
+                'score_diff': score_diff,
+                'explanation': None  # Will be filled by Gemini
+            }
+
+        except MentorCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error evaluating move: {e}", exc_info=True)
+            return {
+                'score': None,
+                'mate': None,
+                'quality': 'Error',
+                'explanation': f"Evaluation error: {str(e)}"
+            }
+
+    def _evaluate_move_single(self, board, move, depth, time_limit):
+        """
+        Evaluate a move from a single search of the position before it
+
+        The position is searched with one MultiPV line per legal move, under
+        the same depth and time limit as one search of evaluate_move's two.
+        The best line gives the score before the move and the line starting
+        with the played move gives the score after it, both from the last
+        iteration that searched every line.
+
+        Returns:
+            dict with the same keys as evaluate_move()
+        """
+        try:
+            entry = self._analyse_lines(board, move, depth, time_limit)
+
+            score_before = entry.score
+            score_after = entry.lines[move]
+            logger.debug(f"Score before move: {score_before}, played move: {score_after}")
+
+            quality, score_diff = self._calculate_quality(
+                score_before, score_after, board.turn
+            )
+            logger.debug(f"Move quality calculated: {quality}, diff: {score_diff}")
+
+            return {
+                'score': score_after,
+                'mate': score_after.relative.mate() if score_after is not None else None,
                 'quality': quality,
                 'score_diff': score_diff,
                 'explanation': None  # Will be filled by Gemini
             }
 
+        except MentorCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error evaluating move: {e}", exc_info=True)
             return {
@@ -184,6 +639,216 @@ class ChessMentor:
                 'explanation': f"Evaluation error: {str(e)}"
             }
 
+    def _analyse_lines(self, board, move, depth, time_limit):
+        """
+        Search every move of a position with MultiPV and cache their scores
+
+        A cached entry is used if it is deep enough and has a line for
+        move, e.g. from pre_analyze().
+
+        Args:
+            board: chess.Board object
+            move: chess.Move that must have a line
+            depth: Search depth
+            time_limit: Time limit in seconds
+
+        Returns:
+            EvalEntry for the position, lines holds the root moves searched
+        """
+        entry = self.eval_cache.get(board, depth)
+        if entry is not None and entry.lines and move in entry.lines:
+            logger.debug(f"Eval cache hit at depth {entry.depth}: {board.fen()}")
+            return entry
+
+        infos = self._search(
+            board,
+            chess.engine.Limit(depth=depth, time=time_limit),
+            multipv=board.legal_moves.count()
+        )
+        entry = self._store_lines(board, infos)
+        if entry is None or move not in entry.lines:
+            raise RuntimeError('engine returned no score for the move')
+        return entry
+
+    def _store_lines(self, board, infos):
+        """
+        Put MultiPV search results in the evaluation cache
+
+        The root position gets the best score and every searched root move,
+        and the position after each root move gets its line one ply shorter.
+
+        Returns:
+            EvalEntry of the root position from this search, None if the
+            search has no line. The cache keeps a deeper entry it has.
+        """
+        lines = {}
+        depth = 0
+        for info in infos:
+            if 'pv' not in info or 'score' not in info:
+                continue
+            lines[info['pv'][0]] = info['score']
+            depth = max(depth, info.get('depth', 0))
+
+            # The position after the root move comes for free
+            child = board.copy(stack=False)
+            child.push(info['pv'][0])
+            child_score = chess.engine.PovScore(info['score'].pov(child.turn), child.turn)
+            self.eval_cache.put(child, child_score, info['pv'][1:],
+                                max(0, info.get('depth', 0) - 1))
+
+        if not lines:
+            return None
+
+        best = infos[0]
+        entry = EvalEntry(best['score'], list(best['pv']), depth, lines)
+        self.eval_cache.put(board, *entry)
+        return entry
+
+    def _analyse(self, board, depth, time_limit):
+        """
+        Evaluate a position, using the evaluation cache when possible
+
+        Args:
+            board: chess.Board object
+            depth: Search depth
+            time_limit: Time limit in seconds
+
+        Returns:
+            EvalEntry for the position
+        """
+        entry = self.eval_cache.get(board, depth)
+        if entry is not None:
+            logger.debug(f"Eval cache hit at depth {entry.depth}: {board.fen()}")
+            return entry
+
+        info = self._search(
+            board,
+            chess.engine.Limit(depth=depth, time=time_limit)
+        )[0]
+        entry = EvalEntry(info.get('score'), info.get('pv', []), info.get('depth', 0))
+        if entry.score is not None:
+            self.eval_cache.put(board, entry.score, entry.pv, entry.depth)
+
+        return entry
+
+    def _search(self, board, limit, multipv=None):
+        """
+        Run an engine search that stop() can interrupt
+
+        Returns:
+            list of info dicts, one per MultiPV line. With several lines they
+            are those of the last iteration that searched all of them, so a
+            search that runs out of time does not mix depths.
+
+        Raises:
+            MentorCancelled: if stop() was called before or during the search
+        """
+        return self._run_on_engine(
+            lambda protocol: self._search_lines(protocol, board, limit, multipv))
+
+    @staticmethod
+    async def _search_lines(protocol, board, limit, multipv):
+        num_lines = multipv or 1
+        infos = None
+        with await protocol.analysis(board, limit, multipv=multipv) as analysis:
+            async for info in analysis:
+                if is_iteration_done(info, num_lines):
+                    # python-chess updates the line dicts in place
+                    infos = [dict(line) for line in analysis.multipv]
+            if infos is None:
+                infos = [dict(line) for line in analysis.multipv]
+
+        return infos
+
+    def pre_analyze(self, board, depth=20, multipv=4):
+        """
+        Analyse a position ahead of time and fill the evaluation cache
+
+        Every completed iteration stores the score of the top multipv
+        candidate moves, so grading one of them later needs no search.
+        Runs until depth is reached or stop() is called.
+
+        Args:
+            board: chess.Board object, the user is to move
+            depth: Depth to stop at
+            multipv: Number of candidate moves searched
+
+        Raises:
+            MentorCancelled: if stop() was called
+        """
+        if not self.engine:
+            return
+
+        num_lines = min(multipv, board.legal_moves.count())
+        if num_lines == 0:
+            return
+
+        t1 = time.perf_counter()
+        self._run_on_engine(
+            lambda protocol: self._pre_analyze_lines(protocol, board, depth, num_lines))
+        logger.debug(f"Pre-analysis done in {time.perf_counter() - t1:.2f}s: {board.fen()}")
+
+    async def _pre_analyze_lines(self, protocol, board, depth, num_lines):
+        limit = chess.engine.Limit(depth=depth)
+        with await protocol.analysis(board, limit, multipv=num_lines) as analysis:
+            async for info in analysis:
+                # The last line of an iteration completes the MultiPV set
+                if is_iteration_done(info, num_lines):
+                    self._store_lines(board, analysis.multipv)
+
+    def _run_on_engine(self, make_search):
+        """
+        Run a search coroutine on the engine loop and wait for its result
+
+        stop() cancels the future, the coroutine then leaves its analysis
+        and that sends stop to the engine.
+
+        Args:
+            make_search: Callable taking the engine protocol and returning
+                the search coroutine
+
+        Raises:
+            MentorCancelled: if stop() was called before or during the search
+        """
+        if self._cancel.is_set():
+            raise MentorCancelled()
+
+        engine = self.engine
+        if engine is None:
+            raise RuntimeError('engine is not available')
+
+        protocol = engine.protocol
+        submit = self.engine_submit or (
+            lambda coro: asyncio.run_coroutine_threadsafe(coro, protocol.loop))
+        with self._future_lock:
+            # stop() sets the event before it takes the lock
+            if self._cancel.is_set():
+                raise MentorCancelled()
+            future = self._future = submit(make_search(protocol))
+        try:
+            result = future.result()
+        except concurrent.futures.CancelledError:
+            raise MentorCancelled()
+        finally:
+            with self._future_lock:
+                self._future = None
+
+        if self._cancel.is_set():
+            raise MentorCancelled()
+
+        return result
+
+    def stop(self):
+        """Interrupt the running analysis, it raises MentorCancelled"""
+        self._cancel.set()
+        with self._future_lock:
+            if self._future is not None:
+                self._future.cancel()
+
+    def clear_stop(self):
+        """Allow new analyses after stop()"""
+        self._cancel.clear()
+
     def _score_to_cp(self, score_obj, pov_color):
         """Convert a chess.engine.PovScore/Score to centipawns from pov_color."""
         if score_obj is None:
@@ -248,6 +913,21 @@ class ChessMentor:
         Returns:
             str: AI explanation of the move
         """
+        # Gemini turned off turns explanations off, cached ones included
+        if not self.use_gemini:
+            return None
+
+        # Common moves were most likely explained before
+        cache_key = ExplanationCache.make_key(board, move, quality_info.get('quality', 'Unknown'))
+        explanation = self.explanation_cache.get(cache_key)
+        if explanation is not None:
+            return explanation
+
+        # The model may still be selected in the background
+        if self.use_gemini and not self._gemini_ready.wait(self.gemini_wait_sec):
+            logger.info("Gemini model is not selected yet, skipping explanation")
+            return None
+
         if not self.use_gemini or not self.gemini_model:
             return None
 
@@ -267,13 +947,21 @@ Focus on chess principles (control, development, tactics, etc).
 Keep it concise and educational."""
 
             # Call Gemini
+            t1 = time.perf_counter()
             response = self.gemini_model.generate_content(prompt)
             explanation = response.text.strip()
+            latency = time.perf_counter() - t1
 
-            logger.info(f"Gemini explanation received for move {san_move}")
+            logger.info(f"Gemini explanation received for move {san_move} in {latency:.2f}s")
+            self.explanation_cache.put(cache_key, explanation, latency)
             return explanation
 
+        except GEMINI_PERMANENT_ERRORS as e:
+            logger.error(f"Error getting Gemini explanation, the saved model is dropped: {e}")
+            self._forget_gemini_state()
+            return None
         except Exception as e:
+            # Likely temporary, keep the saved model
             logger.error(f"Error getting Gemini explanation: {e}")
             return None
 
@@ -293,6 +981,10 @@ Keep it concise and educational."""
         # Evaluate with Stockfish
         evaluation = self.evaluate_move(board, move, depth, time_limit)
 
+        # Do not pay for an explanation nobody will read
+        if self._cancel.is_set():
+            raise MentorCancelled()
+
         # Get explanation from Gemini
         if evaluation['quality'] != 'Error':
             explanation = self.get_move_explanation(board, move, evaluation)
@@ -334,20 +1026,226 @@ Keep it concise and educational."""
         return output
 
     def close(self):
-        """Close the Stockfish engine"""
-        if self.engine:
+        """Close the Stockfish engine and the explanation cache"""
+        logger.info(f"Explanation cache: {self.explanation_cache.stats()}")
+        self.explanation_cache.close()
+
+        # A provided engine belongs to someone else
+        if self._own_engine:
             try:
-                self.engine.quit()
+                self._own_engine.quit()
                 logger.info("Stockfish engine closed")
             except Exception as e:
                 logger.error(f"Error closing engine: {e}")
 
 
+class MentorWorker:
+    """Runs ChessMentor move analysis in the background
+
+    Only the analysis of the latest user move matters. Submitting a new move
+    cancels the previous job, and a job that is already running has its
+    engine search interrupted and its result dropped.
+
+    While the user thinks, the worker can also pre-analyse the position on
+    the board so the grading of the move is usually a cache hit.
+    """
+
+    def __init__(self, mentor, result_queue):
+        """
+        Args:
+            mentor: ChessMentor that does the analysis
+            result_queue: queue.Queue that receives a MentorResult per job
+        """
+        self.mentor = mentor
+        self.result_queue = result_queue
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mentor')
+        self._lock = threading.RLock()
+        self._job_id = 0
+        self._future = None
+        self._pre_id = 0
+        self._pre_key = None
+        self._pre_future = None
+        self._running = None
+
+    def submit(self, board, move, depth=20, time_limit=1):
+        """
+        Queue the analysis of a move, cancelling any older job
+
+        Args:
+            board: chess.Board object before the move, it is copied
+            move: chess.Move object
+            depth: Stockfish depth
+            time_limit: Stockfish time limit
+
+        Returns:
+            int: job id, the MentorResult for this move carries the same id
+        """
+        with self._lock:
+            self.cancel()
+            job_id = self._job_id
+            self._future = self._executor.submit(
+                self._run, job_id, board.copy(), move, depth, time_limit)
+
+        return job_id
+
+    def pre_analyze(self, board, depth=20, multipv=4):
+        """
+        Analyse the position the user is thinking about
+
+        The search runs after any pending move analysis and stops at depth,
+        when the user move is submitted or on stop_pre_analysis(). Asking
+        again for the position being analysed does nothing.
+
+        Args:
+            board: chess.Board object, it is copied
+            depth: Stockfish depth, use the depth the move will be graded at
+            multipv: Number of candidate moves searched
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            if key == self._pre_key:
+                return
+            self._stop_pre_analysis()
+            self._pre_key = key
+            self._pre_future = self._executor.submit(
+                self._run_pre, self._pre_id, board.copy(), depth, multipv)
+
+    def stop_pre_analysis(self):
+        """Give the CPU back, e.g. to the opponent or adviser engine"""
+        with self._lock:
+            self._stop_pre_analysis()
+            self._pre_key = None
+
+    def cancel(self):
+        """Drop the pending or running job, including pre-analysis"""
+        with self._lock:
+            self._job_id += 1
+            if self._future is not None:
+                self._future.cancel()
+                self._future = None
+            self._stop_pre_analysis()
+            self._pre_key = None
+            self.mentor.stop()
+
+    def shutdown(self):
+        """Cancel work and stop the worker thread"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _stop_pre_analysis(self):
+        self._pre_id += 1
+        if self._pre_future is not None:
+            self._pre_future.cancel()
+            self._pre_future = None
+        if self._running == 'pre':
+            self.mentor.stop()
+
+    def _start(self, kind, job_id):
+        """Mark a job as running, returns False if it is already stale"""
+        with self._lock:
+            current = self._pre_id if kind == 'pre' else self._job_id
+            if job_id != current:
+                return False
+            self._running = kind
+            self.mentor.clear_stop()
+            return True
+
+    def _finish(self):
+        with self._lock:
+            self._running = None
+
+    def _is_stale(self, job_id):
+        return job_id != self._job_id
+
+    def _run_pre(self, pre_id, board, depth, multipv):
+        if not self._start('pre', pre_id):
+            return
+
+        try:
+            self.mentor.pre_analyze(board, depth, multipv)
+        except MentorCancelled:
+            logger.debug("Pre-analysis was stopped")
+        except Exception as e:
+            logger.error(f"Error in pre-analysis: {e}", exc_info=True)
+        finally:
+            self._finish()
+
+    def _run(self, job_id, board, move, depth, time_limit):
+        if not self._start('grade', job_id):
+            return
+
+        try:
+            self._analyze(job_id, board, move, depth, time_limit)
+        finally:
+            self._finish()
+
+    def _analyze(self, job_id, board, move, depth, time_limit):
+        san_move = board.san(move)
+        t1 = time.perf_counter()
+        try:
+            analysis = self.mentor.analyze_move(board, move, depth, time_limit)
+            text = self.mentor.format_output(san_move, analysis)
+        except MentorCancelled:
+            logger.debug(f"Analysis of {san_move} was cancelled")
+            return
+        except Exception as e:
+            logger.error(f"Error analyzing move: {e}", exc_info=True)
+            text = f"Analysis error: {str(e)}"
+
+        if self._is_stale(job_id):
+            logger.debug(f"Drop stale analysis of {san_move}")
+            return
+
+        logger.info(f"Analysis of {san_move} done in {time.perf_counter() - t1:.2f}s")
+        self.result_queue.put(MentorResult(job_id, san_move, text))
+
+
+def benchmark_grading(mentor, moves_san, depth=15, time_limit=1):
+    """
+    Time move grading with one search per move against two searches per move
+
+    The evaluation cache is cleared before every move so both modes search.
+
+    Args:
+        mentor: ChessMentor with a running engine
+        moves_san: List of moves in SAN played from the start position
+        depth: Search depth
+        time_limit: Time limit in seconds
+
+    Returns:
+        dict of mode name to average seconds per graded move
+    """
+    result = {}
+    single_search = mentor.single_search
+    for mode, is_single in (('two searches', False), ('single search', True)):
+        mentor.single_search = is_single
+        board = chess.Board()
+        elapsed = 0.0
+        for san in moves_san:
+            move = board.parse_san(san)
+            mentor.eval_cache.clear()
+            t1 = time.perf_counter()
+            mentor.evaluate_move(board, move, depth, time_limit)
+            elapsed += time.perf_counter() - t1
+            board.push(move)
+        result[mode] = elapsed / len(moves_san)
+    mentor.single_search = single_search
+
+    return result
+
+
 # Example usage
 if __name__ == "__main__":
     # Test the mentor
     mentor = ChessMentor()
 
+    if '--bench' in sys.argv:
+        opening = ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Bc5', 'c3', 'Nf6', 'd4', 'exd4']
+        for mode, sec in benchmark_grading(mentor, opening).items():
+            print(f"{mode}: {sec:.3f}s per move")
+        mentor.close()
+        sys.exit(0)
+
     # Create a test position
     board = chess.Board()
     move = board.parse_san("e4")
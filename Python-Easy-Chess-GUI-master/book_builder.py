@@ -0,0 +1,381 @@
+"""
+book_builder.py
+
+Builds polyglot .bin books, like Book/pecg_book.bin, Book/computer.bin and
+Book/human.bin, from pgn files of any size.
+
+The pgn files are split into chunks of whole games that worker processes
+read in parallel. A worker counts the (position, move) pairs of the first
+plies of every game in a dict. When the dict is full it is written to a
+sorted shard file, so memory stays bounded however many games are read.
+The shards are then merged in key order into the book, at most
+MAX_MERGE_FAN_IN at a time so the number of open files stays bounded too.
+
+A move gets points for the result of the game from the side that played
+it, by default 2 for a win, 1 for a draw and 0 for a loss. Moves without
+points or played less than --min-count times are left out.
+
+Example:
+    python book_builder.py pecg_auto_save_games.pgn pecg_my_games.pgn -o Book/pecg_book.bin --max-ply 24
+"""
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from itertools import groupby
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+import pgn_tools
+
+
+ENTRY_STRUCT = struct.Struct('>QHHI')  # polyglot key, move, weight, learn
+SHARD_STRUCT = struct.Struct('>QHIQ')  # key, move, games, points
+MAX_WEIGHT = 0xffff
+MAX_MERGE_FAN_IN = 64  # shards open at once while merging
+
+BuildOptions = namedtuple('BuildOptions', [
+    'max_ply', 'color', 'win', 'draw', 'loss', 'max_entries', 'shard_dir'])
+ChunkResult = namedtuple('ChunkResult', ['games', 'skipped', 'moves', 'shards'])
+
+
+def polyglot_move(board, move):
+    """Encodes a move the way polyglot stores it, castling is king takes rook."""
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if board.is_kingside_castling(move) else 0
+        to_square = chess.square(rook_file, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+
+    return to_square | move.from_square << 6 | promotion << 12
+
+
+class ZobristCache:
+    def __init__(self, max_positions=200000) -> None:
+        """Memoizes polyglot keys by position.
+
+        The first plies of most games are the same few positions, and
+        hashing a board from scratch is the slowest part of reading a game.
+        """
+        self.max_positions = max_positions
+        self._keys = {}
+
+    def get(self, board):
+        position = (board.pawns, board.knights, board.bishops, board.rooks,
+                    board.queens, board.kings, board.occupied_co[chess.WHITE],
+                    board.occupied_co[chess.BLACK], board.turn,
+                    board.castling_rights, board.ep_square)
+        key = self._keys.get(position)
+        if key is None:
+            if len(self._keys) >= self.max_positions:
+                self._keys.clear()
+            key = self._keys[position] = chess.polyglot.zobrist_hash(board)
+        return key
+
+
+class BookVisitor(chess.pgn.BaseVisitor):
+    def __init__(self, max_ply, color=None, zobrist_cache=None) -> None:
+        """Collects the (zobrist key, polyglot move, side) of the first plies.
+
+        Variations are skipped, and moves after max_ply are not parsed.
+
+        Args:
+          max_ply: number of plies to read from the start of the game
+          color: chess.WHITE or chess.BLACK to keep only the moves of one
+            side, None for both
+          zobrist_cache: ZobristCache shared by the games of a worker
+        """
+        self.max_ply = max_ply
+        self.color = color
+        self.zobrist_cache = zobrist_cache or ZobristCache()
+
+    def begin_game(self):
+        self.result_tag = '*'
+        self.moves = []
+        self.is_skip = False
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == 'Result':
+            self.result_tag = tagvalue
+        elif tagname == 'Variant' and tagvalue.lower() not in ('', 'standard', 'chess'):
+            self.is_skip = True
+
+    def end_headers(self):
+        return chess.pgn.SKIP if self.is_skip else None
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def begin_parse_san(self, board, san):
+        if board.ply() >= self.max_ply:
+            return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if self.color is None or board.turn == self.color:
+            self.moves.append((self.zobrist_cache.get(board),
+                               polyglot_move(board, move), board.turn))
+
+    def handle_error(self, error):
+        # Keep the moves before the error, ignore the rest of the game
+        self.max_ply = 0
+
+    def result(self):
+        if self.is_skip:
+            return None, []
+        return self.result_tag, self.moves
+
+
+def result_points(result_tag, turn, options):
+    """Returns the points of a move of the side turn in a game result."""
+    if result_tag == '1-0':
+        return options.win if turn == chess.WHITE else options.loss
+    if result_tag == '0-1':
+        return options.win if turn == chess.BLACK else options.loss
+    # Draws and unfinished games
+    return options.draw
+
+
+def write_shard(counts, shard_dir):
+    """Writes the counts sorted by key and move, returns the shard filename."""
+    return write_records(((key, move, games, points) for (key, move), (games, points)
+                          in sorted(counts.items())), shard_dir)
+
+
+def write_records(records, shard_dir):
+    """Writes (key, move, games, points) records in order, returns the shard filename."""
+    fd, shard_file = tempfile.mkstemp(suffix='.shard', dir=shard_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for record in records:
+            f.write(SHARD_STRUCT.pack(*record))
+
+    return shard_file
+
+
+def read_shard(shard_file, records_per_read=4096):
+    """Yields (key, move, games, points) of a shard file in order."""
+    size = SHARD_STRUCT.size * records_per_read
+    with open(shard_file, 'rb') as f:
+        for data in iter(lambda: f.read(size), b''):
+            yield from SHARD_STRUCT.iter_unpack(data)
+
+
+def count_chunk(task):
+    """Counts the book moves of a pgn chunk in a worker process.
+
+    Args:
+      task: (pgn_file, start, end, options)
+
+    Returns:
+      A ChunkResult, the counts are in its shard files.
+    """
+    pgn_file, start, end, options = task
+    color = {'white': chess.WHITE, 'black': chess.BLACK}.get(options.color)
+    games = skipped = moves = 0
+    counts = {}
+    shards = []
+    zobrist_cache = ZobristCache()
+
+    for game in pgn_tools.iter_chunk_games(
+            pgn_file, start, end,
+            lambda: BookVisitor(options.max_ply, color, zobrist_cache)):
+        result_tag, game_moves = game
+        if result_tag is None:
+            skipped += 1
+            continue
+        games += 1
+        moves += len(game_moves)
+        for key, move, turn in game_moves:
+            points = result_points(result_tag, turn, options)
+            value = counts.get((key, move))
+            if value is None:
+                counts[(key, move)] = (1, points)
+            else:
+                counts[(key, move)] = (value[0] + 1, value[1] + points)
+
+        if len(counts) >= options.max_entries:
+            shards.append(write_shard(counts, options.shard_dir))
+            counts.clear()
+
+    if counts:
+        shards.append(write_shard(counts, options.shard_dir))
+
+    return ChunkResult(games, skipped, moves, shards)
+
+
+def merge_shards(shard_files, shard_dir=None):
+    """Yields (key, move, games, points) summed over all shards, in order.
+
+    With more than MAX_MERGE_FAN_IN shards, groups of them are first merged
+    into intermediate shards in shard_dir, until few enough are left. The
+    intermediate shards are removed once they are merged.
+    """
+    shard_files = list(shard_files)
+    intermediate = set()
+    while len(shard_files) > MAX_MERGE_FAN_IN:
+        merged = []
+        for i in range(0, len(shard_files), MAX_MERGE_FAN_IN):
+            group = shard_files[i:i + MAX_MERGE_FAN_IN]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged_file = write_records(sum_shards(group), shard_dir)
+            for shard_file in intermediate.intersection(group):
+                os.remove(shard_file)
+                intermediate.remove(shard_file)
+            intermediate.add(merged_file)
+            merged.append(merged_file)
+        shard_files = merged
+
+    try:
+        yield from sum_shards(shard_files)
+    finally:
+        for shard_file in intermediate:
+            os.remove(shard_file)
+
+
+def sum_shards(shard_files):
+    """Yields the records of the shards summed by key and move, all shards open at once."""
+    records = heapq.merge(*(read_shard(f) for f in shard_files))
+    for (key, move), group in groupby(records, key=lambda r: r[:2]):
+        games = points = 0
+        for _, _, g, p in group:
+            games += g
+            points += p
+        yield key, move, games, points
+
+
+def write_book(shard_files, book_file, min_count=1, shard_dir=None):
+    """Merges the shards into a polyglot book, returns the number of entries.
+
+    The points of a position are scaled down if one of its moves has more
+    than polyglot's 16 bit weight. The book is written to a temp file first
+    so a gui reading the old book never sees a partial file. Intermediate
+    shards of the merge are written to shard_dir.
+    """
+    book_dir = os.path.dirname(os.path.abspath(book_file))
+    fd, tmp_file = tempfile.mkstemp(suffix='.bin', dir=book_dir)
+    n = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            merged = merge_shards(shard_files, shard_dir)
+            for key, group in groupby(merged, key=lambda r: r[0]):
+                entries = [(points, move) for _, move, games, points in group
+                           if games >= min_count and points > 0]
+                if not entries:
+                    continue
+                max_points = max(points for points, _ in entries)
+                scale = min(1.0, MAX_WEIGHT / max_points)
+                for points, move in sorted(entries, reverse=True):
+                    weight = max(1, int(points * scale))
+                    f.write(ENTRY_STRUCT.pack(key, move, weight, 0))
+                    n += 1
+        os.replace(tmp_file, book_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+    return n
+
+
+def build_book(pgn_files, book_file, options, min_count=1, workers=None,
+               chunk_size=pgn_tools.DEFAULT_CHUNK_SIZE):
+    """Builds a polyglot book from pgn files.
+
+    Args:
+      pgn_files: list of pgn filenames
+      book_file: output .bin filename
+      options: BuildOptions, shard_dir is set by this function
+      min_count: minimum number of games of a move
+      workers: number of processes, default is the number of cpus
+      chunk_size: approximate size in bytes of the pgn chunk of a task
+
+    Returns:
+      (games, entries) read and written
+    """
+    start_time = time.perf_counter()
+    book_dir = os.path.dirname(os.path.abspath(book_file))
+    os.makedirs(book_dir, exist_ok=True)
+    shard_dir = tempfile.mkdtemp(prefix='pecg_book_', dir=book_dir)
+    options = options._replace(shard_dir=shard_dir)
+    tasks = [(pgn_file, start, end, options)
+             for pgn_file in pgn_files
+             for start, end in pgn_tools.split_pgn_chunks(pgn_file, chunk_size)]
+    total_bytes = sum(end - start for _, start, end, _ in tasks)
+
+    games = skipped = moves = done_bytes = 0
+    shards = []
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for task, result in zip(tasks, pool.imap(count_chunk, tasks)):
+                games += result.games
+                skipped += result.skipped
+                moves += result.moves
+                shards.extend(result.shards)
+                done_bytes += task[2] - task[1]
+                elapsed = time.perf_counter() - start_time
+                print('{:5.1f}% {} games, {:.0f} games/s'.format(
+                    100 * done_bytes / max(1, total_bytes), games,
+                    games / max(elapsed, 1e-9)), flush=True)
+
+        count_time = time.perf_counter() - start_time
+        entries = write_book(shards, book_file, min_count, shard_dir)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(f'{games} games ({skipped} skipped), {moves} moves, {len(shards)} shards')
+    print('{} entries written to {}'.format(entries, book_file))
+    print('{:.1f}s, {:.0f} games/s ({:.1f}s counting, {:.1f}s merging)'.format(
+        elapsed, games / max(elapsed, 1e-9), count_time, elapsed - count_time))
+
+    return games, entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a polyglot book from pgn files.')
+    parser.add_argument('pgn_files', nargs='+', help='pgn files to read')
+    parser.add_argument('-o', '--output', default='Book/pecg_book.bin',
+                        help='polyglot book to write')
+    parser.add_argument('--max-ply', type=int, default=24,
+                        help='number of plies read from the start of each game')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='minimum number of games of a move')
+    parser.add_argument('--color', choices=['both', 'white', 'black'], default='both',
+                        help='keep only the moves of one side, e.g. for a repertoire book')
+    parser.add_argument('--win', type=int, default=2, help='points of a move in a won game')
+    parser.add_argument('--draw', type=int, default=1,
+                        help='points of a move in a drawn or unfinished game')
+    parser.add_argument('--loss', type=int, default=0, help='points of a move in a lost game')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, default is the number of cpus')
+    parser.add_argument('--chunk-mb', type=float, default=32,
+                        help='size of the pgn chunk of a task in MB')
+    parser.add_argument('--max-entries', type=int, default=1000000,
+                        help='positions a worker counts in memory before it writes a shard')
+    args = parser.parse_args(argv)
+
+    for pgn_file in args.pgn_files:
+        if not os.path.isfile(pgn_file):
+            parser.error(f'{pgn_file} is missing.')
+    if args.win < 0 or args.draw < 0 or args.loss < 0:
+        parser.error('Points can not be negative.')
+
+    options = BuildOptions(args.max_ply, args.color, args.win, args.draw,
+                           args.loss, args.max_entries, None)
+    build_book(args.pgn_files, args.output, options, args.min_count,
+               args.workers, int(args.chunk_mb * 1024 * 1024))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,644 @@
+"""
+game_store.py
+
+SQLite store of the saved games, pecg_games.sqlite3. Every game keeps its
+full pgn text with its players, date, result, time controls and difficulty
+in indexed columns, so the games of a player or a level are found without
+reading a pgn file. The collection column tells where the game was saved:
+auto_save, my_games, white_repertoire or black_repertoire.
+
+The pgn files of the gui are still written and are a mirror of the store.
+They are imported once, in batches of games per transaction. An import
+that was interrupted goes on from the last committed batch. The gui records
+where the import of every file ends with begin_import() before it can save
+a game, so games it appends while the files are imported are not imported
+twice.
+
+The position table maps the zobrist key of every position of the main line
+of a game to (game id, ply), so the games that reached a position are found
+with one index lookup. Games saved by the gui are indexed in the same
+transaction, imported games by index_positions() with a pool of processes.
+
+Example:
+    python game_store.py import pecg_my_games.pgn --collection my_games
+    python game_store.py find --player Human --difficulty hard
+    python game_store.py export hard_games.pgn --difficulty hard
+    python game_store.py index
+    python game_store.py position "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2"
+"""
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+import pgn_tools
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_FILE = 'pecg_games.sqlite3'
+COLLECTIONS = ('auto_save', 'my_games', 'white_repertoire', 'black_repertoire')
+IMPORT_BATCH_SIZE = 1000
+INDEX_CHUNK_GAMES = 2000
+
+GameRow = namedtuple('GameRow', [
+    'id', 'collection', 'white', 'black', 'result', 'date', 'event',
+    'white_time_control', 'black_time_control', 'difficulty'])
+
+GAME_COLUMNS = ', '.join(GameRow._fields)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS game ('
+    'id INTEGER PRIMARY KEY, collection TEXT, white TEXT, black TEXT, '
+    'result TEXT, date TEXT, event TEXT, white_time_control TEXT, '
+    'black_time_control TEXT, difficulty TEXT, pgn TEXT, created REAL)',
+    'CREATE INDEX IF NOT EXISTS game_white ON game (white, date)',
+    'CREATE INDEX IF NOT EXISTS game_black ON game (black, date)',
+    'CREATE INDEX IF NOT EXISTS game_date ON game (date)',
+    'CREATE INDEX IF NOT EXISTS game_result ON game (result)',
+    'CREATE INDEX IF NOT EXISTS game_white_time_control ON game (white_time_control)',
+    'CREATE INDEX IF NOT EXISTS game_black_time_control ON game (black_time_control)',
+    'CREATE INDEX IF NOT EXISTS game_difficulty ON game (difficulty)',
+    'CREATE INDEX IF NOT EXISTS game_collection ON game (collection)',
+    # Bytes of a pgn file imported so far, and where its import ends
+    'CREATE TABLE IF NOT EXISTS pgn_import ('
+    'pgn_file TEXT PRIMARY KEY, collection TEXT, offset INTEGER, '
+    'end INTEGER, crc INTEGER)',
+    # Key is the zobrist key as a signed 64 bit integer, rows of a key are
+    # stored together in game order
+    'CREATE TABLE IF NOT EXISTS position ('
+    'key INTEGER, game_id INTEGER, ply INTEGER, '
+    'PRIMARY KEY (key, game_id, ply)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS position_game ('
+    'game_id INTEGER PRIMARY KEY, plies INTEGER)',
+]
+
+
+def sql_key(key):
+    """Returns a zobrist key as the signed integer that SQLite stores."""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class ZobristUpdater:
+    def __init__(self) -> None:
+        """Polyglot keys of the consecutive positions of a game.
+
+        Only the pieces of the squares that changed since the previous
+        position are hashed, hashing every piece of every position is
+        slower than parsing the game. The keys are the same as the ones of
+        chess.polyglot.zobrist_hash.
+        """
+        self.hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+        self._bitboards = (0,) * 7
+        self._pieces_key = 0
+
+    def _pieces(self, bitboards, mask):
+        key = 0
+        array = self.hasher.array
+        white = bitboards[6]
+        for i, bb in enumerate(bitboards[:6]):
+            for square in chess.scan_reversed(bb & mask):
+                pivot = 1 if white & chess.BB_SQUARES[square] else 0
+                key ^= array[64 * (i * 2 + pivot) + square]
+        return key
+
+    def get(self, board):
+        """Returns the key of board, the position after the previous one."""
+        bitboards = (board.pawns, board.knights, board.bishops, board.rooks,
+                     board.queens, board.kings, board.occupied_co[chess.WHITE])
+        mask = 0
+        for old, new in zip(self._bitboards, bitboards):
+            mask |= old ^ new
+        self._pieces_key ^= (self._pieces(self._bitboards, mask) ^
+                             self._pieces(bitboards, mask))
+        self._bitboards = bitboards
+
+        return (self._pieces_key ^ self.hasher.hash_castling(board) ^
+                self.hasher.hash_ep_square(board) ^ self.hasher.hash_turn(board))
+
+
+class PositionVisitor(chess.pgn.BaseVisitor):
+    """Collects the zobrist keys of the main line positions of a game.
+
+    The first key is the start position, the key at index n is the position
+    after n plies. Variations are skipped, and an illegal move ends the game.
+    """
+
+    def begin_game(self):
+        self.keys = []
+        self.is_error = False
+        self.zobrist = ZobristUpdater()
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_board(self, board):
+        if not self.is_error:
+            self.keys.append(self.zobrist.get(board))
+
+    def handle_error(self, error):
+        self.is_error = True
+
+    def result(self):
+        return self.keys
+
+
+def game_keys(game) -> list:
+    """Returns the zobrist keys of the main line positions of a game."""
+    zobrist = ZobristUpdater()
+    board = game.board()
+    keys = [zobrist.get(board)]
+    for move in game.mainline_moves():
+        board.push(move)
+        keys.append(zobrist.get(board))
+    return keys
+
+
+def index_chunk(task):
+    """Reads the position keys of the games of an id range, in a worker process.
+
+    Args:
+      task: (db_file, first_id, last_id)
+
+    Returns:
+      A list of (game id, keys) of the games not indexed yet.
+    """
+    db_file, first_id, last_id = task
+    game_keys_list = []
+    db = sqlite3.connect(db_file)
+    try:
+        for game_id, pgn_text in db.execute(
+                'SELECT id, pgn FROM game WHERE id BETWEEN ? AND ? AND id NOT IN '
+                '(SELECT game_id FROM position_game) ORDER BY id', (first_id, last_id)):
+            keys = chess.pgn.read_game(io.StringIO(pgn_text), Visitor=PositionVisitor)
+            game_keys_list.append((game_id, keys or []))
+    finally:
+        db.close()
+
+    return game_keys_list
+
+
+def game_values(headers, pgn_text, collection, created):
+    """Returns the values of a game row, in the order of the game table."""
+    time_control = headers.get('TimeControl')
+    return (collection, headers.get('White', '?'), headers.get('Black', '?'),
+            headers.get('Result', '*'), headers.get('Date', '????.??.??'),
+            headers.get('Event', '?'),
+            headers.get('WhiteTimeControl', time_control),
+            headers.get('BlackTimeControl', time_control),
+            headers.get('Difficulty'), pgn_text, created)
+
+
+class GameStore:
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, db_file=DEFAULT_DB_FILE) -> None:
+        """Games of all collections in an SQLite file.
+
+        Args:
+          db_file: SQLite filename, it is created if missing
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+    @classmethod
+    def for_file(cls, db_file=DEFAULT_DB_FILE):
+        """Returns the store of an SQLite file, one per path."""
+        key = os.path.abspath(db_file)
+        with cls._stores_lock:
+            if key not in cls._stores:
+                cls._stores[key] = cls(db_file)
+            return cls._stores[key]
+
+    def _insert_positions(self, game_keys_list) -> None:
+        """Inserts the positions of games in the current transaction.
+
+        Args:
+          game_keys_list: list of (game id, keys)
+        """
+        rows = sorted((sql_key(key), game_id, ply)
+                      for game_id, keys in game_keys_list
+                      for ply, key in enumerate(keys))
+        self._db.executemany('INSERT OR IGNORE INTO position VALUES (?, ?, ?)', rows)
+        self._db.executemany(
+            'INSERT OR IGNORE INTO position_game VALUES (?, ?)',
+            [(game_id, max(0, len(keys) - 1)) for game_id, keys in game_keys_list])
+
+    def _insert(self, values_list) -> list:
+        """Inserts game rows in the current transaction, returns their ids."""
+        ids = []
+        for values in values_list:
+            cursor = self._db.execute(
+                'INSERT INTO game (collection, white, black, result, date, event, '
+                'white_time_control, black_time_control, difficulty, pgn, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values)
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def add_games(self, games, collection) -> list:
+        """Saves games and their positions in one transaction.
+
+        None of the games is saved if one fails.
+
+        Args:
+          games: list of chess.pgn.Game
+          collection: one of COLLECTIONS
+
+        Returns:
+          The ids of the games.
+        """
+        now = time.time()
+        values_list = [game_values(game.headers, str(game), collection, now)
+                       for game in games]
+        keys_list = [game_keys(game) for game in games]
+        with self._lock, self._db:
+            ids = self._insert(values_list)
+            self._insert_positions(list(zip(ids, keys_list)))
+        return ids
+
+    def add_game(self, game, collection) -> int:
+        """Saves a game, returns its id."""
+        return self.add_games([game], collection)[0]
+
+    def is_imported(self, pgn_file) -> bool:
+        """Whether the import of a pgn file was started and has ended."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT offset, end FROM pgn_import WHERE pgn_file = ?',
+                (os.path.abspath(pgn_file),)).fetchone()
+        return row is not None and row[0] >= row[1]
+
+    def begin_import(self, pgn_file, collection) -> None:
+        """Records the current size of a pgn file as the end of its import.
+
+        Games appended to the file later are not imported, the gui saves
+        them in the store itself. A missing file ends at 0, the gui creates
+        it with the first game it saves. Nothing changes if the import of
+        the file was already begun.
+
+        Args:
+          pgn_file: pgn filename
+          collection: one of COLLECTIONS
+        """
+        try:
+            end = os.path.getsize(pgn_file)
+        except FileNotFoundError:
+            end = 0
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR IGNORE INTO pgn_import VALUES (?, ?, 0, ?, 0)',
+                (os.path.abspath(pgn_file), collection, end))
+
+    def import_pgn(self, pgn_file, collection, batch_size=IMPORT_BATCH_SIZE,
+                   progress=None, cancel_event=None):
+        """Imports the games of a pgn file, or the rest of an interrupted import.
+
+        The import ends at the size recorded by begin_import(), or at the
+        size the file has when the import is started. Games appended later
+        are the ones the gui has already saved in the store. Each batch of
+        games is committed with the offset it ends at.
+
+        Args:
+          pgn_file: pgn filename
+          collection: one of COLLECTIONS
+          batch_size: number of games per transaction
+          progress: callable(done_bytes, total_bytes) called per batch
+          cancel_event: threading.Event that stops the import after a batch
+
+        Returns:
+          The number of games imported, None if cancelled.
+        """
+        key = os.path.abspath(pgn_file)
+        games = 0
+        # The crc of a batch is read with its own handle, iter_raw_games
+        # has already read the first line of the next game from f
+        with open(pgn_file, 'rb') as f, open(pgn_file, 'rb') as crc_f:
+            with self._lock:
+                row = self._db.execute(
+                    'SELECT offset, end, crc FROM pgn_import WHERE pgn_file = ?',
+                    (key,)).fetchone()
+            if row is None:
+                offset, end = 0, os.fstat(f.fileno()).st_size
+            else:
+                offset, end, crc = row
+                if offset >= end:
+                    return 0
+                if pgn_tools.tail_crc(f, offset) != crc:
+                    logger.warning(f'{pgn_file} was changed during its import, '
+                                   f'games after byte {offset} are not imported.')
+                    return 0
+
+            f.seek(offset)
+            batch = []
+            batch_end = offset
+            now = time.time()
+            for headers, raw in pgn_tools.iter_raw_games(f, end - offset):
+                batch_end += len(raw)
+                # Skip trailing empty lines and comments
+                if headers:
+                    pgn_text = raw.decode(pgn_tools.ENCODING, errors='replace').strip()
+                    batch.append(game_values(headers, pgn_text, collection, now))
+                if len(batch) < batch_size and batch_end < end:
+                    continue
+
+                crc = pgn_tools.tail_crc(crc_f, batch_end)
+                with self._lock, self._db:
+                    self._insert(batch)
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO pgn_import VALUES (?, ?, ?, ?, ?)',
+                        (key, collection, batch_end, end, crc))
+                games += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(batch_end, end)
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info(f'Import of {pgn_file} is cancelled.')
+                    return None
+
+            if batch_end < end or row is None and end == 0:
+                # Nothing left to read, e.g. an empty file
+                with self._lock, self._db:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO pgn_import VALUES (?, ?, ?, ?, ?)',
+                        (key, collection, end, end, pgn_tools.tail_crc(crc_f, end)))
+
+        logger.info(f'{games} games of {pgn_file} imported to {self.db_file}.')
+        return games
+
+    @staticmethod
+    def _where(player=None, white=None, black=None, result=None,
+               date_from=None, date_to=None, time_control=None,
+               difficulty=None, collection=None):
+        """Returns the WHERE clause and parameters of the filters that are set.
+
+        Dates are pgn dates, e.g. 2025.12.09, they sort as text.
+        """
+        conditions, params = [], []
+        if player is not None:
+            conditions.append('(white = ? OR black = ?)')
+            params += [player, player]
+        if time_control is not None:
+            conditions.append('(white_time_control = ? OR black_time_control = ?)')
+            params += [time_control, time_control]
+        for column, op, value in [('white', '=', white), ('black', '=', black),
+                                  ('result', '=', result), ('date', '>=', date_from),
+                                  ('date', '<=', date_to),
+                                  ('difficulty', '=', difficulty),
+                                  ('collection', '=', collection)]:
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                params.append(value)
+        if not conditions:
+            return '', params
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    def find_games(self, limit=1000, **filters) -> list:
+        """Returns the GameRow of the games that match all filters.
+
+        Args:
+          limit: maximum number of games, the latest are returned
+          filters: player, white, black, result, date_from, date_to,
+            time_control, difficulty and collection, see _where()
+        """
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT {GAME_COLUMNS} FROM game{where} ORDER BY id DESC LIMIT ?',
+                params + [limit]).fetchall()
+        return [GameRow(*row) for row in rows]
+
+    def count(self, **filters) -> int:
+        """Number of games that match all filters."""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._db.execute(f'SELECT COUNT(*) FROM game{where}', params).fetchone()[0]
+
+    def get_pgn(self, game_id):
+        """Returns the pgn text of a game, None if there is no such game."""
+        with self._lock:
+            row = self._db.execute('SELECT pgn FROM game WHERE id = ?', (game_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def read_game(self, game_id):
+        """Returns a game as chess.pgn.Game, None if there is no such game."""
+        pgn_text = self.get_pgn(game_id)
+        if pgn_text is None:
+            return None
+        return chess.pgn.read_game(io.StringIO(pgn_text))
+
+    def export_pgn(self, pgn_file, **filters) -> int:
+        """Writes the games that match all filters to a pgn file, oldest first.
+
+        The games are read with their own connection, so saves are not
+        blocked by a long export. The file is written to a temp file first
+        and then replaces pgn_file.
+
+        Returns:
+          The number of games written.
+        """
+        where, params = self._where(**filters)
+        pgn_dir = os.path.dirname(os.path.abspath(pgn_file))
+        fd, tmp_file = tempfile.mkstemp(suffix='.pgn', dir=pgn_dir)
+        n = 0
+        db = sqlite3.connect(self.db_file)
+        try:
+            with os.fdopen(fd, 'w', encoding=pgn_tools.ENCODING) as f:
+                for (pgn_text,) in db.execute(
+                        f'SELECT pgn FROM game{where} ORDER BY id', params):
+                    f.write('{}\n\n'.format(pgn_text))
+                    n += 1
+            os.replace(tmp_file, pgn_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+        finally:
+            db.close()
+
+        return n
+
+    def index_positions(self, workers=None, chunk_games=INDEX_CHUNK_GAMES,
+                        progress=None, cancel_event=None):
+        """Indexes the positions of the games that are not indexed yet.
+
+        More than two chunks of games are read by a process pool, every
+        chunk is committed when its keys are back.
+
+        Args:
+          workers: number of processes, default is the number of cpus, 1
+            reads the games in this process
+          chunk_games: number of games of a task
+          progress: callable(done_games, total_games) called per chunk
+          cancel_event: threading.Event that stops indexing after a chunk
+
+        Returns:
+          The number of games indexed, None if cancelled.
+        """
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(
+                'SELECT id FROM game WHERE id NOT IN '
+                '(SELECT game_id FROM position_game) ORDER BY id')]
+        if not ids:
+            return 0
+
+        tasks = [(self.db_file, chunk[0], chunk[-1])
+                 for chunk in (ids[i:i + chunk_games]
+                               for i in range(0, len(ids), chunk_games))]
+        workers = workers or os.cpu_count() or 1
+        games = 0
+
+        def commit(game_keys_list):
+            nonlocal games
+            with self._lock, self._db:
+                self._insert_positions(game_keys_list)
+            games += len(game_keys_list)
+            if progress is not None:
+                progress(games, len(ids))
+            return cancel_event is not None and cancel_event.is_set()
+
+        if len(tasks) <= 2 or workers == 1:
+            for task in tasks:
+                if commit(index_chunk(task)):
+                    return None
+        else:
+            # Spawn, the gui process has threads that fork does not copy
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                for game_keys_list in pool.imap(index_chunk, tasks):
+                    if commit(game_keys_list):
+                        logger.info(f'Indexing positions of {self.db_file} is cancelled.')
+                        return None
+
+        logger.info(f'Positions of {games} games added to {self.db_file}.')
+        return games
+
+    def find_position(self, board, limit=100, **filters) -> list:
+        """Returns the games that reached the position of board.
+
+        Args:
+          board: chess.Board
+          limit: maximum number of games, the latest are returned
+          filters: filters of find_games()
+
+        Returns:
+          A list of (GameRow, ply), ply is the first ply of the game in the
+          position.
+        """
+        where, params = self._where(**filters)
+        where = where.replace(' WHERE ', ' AND ', 1)
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT {GAME_COLUMNS}, MIN(ply) FROM position '
+                f'JOIN game ON game.id = position.game_id '
+                f'WHERE key = ?{where} GROUP BY game_id ORDER BY game_id DESC LIMIT ?',
+                [sql_key(chess.polyglot.zobrist_hash(board))] + params + [limit]).fetchall()
+        return [(GameRow(*row[:-1]), row[-1]) for row in rows]
+
+    def close(self) -> None:
+        """Closes the SQLite file."""
+        with self._lock:
+            self._db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import, find and export saved games.')
+    parser.add_argument('--db', default=DEFAULT_DB_FILE, help='SQLite file of the games')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='import pgn files')
+    import_parser.add_argument('pgn_files', nargs='+')
+    import_parser.add_argument('--collection', choices=COLLECTIONS, default='my_games')
+
+    index_parser = commands.add_parser('index', help='index the positions of the games')
+    index_parser.add_argument('--workers', type=int, default=None,
+                              help='number of processes, default is the number of cpus')
+
+    filter_parsers = [commands.add_parser('find', help='list games'),
+                      commands.add_parser('export', help='write games to a pgn file'),
+                      commands.add_parser('position', help='list games that reached a position')]
+    filter_parsers[1].add_argument('pgn_file')
+    filter_parsers[2].add_argument('fen')
+    for p in filter_parsers:
+        p.add_argument('--player')
+        p.add_argument('--white')
+        p.add_argument('--black')
+        p.add_argument('--result', choices=['1-0', '0-1', '1/2-1/2', '*'])
+        p.add_argument('--date-from', help='pgn date, e.g. 2025.01.01')
+        p.add_argument('--date-to', help='pgn date, e.g. 2025.12.31')
+        p.add_argument('--time-control', help='e.g. 300+10')
+        p.add_argument('--difficulty', choices=['easy', 'medium', 'hard'])
+        p.add_argument('--collection', choices=COLLECTIONS)
+    for p in (filter_parsers[0], filter_parsers[2]):
+        p.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    store = GameStore(args.db)
+    if args.command == 'import':
+        for pgn_file in args.pgn_files:
+            if not os.path.isfile(pgn_file):
+                parser.error(f'{pgn_file} is missing.')
+        for pgn_file in args.pgn_files:
+            if store.is_imported(pgn_file):
+                print(f'{pgn_file} is already imported.')
+                continue
+            t1 = time.perf_counter()
+            games = store.import_pgn(pgn_file, args.collection)
+            print('{} games imported from {} in {:.1f}s'.format(
+                games, pgn_file, time.perf_counter() - t1))
+    elif args.command == 'index':
+        t1 = time.perf_counter()
+        games = store.index_positions(
+            args.workers, progress=lambda done, total: print(
+                '{:5.1f}% {} games'.format(100 * done / total, done), flush=True))
+        elapsed = time.perf_counter() - t1
+        print('Positions of {} games indexed in {:.1f}s, {:.0f} games/s'.format(
+            games, elapsed, games / max(elapsed, 1e-9)))
+    else:
+        filters = {name: getattr(args, name) for name in [
+            'player', 'white', 'black', 'result', 'date_from', 'date_to',
+            'time_control', 'difficulty', 'collection']}
+        if args.command == 'find':
+            for row in store.find_games(args.limit, **filters):
+                print('{:>8} {} {} - {} {} {}'.format(
+                    row.id, row.date, row.white, row.black, row.result,
+                    row.difficulty or ''))
+            print('{} games'.format(store.count(**filters)))
+        elif args.command == 'position':
+            try:
+                board = chess.Board(args.fen)
+            except ValueError:
+                parser.error(f'{args.fen} is not a valid fen.')
+            t1 = time.perf_counter()
+            games = store.find_position(board, args.limit, **filters)
+            elapsed_ms = 1000 * (time.perf_counter() - t1)
+            for row, ply in games:
+                print('{:>8} {} {} - {} {} ply {}'.format(
+                    row.id, row.date, row.white, row.black, row.result, ply))
+            print('{} games in {:.1f}ms'.format(len(games), elapsed_ms))
+        else:
+            n = store.export_pgn(args.pgn_file, **filters)
+            print(f'{n} games written to {args.pgn_file}')
+    store.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""
+match_runner.py
+
+Plays engine vs engine matches without the GUI, e.g. to calibrate the
+easy/medium/hard search depths of play_game or to measure the effect of an
+engine option. Games run in parallel worker processes with the same
+RunEngine search and Timer time control as the GUI. Each opening comes from
+the polyglot book of the GUI and is played twice with colors reversed. Every
+game is saved to a pgn file and the match is reported as an Elo difference,
+an SPRT result and games per hour.
+
+Example, easy (depth 3) against medium (depth 8):
+    python match_runner.py --engine1 Stockfish --depth1 3 --depth2 8 --games 200
+"""
+
+import argparse
+import logging
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+# The GUI module logs to pecg_log.txt when it is imported. Configure logging
+# first so matches don't overwrite the log of a running GUI.
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s :: %(processName)s :: %(levelname)s :: %(message)s'
+)
+
+import chess
+import chess.pgn
+
+import python_easy_chess_gui as pecg
+
+
+Player = namedtuple('Player', ['engine_id_name', 'max_depth'])
+MatchGame = namedtuple('MatchGame', [
+    'game_no', 'players', 'white_index', 'tc_type', 'base_ms', 'inc_ms',
+    'opening', 'seed', 'engine_config_file'])
+GameResult = namedtuple('GameResult', [
+    'game_no', 'score', 'result', 'termination', 'plies', 'seconds', 'pgn'])
+
+# Engine sessions of a worker process, kept from one game to the next
+_sessions = {}
+
+# Openings of the pairs whose book line is shorter than --book-ply
+FALLBACK_OPENINGS = [
+    'e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7',
+    'e4 e5 Nf3 Nc6 Bc4 Bc5 c3 Nf6 d3 d6',
+    'e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6',
+    'e4 c5 Nc3 Nc6 g3 g6 Bg2 Bg7 d3 d6',
+    'e4 e6 d4 d5 Nc3 Nf6 Bg5 Be7 e5 Nfd7',
+    'e4 c6 d4 d5 e5 Bf5 Nf3 e6 Be2 c5',
+    'd4 d5 c4 e6 Nc3 Nf6 Bg5 Be7 e3 O-O',
+    'd4 d5 c4 c6 Nf3 Nf6 Nc3 dxc4 a4 Bf5',
+    'd4 Nf6 c4 g6 Nc3 Bg7 e4 d6 Nf3 O-O',
+    'd4 Nf6 c4 e6 Nc3 Bb4 e3 O-O Bd3 d5',
+    'c4 e5 Nc3 Nf6 g3 d5 cxd5 Nxd5 Bg2 Nb6',
+    'Nf3 d5 g3 Nf6 Bg2 c6 O-O Bg4 d3 Nbd7',
+]
+
+
+def player_name(player):
+    if player.max_depth is None:
+        return player.engine_id_name
+    return f'{player.engine_id_name} d{player.max_depth}'
+
+
+def init_worker():
+    """Quit the engines of a worker when the pool shuts down."""
+    multiprocessing.util.Finalize(None, close_sessions, exitpriority=10)
+
+
+def close_sessions():
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def get_session(engine_config_file, engine_id_name, player_index):
+    """Returns the engine of a player in this worker.
+
+    Each player has its own process even if both play the same engine, so
+    they don't share the hash.
+    """
+    key = (engine_id_name, player_index)
+    if key not in _sessions:
+        config = pecg.EngineConfigRegistry.for_file(engine_config_file).get(engine_id_name)
+        if config is None:
+            raise ValueError(f'{engine_id_name} is not in {engine_config_file}.')
+        _sessions[key] = pecg.EngineSession(
+            engine_config_file, config.path_and_file, engine_id_name)
+    return _sessions[key]
+
+
+def pick_opening(book_file, book_ply, rng):
+    """Returns the uci moves of an opening and whether it is from the book.
+
+    Moves are picked by weight from the book up to book_ply. If the book has
+    no move before that, the opening is one of FALLBACK_OPENINGS.
+
+    Args:
+      book_file: polyglot book, None for the fixed openings only
+      book_ply: number of opening plies
+      rng: random.Random of the pair
+    """
+    board = chess.Board()
+    if book_file:
+        book_service = pecg.BookService.get()
+        while board.ply() < book_ply:
+            entries = book_service.find_all(book_file, board)
+            if not entries or not sum(e.weight for e in entries):
+                break
+            board.push(rng.choices(entries, weights=[e.weight for e in entries])[0].move)
+        else:
+            return tuple(move.uci() for move in board.move_stack), True
+
+    board = chess.Board()
+    for san in rng.choice(FALLBACK_OPENINGS).split()[:book_ply]:
+        board.push_san(san)
+    return tuple(move.uci() for move in board.move_stack), False
+
+
+def play_match_game(match_game):
+    """Plays one game, runs in a worker process.
+
+    Args:
+      match_game: MatchGame
+
+    Returns:
+      GameResult, score is from the point of view of the first player.
+    """
+    random.seed(match_game.seed)
+    start_time = time.perf_counter()
+    players = match_game.players
+    index_of = {chess.WHITE: match_game.white_index,
+                chess.BLACK: 1 - match_game.white_index}
+
+    board = chess.Board()
+    game = chess.pgn.Game()
+    game.headers['Event'] = 'PECG match'
+    game.headers['Date'] = datetime.today().strftime('%Y.%m.%d')
+    game.headers['Round'] = str(match_game.game_no)
+    game.headers['White'] = player_name(players[index_of[chess.WHITE]])
+    game.headers['Black'] = player_name(players[index_of[chess.BLACK]])
+    if match_game.tc_type == 'fischer':
+        # PGN writes seconds, 60+1 and not 60.0+1.0
+        game.headers['TimeControl'] = '{:g}+{:g}'.format(
+            match_game.base_ms / 1000, match_game.inc_ms / 1000)
+
+    timers = {
+        color: pecg.Timer(match_game.tc_type, match_game.base_ms, match_game.inc_ms)
+        for color in chess.COLORS
+    }
+
+    node = game
+    termination = None
+    while not board.is_game_over(claim_draw=True):
+        index = index_of[board.turn]
+        player = players[index]
+        timer = timers[board.turn]
+        move, comment = None, ''
+
+        if board.ply() < len(match_game.opening):
+            move = chess.Move.from_uci(match_game.opening[board.ply()])
+            comment = 'book'
+
+        if move is None:
+            session = get_session(match_game.engine_config_file,
+                                  player.engine_id_name, index)
+            search = pecg.RunEngine(
+                queue.Queue(), match_game.engine_config_file,
+                session.engine_path_and_file, player.engine_id_name,
+                pecg.MAX_DEPTH if player.max_depth is None else player.max_depth,
+                timer.base, timer.inc, tc_type=timer.tc_type,
+                period_moves=board.fullmove_number,
+                is_stream_search_info=False, session=session, game=game
+            )
+            search.is_move_delay = False
+            search.get_board(board)
+
+            timer.start()
+            search.start()
+            search.join()
+            timer.stop()
+
+            move = search.bm
+            if move is None or not board.is_legal(move):
+                termination = 'illegal move'
+                break
+            if timer.tc_type != 'timepermove' and timer.elapse > timer.base:
+                termination = 'time forfeit'
+                break
+            timer.update_base()
+
+            if search.score is not None:
+                comment = '{:+0.2f}/{}'.format(search.score, search.depth)
+
+        board.push(move)
+        node = node.add_variation(move)
+        node.comment = comment
+
+    if termination is None:
+        result = board.result(claim_draw=True)
+        termination = board.outcome(claim_draw=True).termination.name.lower()
+    else:
+        # Side to move lost
+        result = '0-1' if board.turn == chess.WHITE else '1-0'
+    game.headers['Result'] = result
+    game.headers['Termination'] = termination
+
+    score_white = {'1-0': 1.0, '0-1': 0.0}.get(result, 0.5)
+    score = score_white if match_game.white_index == 0 else 1.0 - score_white
+
+    return GameResult(match_game.game_no, score, result, termination,
+                      board.ply(), time.perf_counter() - start_time, str(game))
+
+
+def elo_from_score(score):
+    """Returns the Elo difference of an expected score."""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return 400 * math.log10(score / (1 - score))
+
+
+def score_stats(wins, draws, losses):
+    """Returns the score rate and its variance per game."""
+    n = wins + draws + losses
+    score = (wins + draws / 2) / n
+    var = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 +
+           losses * score ** 2) / n
+    return score, var
+
+
+def elo_estimate(wins, draws, losses):
+    """Returns the Elo difference and its 95% error margin."""
+    n = wins + draws + losses
+    if n == 0:
+        return 0.0, math.inf
+
+    score, var = score_stats(wins, draws, losses)
+    margin = 1.959964 * math.sqrt(var / n)
+    elo = elo_from_score(score)
+    return elo, (elo_from_score(score + margin) - elo_from_score(score - margin)) / 2
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """Log likelihood ratio of H1: elo1 against H0: elo0.
+
+    Uses the normal approximation of the trinomial GSPRT.
+    """
+    n = wins + draws + losses
+    if n == 0:
+        return 0.0
+
+    score, var = score_stats(wins, draws, losses)
+    if var == 0:
+        return 0.0
+
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return n * (s1 - s0) * (2 * score - s0 - s1) / (2 * var)
+
+
+def sprt_bounds(alpha, beta):
+    """Returns the lower and upper LLR bounds."""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def parse_tc(tc):
+    """Returns base and increment in ms of a 'base+inc' time control in seconds."""
+    base, _, inc = tc.partition('+')
+    return int(float(base) * 1000), int(float(inc or 0) * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless engine vs engine matches.')
+    parser.add_argument('--engine-config', default='pecg_engines.json',
+                        help='engine config file of the GUI')
+    parser.add_argument('--engine1', required=True, help='engine id name of player 1')
+    parser.add_argument('--engine2', help='engine id name of player 2, default is engine1')
+    parser.add_argument('--depth1', type=int, help='max depth of player 1')
+    parser.add_argument('--depth2', type=int, help='max depth of player 2')
+    parser.add_argument('--tc', default='60+1',
+                        help='fischer time control, base+inc in seconds')
+    parser.add_argument('--movetime', type=float,
+                        help='seconds per move, replaces --tc')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--concurrency', type=int,
+                        default=max(1, (os.cpu_count() or 2) // 2),
+                        help='games played at the same time')
+    parser.add_argument('--book', default='Book/pecg_book.bin',
+                        help='polyglot book for openings, empty for none')
+    parser.add_argument('--book-ply', type=int, default=8)
+    parser.add_argument('--pgn', default='pecg_match_games.pgn',
+                        help='games are appended to this file')
+    parser.add_argument('--seed', type=int, help='seed of the openings')
+    parser.add_argument('--sprt', action='store_true',
+                        help='stop when the SPRT of elo0 against elo1 ends')
+    parser.add_argument('--elo0', type=float, default=0.0)
+    parser.add_argument('--elo1', type=float, default=10.0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    registry = pecg.EngineConfigRegistry.for_file(args.engine_config)
+    engine2 = args.engine2 or args.engine1
+    for name in (args.engine1, engine2):
+        if not registry.exists(name):
+            parser.error(f'{name} is not in {args.engine_config}.')
+
+    if args.movetime is not None:
+        tc_type, base_ms, inc_ms = 'timepermove', int(args.movetime * 1000), 0
+    else:
+        tc_type = 'fischer'
+        base_ms, inc_ms = parse_tc(args.tc)
+
+    book_file = args.book if args.book and os.path.isfile(args.book) else None
+    if args.book and book_file is None:
+        logging.warning(f'Book {args.book} is missing, games use fixed openings.')
+
+    players = (Player(args.engine1, args.depth1), Player(engine2, args.depth2))
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+
+    # Each opening is played twice with colors reversed
+    openings = []
+    n_fallback = 0
+    for pair in range((args.games + 1) // 2):
+        if args.book:
+            opening, is_book = pick_opening(book_file, args.book_ply,
+                                            random.Random(seed + pair))
+            n_fallback += not is_book
+        else:
+            opening = ()
+        openings.append(opening)
+    if book_file and n_fallback:
+        logging.warning(f'Book {book_file} has less than {args.book_ply} plies '
+                        f'for {n_fallback} of {len(openings)} openings, '
+                        f'these use fixed openings.')
+
+    match_games = [
+        MatchGame(i + 1, players, i % 2, tc_type, base_ms, inc_ms,
+                  openings[i // 2], seed + i // 2, args.engine_config)
+        for i in range(args.games)
+    ]
+
+    name1, name2 = player_name(players[0]), player_name(players[1])
+    print(f'{name1} vs {name2}, {args.games} games, {args.concurrency} at a time')
+
+    lower, upper = sprt_bounds(args.alpha, args.beta)
+    wins = draws = losses = 0
+    sprt_result = None
+    start_time = time.perf_counter()
+
+    is_done = False
+    pool = multiprocessing.Pool(args.concurrency, initializer=init_worker)
+    try:
+        with open(args.pgn, 'a') as pgn:
+            for r in pool.imap_unordered(play_match_game, match_games):
+                if r.score == 1.0:
+                    wins += 1
+                elif r.score == 0.0:
+                    losses += 1
+                else:
+                    draws += 1
+                n = wins + draws + losses
+
+                pgn.write(r.pgn + '\n\n')
+                pgn.flush()
+
+                elo, margin = elo_estimate(wins, draws, losses)
+                line = '{:>4}/{}: game {} {} ({}, {} plies)  +{} ={} -{}  Elo {:+.1f} +/- {:.1f}'.format(
+                    n, args.games, r.game_no, r.result, r.termination, r.plies,
+                    wins, draws, losses, elo, margin)
+
+                if args.sprt:
+                    llr = sprt_llr(wins, draws, losses, args.elo0, args.elo1)
+                    line += '  LLR {:.2f} ({:.2f}, {:.2f})'.format(llr, lower, upper)
+                    if llr >= upper:
+                        sprt_result = 'H1 accepted'
+                    elif llr <= lower:
+                        sprt_result = 'H0 accepted'
+                print(line, flush=True)
+
+                if sprt_result is not None:
+                    break
+            else:
+                # All games are played, let the workers quit their engines
+                pool.close()
+                is_done = True
+    except KeyboardInterrupt:
+        print('Match is interrupted.')
+    finally:
+        if not is_done:
+            pool.terminate()
+        pool.join()
+
+    n = wins + draws + losses
+    if n == 0:
+        print('No games finished.')
+        return 1
+
+    elapsed = time.perf_counter() - start_time
+    elo, margin = elo_estimate(wins, draws, losses)
+    print()
+    print(f'{name1} vs {name2}: +{wins} ={draws} -{losses} in {n} games')
+    print('Score {:.1f}%, Elo {:+.1f} +/- {:.1f}'.format(
+        100 * (wins + draws / 2) / n, elo, margin))
+    if args.sprt:
+        llr = sprt_llr(wins, draws, losses, args.elo0, args.elo1)
+        print('SPRT elo0={} elo1={}: LLR {:.2f} ({:.2f}, {:.2f}), {}'.format(
+            args.elo0, args.elo1, llr, lower, upper, sprt_result or 'inconclusive'))
+    print('{:.0f} games/hour, {:.1f}s per game'.format(3600 * n / elapsed, elapsed / n))
+    print(f'Games saved to {args.pgn}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+pgn_index.py
+
+Header index of a pgn file, so player lists, game counts and the games of a
+player are found without reading the pgn. The index is kept in a sidecar
+file next to the pgn, e.g. pecg_my_games.idx, with the byte offset and the
+White, Black, Result, Date and Event tags of every game.
+
+Games appended to the pgn, like save_game does after every game, are the
+only ones read on the next update. A pgn that was changed in any other way,
+e.g. by Delete Player, is indexed again. Large pgn files are read in chunks
+by a pool of processes.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+from collections import Counter, namedtuple
+
+import chess.pgn
+
+import pgn_tools
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PECGIDX1'
+HEADER_STRUCT = struct.Struct('>8sQIQQ')  # magic, pgn offset, tail crc, body size, games
+
+PARALLEL_CHUNK_SIZE = 8 * 1024 * 1024
+CANCEL_POLL_SEC = 0.1  # wait for a chunk of the pool between cancel checks
+
+GameHeader = namedtuple('GameHeader', ['offset', 'white', 'black', 'result', 'date', 'event'])
+
+
+def scan_chunk(task, cancel_event=None):
+    """Reads the GameHeader of the games of a byte range, in a worker process.
+
+    Args:
+      task: (pgn_file, start, end)
+      cancel_event: threading.Event that stops the scan, when it is run in
+        this process
+
+    Returns:
+      A list of GameHeader, None if cancelled.
+    """
+    pgn_file, start, end = task
+    game_headers = []
+    with open(pgn_file, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for headers, raw in pgn_tools.iter_raw_games(f, end - start, cancel_event):
+            # Skip trailing empty lines and comments
+            if headers:
+                game_headers.append(GameHeader(
+                    offset, headers.get('White', '?'), headers.get('Black', '?'),
+                    headers.get('Result', '*'), headers.get('Date', '????.??.??'),
+                    headers.get('Event', '?')))
+            offset += len(raw)
+
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+
+    return game_headers
+
+
+class PgnHeaderIndex:
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, pgn_file, index_file=None) -> None:
+        """Offsets and main tags of the games of a pgn file.
+
+        Args:
+          pgn_file: pgn filename
+          index_file: sidecar filename, default is the pgn with a .idx suffix
+        """
+        self.pgn_file = pgn_file
+        self.index_file = index_file or os.path.splitext(pgn_file)[0] + '.idx'
+        self._games = []
+        self._players = {}  # name: list of game numbers
+        self._offset = 0
+        self._crc = 0
+        self._body_size = 0
+        self._is_loaded = False
+        self._lock = threading.RLock()
+
+    @classmethod
+    def for_file(cls, pgn_file):
+        """Returns the index of a pgn file, one per path."""
+        key = os.path.abspath(pgn_file)
+        with cls._indexes_lock:
+            if key not in cls._indexes:
+                cls._indexes[key] = cls(pgn_file)
+            return cls._indexes[key]
+
+    def __len__(self):
+        """Number of games in the pgn."""
+        return len(self._games)
+
+    def _add(self, game_header) -> None:
+        n = len(self._games)
+        self._games.append(game_header)
+        self._players.setdefault(game_header.white, []).append(n)
+        if game_header.black != game_header.white:
+            self._players.setdefault(game_header.black, []).append(n)
+
+    def _clear(self) -> None:
+        self._games = []
+        self._players = {}
+        self._offset, self._crc, self._body_size = 0, 0, 0
+
+    def _load(self) -> None:
+        """Reads the sidecar, an unusable sidecar leaves the index empty."""
+        self._clear()
+        try:
+            with open(self.index_file, 'rb') as f:
+                magic, offset, crc, body_size, games = HEADER_STRUCT.unpack(
+                    f.read(HEADER_STRUCT.size))
+                if magic != MAGIC:
+                    return
+                body = f.read(body_size)
+        except FileNotFoundError:
+            return
+        except (OSError, struct.error):
+            logger.warning(f'Pgn index {self.index_file} is not readable, rebuilding.')
+            return
+
+        if len(body) != body_size:
+            return
+        try:
+            # One json list per line, parse all lines as one list
+            rows = json.loads(b'[' + body.rstrip(b'\n').replace(b'\n', b',') + b']')
+        except ValueError:
+            logger.warning(f'Pgn index {self.index_file} is damaged, rebuilding.')
+            return
+        if len(rows) != games:
+            return
+
+        for row in rows:
+            self._add(GameHeader(*row))
+        self._offset, self._crc, self._body_size = offset, crc, body_size
+
+    def _save(self, new_games, is_rebuild) -> None:
+        """Appends the new games to the sidecar and then commits the header.
+
+        Rows after the committed body size are from an interrupted update,
+        they are overwritten.
+        """
+        mode = 'wb' if is_rebuild or not os.path.isfile(self.index_file) else 'r+b'
+        body = b''.join(json.dumps(list(g)).encode('utf-8') + b'\n' for g in new_games)
+        with open(self.index_file, mode) as f:
+            if mode == 'wb':
+                self._body_size = 0
+            f.seek(HEADER_STRUCT.size + self._body_size)
+            f.write(body)
+            f.truncate()
+            f.flush()
+            self._body_size += len(body)
+            f.seek(0)
+            f.write(HEADER_STRUCT.pack(MAGIC, self._offset, self._crc,
+                                       self._body_size, len(self._games)))
+
+    def _scan(self, start, size, workers, progress, cancel_event):
+        """Returns the GameHeader of the games from start, None if cancelled.
+
+        More than two chunks are read by a process pool, the results are
+        merged in file order. A cancel stops the pool without waiting for
+        the chunks being read.
+        """
+        chunks = pgn_tools.split_pgn_chunks(self.pgn_file, PARALLEL_CHUNK_SIZE, start)
+        total = size - start
+        workers = workers or os.cpu_count() or 1
+        if len(chunks) <= 2 or workers == 1:
+            game_headers = scan_chunk((self.pgn_file, start, size), cancel_event)
+            if game_headers is None:
+                logger.info(f'Indexing {self.pgn_file} is cancelled.')
+                return None
+            if progress is not None:
+                progress(total, total)
+            return game_headers
+
+        # Spawn, the gui process has threads that fork does not copy
+        game_headers = []
+        done = 0
+        tasks = [(self.pgn_file, chunk_start, chunk_end) for chunk_start, chunk_end in chunks]
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            results = pool.imap(scan_chunk, tasks)
+            for task in tasks:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info(f'Indexing {self.pgn_file} is cancelled.')
+                        return None
+                    try:
+                        chunk_headers = results.next(CANCEL_POLL_SEC)
+                        break
+                    except multiprocessing.TimeoutError:
+                        pass
+                game_headers.extend(chunk_headers)
+                done += task[2] - task[1]
+                if progress is not None:
+                    progress(done, total)
+
+        return game_headers
+
+    def update(self, is_rebuild_allowed=True, workers=None, progress=None,
+               cancel_event=None):
+        """Indexes the games added to the pgn since the last update.
+
+        Args:
+          is_rebuild_allowed: False to only read appended games, e.g. from
+            the gui thread, a pgn that must be indexed again is left for the
+            next update that allows it
+          workers: number of processes for a large pgn, default is the
+            number of cpus, 1 reads it in this process
+          progress: callable(done_bytes, total_bytes) called per chunk
+          cancel_event: threading.Event that stops the update, the index is
+            left as it was
+
+        Returns:
+          The number of games read from the pgn, None if cancelled.
+        """
+        with self._lock:
+            if not self._is_loaded:
+                self._load()
+                self._is_loaded = True
+
+            if not os.path.isfile(self.pgn_file):
+                if self._offset:
+                    self._clear()
+                    self._save([], True)
+                return 0
+
+            with open(self.pgn_file, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                is_append = (self._offset <= size and
+                             pgn_tools.tail_crc(f, self._offset) == self._crc)
+                if is_append and size == self._offset:
+                    return 0
+                if not is_rebuild_allowed and (not is_append or self._offset == 0):
+                    return 0
+
+                crc = pgn_tools.tail_crc(f, size)
+
+            new_games = self._scan(self._offset if is_append else 0, size,
+                                   workers, progress, cancel_event)
+            if new_games is None:
+                return None
+
+            if not is_append:
+                self._clear()
+            for game_header in new_games:
+                self._add(game_header)
+            self._offset, self._crc = size, crc
+
+            try:
+                self._save(new_games, not is_append)
+            except OSError:
+                logger.exception(f'Failed to save pgn index {self.index_file}.')
+
+            logger.info(f'{len(new_games)} games of {self.pgn_file} added to the pgn index.')
+            return len(new_games)
+
+    def get_players(self) -> Counter:
+        """Returns the number of games of every player."""
+        with self._lock:
+            return Counter({name: len(games) for name, games in self._players.items()})
+
+    def get_games(self, name) -> list:
+        """Returns the GameHeader of every game of a player."""
+        with self._lock:
+            return [self._games[n] for n in self._players.get(name, [])]
+
+    def read_game(self, game_header):
+        """Reads a game of the pgn at its indexed offset."""
+        with open(self.pgn_file, 'rb') as f:
+            reader = pgn_tools.PgnChunkReader(f, game_header.offset, os.fstat(f.fileno()).st_size)
+            return chess.pgn.read_game(reader)
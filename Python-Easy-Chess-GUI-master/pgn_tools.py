@@ -0,0 +1,200 @@
+"""
+pgn_tools.py
+
+Helpers to process large pgn files. A file is split into byte ranges that
+start at a game, so every worker process can open the file, seek to its
+range and read the games with chess.pgn without anything being sent
+through a pipe. iter_raw_games() streams the games as raw bytes with their
+tags, to filter a file without parsing moves.
+"""
+
+import os
+import zlib
+
+import chess.pgn
+
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+ENCODING = 'utf-8'
+BOM = b'\xef\xbb\xbf'
+TAIL_SIZE = 4096
+CANCEL_CHECK_GAMES = 1000  # games read between checks of a cancel event
+
+
+def tail_crc(f, offset, size=TAIL_SIZE):
+    """Returns the crc32 of the bytes before offset.
+
+    An index that read a pgn up to offset compares it to tell whether the
+    file was only appended to since then.
+    """
+    start = max(0, offset - size)
+    f.seek(start)
+    return zlib.crc32(f.read(offset - start))
+
+
+def find_game_start(f, pos, file_size):
+    """Returns the offset of the first game that starts at or after pos.
+
+    A game starts with a tag line, '[' at the start of a line, that follows
+    an empty line or the start of the file.
+
+    Args:
+      f: pgn file opened in binary mode
+      pos: offset to search from
+      file_size: size of the file
+    """
+    if pos <= 0:
+        return 0
+    if pos >= file_size:
+        return file_size
+
+    # Start at a line boundary, the line at pos may be partial
+    f.seek(pos - 1)
+    if f.read(1) != b'\n':
+        f.readline()
+    offset = f.tell()
+
+    is_after_empty_line = False
+    for line in iter(f.readline, b''):
+        if line.startswith(b'[') and is_after_empty_line:
+            return offset
+        is_after_empty_line = not line.strip()
+        offset += len(line)
+
+    return file_size
+
+
+def split_pgn_chunks(pgn_file, chunk_size=DEFAULT_CHUNK_SIZE, start=0):
+    """Splits a pgn file into (start, end) byte ranges of whole games.
+
+    Args:
+      pgn_file: pgn filename
+      chunk_size: approximate size of a range in bytes
+      start: offset of a game to split the file from, e.g. the end of what
+        an index has already read
+
+    Returns:
+      A list of ranges that cover the file from start, empty if there is
+      nothing after start.
+    """
+    file_size = os.path.getsize(pgn_file)
+    chunks = []
+    with open(pgn_file, 'rb') as f:
+        while start < file_size:
+            end = find_game_start(f, start + chunk_size, file_size)
+            chunks.append((start, end))
+            start = end
+
+    return chunks
+
+
+class PgnChunkReader:
+    def __init__(self, f, start, end, encoding=ENCODING) -> None:
+        """Text handle over a byte range of a pgn file for chess.pgn.read_game.
+
+        Args:
+          f: pgn file opened in binary mode
+          start: offset of the first game
+          end: offset where the range ends, readline() returns '' there
+          encoding: text encoding, bad bytes are replaced
+        """
+        self.f = f
+        self.offset = start
+        self.end = end
+        self.encoding = encoding
+        self.f.seek(start)
+
+    def readline(self):
+        if self.offset >= self.end:
+            return ''
+        line = self.f.readline()
+        self.offset += len(line)
+        return line.decode(self.encoding, errors='replace')
+
+
+def iter_chunk_games(pgn_file, start, end, visitor_factory=chess.pgn.GameBuilder):
+    """Yields what read_game returns for every game of a byte range.
+
+    Args:
+      pgn_file: pgn filename
+      start: offset from split_pgn_chunks()
+      end: offset from split_pgn_chunks()
+      visitor_factory: visitor class of chess.pgn, e.g. to read only the
+        headers or the first moves of the games
+    """
+    with open(pgn_file, 'rb') as f:
+        reader = PgnChunkReader(f, start, end)
+        while True:
+            game = chess.pgn.read_game(reader, Visitor=visitor_factory)
+            if game is None:
+                break
+            yield game
+
+
+def iter_raw_games(f, size=None, cancel_event=None):
+    """Yields (headers, raw) for every game of a pgn file.
+
+    Only the tag lines are parsed. raw is the exact bytes of the game up to
+    the next game, so writing the raw of every game gives the file back.
+    Like chess.pgn, a game ends at an empty line after its moves, the next
+    game starts with its first tag line.
+
+    Args:
+      f: pgn file opened in binary mode, at the start of a game
+      size: number of bytes to read, e.g. a range of split_pgn_chunks(),
+        None to read to the end of the file
+      cancel_event: threading.Event checked every CANCEL_CHECK_GAMES games,
+        the iterator ends early when it is set
+
+    Returns:
+      An iterator of a dict of tags and the bytes of the game.
+    """
+    games = 0
+    lines = []
+    headers = {}
+    is_tag_section = True
+    has_movetext = False
+    is_after_empty_line = True
+    remaining = size
+
+    for line in f:
+        if remaining is not None:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+
+        if not lines and not headers and line.startswith(BOM):
+            tag_line = line[len(BOM):]
+        else:
+            tag_line = line
+
+        if tag_line.startswith(b'[') and is_after_empty_line and has_movetext:
+            yield headers, b''.join(lines)
+            lines, headers = [], {}
+            is_tag_section, has_movetext = True, False
+            games += 1
+            if (cancel_event is not None and games % CANCEL_CHECK_GAMES == 0 and
+                    cancel_event.is_set()):
+                return
+
+        lines.append(line)
+
+        # Escape and comment lines are skipped by chess.pgn, a tag line
+        # after them still starts a game if the line before was empty
+        if line.startswith((b'%', b';')):
+            continue
+        is_after_empty_line = line.isspace()
+        if is_after_empty_line:
+            continue
+
+        if is_tag_section and tag_line.startswith(b'['):
+            tag_match = chess.pgn.TAG_REGEX.match(
+                tag_line.decode(ENCODING, errors='replace'))
+            if tag_match:
+                headers[tag_match.group(1)] = tag_match.group(2)
+        else:
+            is_tag_section = False
+            has_movetext = True
+
+    if lines:
+        yield headers, b''.join(lines)
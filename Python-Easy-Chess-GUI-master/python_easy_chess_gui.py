@@ -40,13 +40,20 @@ col is the same as in PySimpleGUI
 """
 
 import PySimpleGUI as sg
+import asyncio
+import concurrent.futures
+import multiprocessing
 import os
 import sys
 import subprocess
 import threading
 from pathlib import Path, PurePath  # Python 3.4 and up
 import queue
+import shutil
 import copy
+import itertools
+import random
+import tempfile
 import time
 from datetime import datetime
 import json
@@ -57,16 +64,25 @@ import chess.engine
 import chess.polyglot
 import logging
 import platform as sys_plat
-from ai_chess_mentor import ChessMentor
+from collections import OrderedDict, namedtuple
+from ai_chess_mentor import ChessMentor, MentorResult, MentorWorker
+from repertoire import RepertoireIndex, RepertoireLine
+import pgn_tools
+from pgn_index import PgnHeaderIndex
+from game_store import GameStore
 
 
 log_format = '%(asctime)s :: %(funcName)s :: line: %(lineno)d :: %(levelname)s :: %(message)s'
-logging.basicConfig(
-    filename='pecg_log.txt',
-    filemode='w',
-    level=logging.DEBUG,
-    format=log_format
-)
+
+# Worker processes, e.g. of the pgn index, import this module again, only
+# the app itself writes the log.
+if multiprocessing.parent_process() is None:
+    logging.basicConfig(
+        filename='pecg_log.txt',
+        filemode='w',
+        level=logging.DEBUG,
+        format=log_format
+    )
 
 
 APP_NAME = 'Python Easy Chess GUI'
@@ -263,6 +279,7 @@ menu_def_play = [
                    'Save to My Games::save_game_k',
                    'Save to White Repertoire',
                    'Save to Black Repertoire',
+                   'Find Games::find_games_k',
                    'Resign::resign_game_k',
                    'User Wins::user_wins_k',
                    'User Draws::user_draws_k']],
@@ -276,6 +293,10 @@ class Timer:
     def __init__(self, tc_type: str = 'fischer', base: int = 300000, inc: int = 10000, period_moves: int = 40) -> None:
         """Manages time control.
 
+        The time used on a move is measured with time.monotonic_ns()
+        between start() and stop(), so the clock does not depend on how
+        often the gui loop reads its events.
+
         Args:
           tc_type: time control type ['fischer, delay, classical']
           base: base time in ms
@@ -286,22 +307,148 @@ class Timer:
         self.base = base
         self.inc = inc
         self.period_moves = period_moves
-        self.elapse = 0
+        self.elapse_ns = 0
+        self.start_ns = None
+        self.last_elapse = 0
         self.init_base_time = self.base
 
+    @property
+    def is_running(self) -> bool:
+        return self.start_ns is not None
+
+    @property
+    def elapse(self) -> int:
+        """Time used on the current move in ms, including the running part."""
+        elapse_ns = self.elapse_ns
+        if self.start_ns is not None:
+            elapse_ns += time.monotonic_ns() - self.start_ns
+        return elapse_ns // 1000000
+
+    def start(self) -> None:
+        """Starts the clock, does nothing if it is already running."""
+        if self.start_ns is None:
+            self.start_ns = time.monotonic_ns()
+
+    def stop(self) -> int:
+        """Stops the clock and returns the time used on the move in ms.
+
+        The move is not finished yet, a later start() continues it.
+        """
+        if self.start_ns is not None:
+            self.elapse_ns += time.monotonic_ns() - self.start_ns
+            self.start_ns = None
+        return self.elapse_ns // 1000000
+
     def update_base(self) -> None:
         """Updates base time after every move."""
+        elapse = self.stop()
         if self.tc_type == 'delay':
-            self.base += min(0, self.inc - self.elapse)
+            self.base += min(0, self.inc - elapse)
         elif self.tc_type == 'fischer':
-            self.base += self.inc - self.elapse
+            self.base += self.inc - elapse
         elif self.tc_type == 'timepermove':
             self.base = self.init_base_time
         else:
-            self.base -= self.elapse
+            self.base -= elapse
 
         self.base = max(0, self.base)
-        self.elapse = 0
+        self.last_elapse = elapse
+        self.elapse_ns = 0
+
+
+class BookService:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_positions: int = 4096) -> None:
+        """Shared access to the polyglot books of the app.
+
+        Each book file is memory mapped once, python-chess binary searches
+        the entries of a key in the mapped file. The entries found for a
+        (book, zobrist key) are memoized, so refreshing the book panes on
+        every loop of play_game costs a dict lookup. A book file that is
+        replaced on disk is mapped again.
+
+        Args:
+          max_positions: number of memoized positions over all books
+        """
+        self.max_positions = max_positions
+        self._readers = {}  # path: (stamp, reader)
+        self._entries = OrderedDict()  # (path, stamp, key): [entries, san moves]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """Returns the book service of the process."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _get_reader(self, book_file: str):
+        """Returns the stamp and reader of the book, raises OSError if missing."""
+        st = os.stat(book_file)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._readers.get(book_file)
+        if cached is not None and cached[0] == stamp:
+            return cached
+        if cached is not None:
+            cached[1].close()
+        reader = chess.polyglot.open_reader(book_file)
+        self._readers[book_file] = (stamp, reader)
+        return stamp, reader
+
+    def _lookup(self, book_file: str, board: chess.Board) -> list:
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            stamp, reader = self._get_reader(book_file)
+            cache_key = (book_file, stamp, key)
+            memo = self._entries.get(cache_key)
+            if memo is not None:
+                self._entries.move_to_end(cache_key)
+                return memo
+
+            memo = [tuple(reader.find_all(board)), None]
+            self._entries[cache_key] = memo
+            if len(self._entries) > self.max_positions:
+                self._entries.popitem(last=False)
+            return memo
+
+    def find_all(self, book_file: str, board: chess.Board) -> tuple:
+        """Returns the legal book entries of the position, can be empty.
+
+        Raises:
+          OSError: the book file cannot be read.
+        """
+        return self._lookup(book_file, board)[0]
+
+    def find_all_san(self, book_file: str, board: chess.Board) -> tuple:
+        """Returns (san, weight) of the book entries, for the book panes."""
+        memo = self._lookup(book_file, board)
+        if memo[1] is None:
+            memo[1] = tuple((board.san(e.move), e.weight) for e in memo[0])
+        return memo[1]
+
+    def find(self, book_file: str, board: chess.Board):
+        """Returns the entry with the highest weight, raises IndexError if none."""
+        entries = self.find_all(book_file, board)
+        if not entries:
+            raise IndexError()
+        return max(entries, key=lambda e: e.weight)
+
+    def weighted_choice(self, book_file: str, board: chess.Board):
+        """Returns a random entry by weight, raises IndexError if none."""
+        entries = self.find_all(book_file, board)
+        if not entries or not sum(e.weight for e in entries):
+            raise IndexError()
+        return random.choices(entries, weights=[e.weight for e in entries])[0]
+
+    def close(self) -> None:
+        with self._lock:
+            for _, reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+            self._entries.clear()
 
 
 class GuiBook:
@@ -320,19 +467,17 @@ class GuiBook:
 
     def get_book_move(self) -> None:
         """Gets book move either random or best move."""
-        reader = chess.polyglot.open_reader(self.book_file)
+        book_service = BookService.get()
         try:
             if self.is_random:
-                entry = reader.weighted_choice(self.board)
+                entry = book_service.weighted_choice(self.book_file, self.board)
             else:
-                entry = reader.find(self.board)
+                entry = book_service.find(self.book_file, self.board)
             self.__book_move = entry.move
         except IndexError:
             logging.warning('No more book move.')
         except Exception:
             logging.exception('Failed to get book move.')
-        finally:
-            reader.close()
 
         return self.__book_move
 
@@ -349,15 +494,12 @@ class GuiBook:
 
         if os.path.isfile(self.book_file):
             moves = '{:4s}   {:<5s}   {}\n'.format('move', 'score', 'weight')
-            with chess.polyglot.open_reader(self.book_file) as reader:
-                for entry in reader.find_all(self.board):
-                    is_found = True
-                    san_move = self.board.san(entry.move)
-                    score = entry.weight
-                    total_score += score
-                    bd = {cnt: {'move': san_move, 'score': score}}
-                    book_data.update(bd)
-                    cnt += 1
+            for san_move, score in BookService.get().find_all_san(self.book_file, self.board):
+                is_found = True
+                total_score += score
+                bd = {cnt: {'move': san_move, 'score': score}}
+                book_data.update(bd)
+                cnt += 1
         else:
             moves = '{:4s}  {:<}\n'.format('move', 'score')
 
@@ -372,14 +514,678 @@ class GuiBook:
         return moves, is_found
 
 
-class RunEngine(threading.Thread):
+class EngineConfig:
+    def __init__(self, data: dict) -> None:
+        """One engine entry of pecg_engines.json.
+
+        Options are indexed by lower case name, e.g. config.option('hash').
+
+        Args:
+          data: the engine dict as read from the json file
+        """
+        self.data = data
+        self.name = data['name']
+        self.command = data['command']
+        self.working_directory = data['workingDirectory']
+        self.protocol = data['protocol']
+        self.options = {o['name'].lower(): o for o in data.get('options', [])}
+
+    @property
+    def path_and_file(self) -> str:
+        return Path(self.working_directory, self.command).as_posix()
+
+    def option(self, name: str):
+        """Returns the option dict or None if the engine has no such option."""
+        return self.options.get(name.lower())
+
+    def option_value(self, name: str):
+        """Returns the user value of an option or None."""
+        opt = self.option(name)
+        return None if opt is None else opt['value']
+
+
+class EngineConfigRegistry:
+    _registries = {}
+    _registries_lock = threading.Lock()
+
+    def __init__(self, engine_config_file) -> None:
+        """Parsed and indexed pecg_engines.json shared by the app.
+
+        The file is read again only when its mtime or size changes, so
+        lookups per move or per search cost a dict access. Writes go to a
+        temp file that replaces the config, a crash never leaves a half
+        written file.
+
+        Args:
+          engine_config_file: pecg_engines.json
+        """
+        self.engine_config_file = engine_config_file
+        self._stat = None
+        self._data = []
+        self._configs = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def for_file(cls, engine_config_file):
+        """Returns the registry of a config file, one per path."""
+        key = os.path.abspath(engine_config_file)
+        with cls._registries_lock:
+            if key not in cls._registries:
+                cls._registries[key] = cls(engine_config_file)
+            return cls._registries[key]
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.engine_config_file)
+            stat = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stat = None
+
+        if stat == self._stat:
+            return
+
+        data = []
+        if stat is not None:
+            with open(self.engine_config_file, 'r') as json_file:
+                data = json.load(json_file)
+            logging.info(f'Loaded {len(data)} engines from {self.engine_config_file}.')
+
+        self._set_data(data, stat)
+
+    def _set_data(self, data, stat) -> None:
+        self._data = data
+        self._configs = {p['name']: EngineConfig(p) for p in data}
+        self._stat = stat
+
+    def get(self, engine_id_name):
+        """Returns the EngineConfig of an engine or None."""
+        with self._lock:
+            self._refresh()
+            return self._configs.get(engine_id_name)
+
+    def names(self, protocol: str = 'uci'):
+        """Returns sorted engine id names of a protocol."""
+        with self._lock:
+            self._refresh()
+            return sorted(c.name for c in self._configs.values()
+                          if c.protocol == protocol)
+
+    def exists(self, engine_id_name) -> bool:
+        with self._lock:
+            self._refresh()
+            return engine_id_name in self._configs
+
+    def data(self):
+        """Returns a copy of the engine list that can be edited and saved."""
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._data)
+
+    def save(self, data) -> None:
+        """Atomically writes the engine list to the config file."""
+        folder = os.path.dirname(os.path.abspath(self.engine_config_file))
+        with self._lock:
+            fd, tmp_file = tempfile.mkstemp(
+                prefix='.pecg_engines_', suffix='.tmp', dir=folder)
+            try:
+                with os.fdopen(fd, 'w') as h:
+                    json.dump(data, h, indent=4)
+                os.replace(tmp_file, self.engine_config_file)
+            except Exception:
+                os.remove(tmp_file)
+                raise
+
+            st = os.stat(self.engine_config_file)
+            self._set_data(copy.deepcopy(data), (st.st_mtime_ns, st.st_size))
+
+
+class EngineOrchestrator:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        """Runs all engine processes on one asyncio event loop.
+
+        The loop runs on its own thread. Searches of the opponent, adviser,
+        ponder and mentor are coroutines scheduled with submit(), and
+        stopped through their analysis handle on the loop or by cancelling
+        their future. Engines are also returned as chess.engine.SimpleEngine
+        facades, so python-chess does not start a loop thread per process.
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop,
+                                        name='engine-loop', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls):
+        """Returns the orchestrator of the app, it starts on first use."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def is_loop_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop, can be called from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result."""
+        if self.is_loop_thread():
+            raise RuntimeError('Blocking call on the engine loop, await the coroutine.')
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args) -> None:
+        """Run a plain callback on the loop, e.g. to stop an analysis."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def popen_uci(self, command, timeout=10.0, **popen_args):
+        """Starts a uci engine on the loop.
+
+        Returns:
+          A chess.engine.SimpleEngine whose returncode is set when the
+          process exits.
+        """
+        ready = concurrent.futures.Future()
+        self.submit(self._watch_uci(command, timeout, popen_args, ready))
+        return ready.result()
+
+    async def _watch_uci(self, command, timeout, popen_args, ready) -> None:
+        try:
+            transport, protocol = await asyncio.wait_for(
+                chess.engine.popen_uci(command, **popen_args), timeout)
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+
+        engine = chess.engine.SimpleEngine(transport, protocol, timeout=timeout)
+        ready.set_result(engine)
+        try:
+            engine.returncode.set_result(await protocol.returncode)
+        finally:
+            engine.close()
+
+
+class EngineSession:
+    def __init__(self, engine_config_file, engine_path_and_file, engine_id_name):
+        """Keeps one uci engine process running across searches.
+
+        The process is started on first use and reused for every search
+        after that, so process startup, uci handshake and option setup are
+        paid once and the engine keeps its hash between moves. A process
+        that died is started again on the next use.
+
+        Args:
+          engine_config_file: pecg_engines.json
+          engine_path_and_file: engine executable
+          engine_id_name: engine name in the config file
+        """
+        self.engine_config_file = engine_config_file
+        self.engine_path_and_file = engine_path_and_file
+        self.engine_id_name = engine_id_name
+        self.engine = None
+        self.is_ownbook = False
+        self.spawn_count = 0
+        self.is_stale = False
+        self._lock = threading.Lock()
+
+    def is_alive(self) -> bool:
+        """Returns True if the engine process is running."""
+        return self.engine is not None and not self.engine.returncode.done()
+
+    def invalidate(self) -> None:
+        """Restart the engine on next use, e.g. because its options changed."""
+        self.is_stale = True
+
+    def get_engine(self):
+        """Returns the running engine, starting it if needed.
+
+        Returns:
+          A tuple of chess.engine.SimpleEngine and True if it was just started.
+        """
+        with self._lock:
+            if self.is_stale and self.engine is not None:
+                logging.info(f'Restart engine {self.engine_id_name} with new options.')
+                self._quit()
+            self.is_stale = False
+
+            if self.is_alive():
+                return self.engine, False
+
+            if self.engine is not None:
+                logging.warning(f'Engine {self.engine_id_name} died, starting it again.')
+                self.engine = None
+
+            self.open()
+            return self.engine, True
+
+    async def get_engine_async(self):
+        """Like get_engine(), for coroutines on the engine loop.
+
+        Starting the process blocks, so that is done on an executor thread.
+        """
+        if not self.is_stale and self.is_alive():
+            return self.engine, False
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_engine)
+
+    def open(self) -> None:
+        """Starts and configures the engine process."""
+        folder = Path(self.engine_path_and_file)
+        folder = folder.parents[0]
+
+        if sys_os == 'Windows':
+            self.engine = EngineOrchestrator.get().popen_uci(
+                self.engine_path_and_file, cwd=folder,
+                creationflags=subprocess.CREATE_NO_WINDOW)
+        else:
+            self.engine = EngineOrchestrator.get().popen_uci(
+                self.engine_path_and_file, cwd=folder)
+        self.spawn_count += 1
+
+        # Set engine option values
+        try:
+            self.configure_engine()
+        except Exception:
+            logging.exception('Failed to configure engine.')
+
+    def configure_engine(self) -> None:
+        """Configures the engine internal settings.
+
+        Read the engine config file pecg_engines.json and set the engine to
+        use the user_value of the value key. Our option name has 2 values,
+        default_value and user_value.
+
+        Example for hash option
+        'name': Hash
+        'default': default_value
+        'value': user_value
+
+        If default_value and user_value are not the same, we will set the
+        engine to use the user_value by the command,
+        setoption name Hash value user_value
+
+        However if default_value and user_value are the same, we will not send
+        commands to set the option value because the value is default already.
+        """
+        config = EngineConfigRegistry.for_file(self.engine_config_file).get(
+            self.engine_id_name)
+        if config is None:
+            return
+
+        self.is_ownbook = config.option('ownbook') is not None
+
+        for n in config.options.values():
+            # Ignore button type for a moment.
+            if n['type'] == 'button':
+                continue
+
+            if n['type'] == 'spin':
+                user_value = int(n['value'])
+                default_value = int(n['default'])
+            else:
+                user_value = n['value']
+                default_value = n['default']
+
+            if user_value != default_value:
+                try:
+                    self.engine.configure({n['name']: user_value})
+                    logging.info('Set ' + n['name'] + ' to ' + str(user_value))
+                except Exception:
+                    logging.exception('Failed to configure engine.')
+
+    def close(self) -> None:
+        """Quit the engine process."""
+        with self._lock:
+            self._quit()
+
+    def _quit(self) -> None:
+        if self.engine is None:
+            return
+        logging.info(f'quit engine {self.engine_id_name}')
+        try:
+            self.engine.quit()
+        except Exception:
+            logging.exception('Failed to quit engine.')
+        self.engine = None
+
+
+class EngineLease:
+    def __init__(self, pool, session, role: str) -> None:
+        """Gives one role exclusive use of a pooled engine session.
+
+        Args:
+          pool: the EnginePool the session came from
+          session: EngineSession to search with
+          role: 'opponent', 'adviser' or 'mentor', for logging
+        """
+        self.pool = pool
+        self.session = session
+        self.role = role
+        self.is_released = False
+
+    def release(self) -> None:
+        """Give the session back to the pool, it keeps running there."""
+        if not self.is_released:
+            self.is_released = True
+            self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class EnginePool:
+    def __init__(self, engine_config_file, max_processes: int = 4) -> None:
+        """Keeps warm engine processes for the opponent, adviser and mentor.
+
+        A role leases a session for an engine id, searches with it and
+        releases it. Released sessions stay running, so the next lease of
+        the same engine skips startup. When max_processes are running the
+        least recently released idle session is quit to make room, when
+        all of them are leased acquire waits for a release. Dead processes
+        are restarted by their session on the next lease.
+
+        Args:
+          engine_config_file: pecg_engines.json
+          max_processes: number of engine processes kept in total
+        """
+        self.engine_config_file = engine_config_file
+        self.max_processes = max_processes
+        self._idle = []  # Least recently released first
+        self._busy = []
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def acquire(self, engine_id_name, engine_path_and_file, role: str,
+                timeout: float = 10.0) -> EngineLease:
+        """Lease a session of an engine, the process starts on first search.
+
+        Args:
+          engine_id_name: engine name in pecg_engines.json
+          engine_path_and_file: engine executable
+          role: 'opponent', 'adviser' or 'mentor'
+          timeout: seconds to wait for a release when all sessions are leased
+
+        Raises:
+          RuntimeError: if no session was released within timeout
+        """
+        evicted = None
+        deadline = time.monotonic() + timeout
+        with self._released:
+            while True:
+                session = None
+                for s in reversed(self._idle):
+                    if s.engine_id_name == engine_id_name and \
+                            s.engine_path_and_file == engine_path_and_file:
+                        session = s
+                        self._idle.remove(s)
+                        break
+                if session is not None:
+                    break
+
+                if len(self._idle) + len(self._busy) < self.max_processes or self._idle:
+                    if len(self._idle) + len(self._busy) >= self.max_processes:
+                        evicted = self._idle.pop(0)
+                    session = EngineSession(self.engine_config_file,
+                                            engine_path_and_file, engine_id_name)
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        f'Engine pool is full, all {self.max_processes} engines are '
+                        f'in use, {role} could not lease {engine_id_name}.')
+                logging.info(f'Engine pool is full, {role} waits for a release.')
+                self._released.wait(remaining)
+
+            self._busy.append(session)
+
+        # Quitting an engine can take a while, other roles need not wait for it
+        if evicted is not None:
+            logging.info(f'Engine pool is full, quit idle {evicted.engine_id_name}.')
+            evicted.close()
+
+        logging.info(f'{role} leases {engine_id_name}.')
+        return EngineLease(self, session, role)
+
+    def release(self, lease: EngineLease) -> None:
+        """Take a session back, it is kept warm unless the pool is over capacity."""
+        session = lease.session
+        is_kept = False
+        with self._released:
+            if session in self._busy:
+                self._busy.remove(session)
+
+            # Crashed processes are not worth keeping, a new one is started on demand
+            if session.engine is not None and not session.is_alive():
+                logging.warning(f'{session.engine_id_name} died while used as {lease.role}.')
+            elif len(self._idle) + len(self._busy) < self.max_processes:
+                self._idle.append(session)
+                is_kept = True
+            self._released.notify_all()
+
+        if not is_kept:
+            session.close()
+            return
+
+        logging.info(f'{lease.role} releases {session.engine_id_name}.')
+
+    def invalidate(self, engine_id_name=None) -> None:
+        """Restart sessions of an engine, or of all engines, on their next use."""
+        with self._lock:
+            for session in self._idle + self._busy:
+                if engine_id_name is None or session.engine_id_name == engine_id_name:
+                    session.invalidate()
+
+    def close(self) -> None:
+        """Quit all engine processes."""
+        with self._lock:
+            sessions = self._idle + self._busy
+            self._idle, self._busy = [], []
+
+        for session in sessions:
+            session.close()
+
+
+# Messages from RunEngine to the GUI. source is the engine id name and
+# search_id the RunEngine.search_id of the search that sent it.
+SearchInfo = namedtuple('SearchInfo', ['source', 'search_id', 'score', 'depth', 'time', 'pv'])
+PvInfo = namedtuple('PvInfo', ['source', 'search_id', 'pv'])
+BestMove = namedtuple('BestMove', ['source', 'search_id', 'move'])
+EngineError = namedtuple('EngineError', ['source', 'search_id', 'error'])
+AdviserInfo = namedtuple('AdviserInfo', ['source', 'search_id', 'lines'])
+ENGINE_MESSAGES = (SearchInfo, PvInfo, BestMove, EngineError)
+
+# The repertoire index of line is updated, line is the RepertoireLine to refresh
+RepertoireReady = namedtuple('RepertoireReady', ['line'])
+
+
+class EnginePonder:
+    def __init__(self, session, board, ponder_move, game=None, max_depth=MAX_DEPTH):
+        """Searches the expected reply of the user on the user's clock.
+
+        The engine analyses the position after ponder_move until stop() is
+        called, or until max_depth so that a ponder hit does not play
+        deeper than the difficulty allows. If the user plays ponder_move, RunEngine
+        takes over the running search, so the hash and the depth reached
+        while the user was thinking are not lost. The search is a task on
+        the EngineOrchestrator loop.
+
+        Args:
+          session: EngineSession of the opponent
+          board: position after the engine move, user to move
+          ponder_move: the user move expected by the engine
+          game: object identifying the game, see RunEngine
+          max_depth: depth limit of the search, MAX_DEPTH for none
+        """
+        self.session = session
+        self.ponder_move = ponder_move
+        self.max_depth = max_depth
+        self.board = board.copy()
+        self.board.push(ponder_move)
+        self.game = game
+        self.analysis = None
+        self.info = None
+        self.start_time = None
+        self.is_done = False
+        self.orchestrator = EngineOrchestrator.get()
+        self._future = None
+        self._ready = None
+        self._new_info = None
+
+    def start(self):
+        """Schedule the search on the engine loop."""
+        self.start_time = time.perf_counter()
+        self._future = self.orchestrator.submit(self.ponder())
+
+    async def ponder(self):
+        # Events belong to the engine loop. This task is scheduled before
+        # anyone can wait on them, so they exist by then.
+        self._ready = asyncio.Event()
+        self._new_info = asyncio.Event()
+        try:
+            engine, _ = await self.session.get_engine_async()
+            limit = None
+            if self.max_depth != MAX_DEPTH:
+                limit = chess.engine.Limit(depth=self.max_depth)
+            with await engine.protocol.analysis(self.board, limit, game=self.game) as analysis:
+                self.analysis = analysis
+                self._ready.set()
+                async for info in analysis:
+                    if 'pv' in info and not ('upperbound' in info or
+                                             'lowerbound' in info):
+                        self.info = info
+                        self._new_info.set()
+        except Exception:
+            logging.exception('Failed to ponder.')
+        finally:
+            self.is_done = True
+            self._ready.set()
+            self._new_info.set()
+
+    def is_hit(self, board) -> bool:
+        """Returns True if board is the position the engine is pondering."""
+        return self.board == board
+
+    def elapsed(self) -> float:
+        """Seconds spent on this search so far."""
+        if self.start_time is None:
+            return 0.0
+        return time.perf_counter() - self.start_time
+
+    async def get_info(self, timeout: float):
+        """Waits for a new pv and returns the latest one or None."""
+        try:
+            await asyncio.wait_for(self._new_info.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._new_info.clear()
+        return self.info
+
+    async def finish(self):
+        """Stops the search and waits for the engine to be free again."""
+        await self._ready.wait()
+        if self.analysis is not None:
+            self.analysis.stop()
+        await asyncio.wrap_future(self._future)
+
+    def stop(self):
+        """Like finish(), for callers outside the engine loop."""
+        self.orchestrator.call(self.finish())
+
+
+class PvSanRenderer:
+    def __init__(self) -> None:
+        """Converts principal variations to SAN, reusing the previous pv.
+
+        Consecutive pvs of a search usually share their first moves. The
+        renderer keeps the last pv of a root position with its SAN and a
+        board with those moves pushed, only moves after the common prefix
+        are converted. A new root position resets the cache.
+        """
+        self._root_key = None
+        self._board = None  # Root position with self._moves pushed
+        self._moves = []
+        self._sans = []
+        self.reused_plies = 0
+        self.converted_plies = 0
+
+    def get_san_list(self, board, pv):
+        """Returns the SAN of each move in pv played from board."""
+        root_key = chess.polyglot.zobrist_hash(board)
+        if root_key != self._root_key:
+            self._root_key = root_key
+            self._board = board.copy(stack=False)
+            self._moves, self._sans = [], []
+
+        k = 0
+        for cached, move in zip(self._moves, pv):
+            if cached != move:
+                break
+            k += 1
+
+        while len(self._moves) > k:
+            self._board.pop()
+            self._moves.pop()
+            self._sans.pop()
+
+        for move in pv[k:]:
+            self._sans.append(self._board.san(move))
+            self._board.push(move)
+            self._moves.append(move)
+
+        self.reused_plies += k
+        self.converted_plies += len(pv) - k
+
+        return list(self._sans)
+
+    def render(self, board, pv, is_move_number=False):
+        """Returns pv in SAN, with move numbers like board.variation_san()."""
+        if pv is None:
+            return None
+
+        san_list = self.get_san_list(board, pv)
+        if not is_move_number:
+            return ' '.join(san_list)
+
+        moves = []
+        fullmove_number = board.fullmove_number
+        is_white = board.turn == chess.WHITE
+        for san in san_list:
+            if is_white:
+                moves.append(f'{fullmove_number}. {san}')
+            elif not moves:
+                moves.append(f'{fullmove_number}...{san}')
+            else:
+                moves.append(san)
+            if not is_white:
+                fullmove_number += 1
+            is_white = not is_white
+
+        return ' '.join(moves)
+
+
+class RunEngine:
     pv_length = 9
     move_delay_sec = 3.0
+    moves_to_go = 30  # Used to estimate the time of a move on ponder hit
+    info_interval_sec = 0.1  # Search info is sent to the GUI at most this often
+    _search_ids = itertools.count(1)
 
     def __init__(self, eng_queue, engine_config_file, engine_path_and_file,
                  engine_id_name, max_depth=MAX_DEPTH,
                  base_ms=300000, inc_ms=1000, tc_type='fischer',
-                 period_moves=0, is_stream_search_info=True):
+                 period_moves=0, is_stream_search_info=True, session=None,
+                 game=None, ponder=None):
         """
         Run engine as opponent or as adviser.
 
@@ -388,9 +1194,20 @@ class RunEngine(threading.Thread):
         :param engine_path_and_file:
         :param engine_id_name:
         :param max_depth:
+        :param session: EngineSession to search with, if None a new engine
+            process is started and quit_engine() stops it
+        :param game: object identifying the game, the engine gets ucinewgame
+            when it changes
+        :param ponder: EnginePonder running on the same session, its search
+            is used if it is pondering the position to search, else stopped
+
+        The search is a coroutine on the EngineOrchestrator loop, start(),
+        stop() and join() can be called from the GUI thread.
         """
-        threading.Thread.__init__(self)
         self._kill = threading.Event()
+        self._future = None
+        self.orchestrator = EngineOrchestrator.get()
+        self.search_id = next(self._search_ids)
         self.engine_config_file = engine_config_file
         self.engine_path_and_file = engine_path_and_file
         self.engine_id_name = engine_id_name
@@ -407,98 +1224,80 @@ class RunEngine(threading.Thread):
         self.board = None
         self.analysis = is_stream_search_info
         self.is_nomove_number_in_variation = True
+        self.pv_renderer = PvSanRenderer()
         self.base_ms = base_ms
         self.inc_ms = inc_ms
         self.tc_type = tc_type
         self.period_moves = period_moves
         self.is_ownbook = False
         self.is_move_delay = True
+        self.game = game
+        self.ponder = ponder
+        self.ponder_move = None
+        self.is_ponder_hit = False
+        self._search = None
+        self.is_own_session = session is None
+        self.session = session if session is not None else EngineSession(
+            engine_config_file, engine_path_and_file, engine_id_name)
+
+    def start(self):
+        """Schedule the search on the engine loop."""
+        self._future = self.orchestrator.submit(self.search())
+
+    def join(self, timeout=None):
+        """Wait for the search to end."""
+        if self._future is None:
+            return
+        try:
+            self._future.result(timeout)
+        except concurrent.futures.CancelledError:
+            pass
+        except concurrent.futures.TimeoutError:
+            raise
+        except Exception:
+            logging.exception('Engine search failed.')
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
 
     def stop(self):
-        """Interrupt engine search."""
+        """Interrupt engine search, can be called from any thread."""
         self._kill.set()
+        self.orchestrator.call_soon(self._stop_search)
+
+    def _stop_search(self):
+        if self._search is not None:
+            self._search.stop()
 
     def get_board(self, board):
         """Get the current board position."""
         self.board = board
 
-    def configure_engine(self):
-        """Configures the engine internal settings.
-
-        Read the engine config file pecg_engines.json and set the engine to
-        use the user_value of the value key. Our option name has 2 values,
-        default_value and user_value.
-
-        Example for hash option
-        'name': Hash
-        'default': default_value
-        'value': user_value
-
-        If default_value and user_value are not the same, we will set the
-        engine to use the user_value by the command,
-        setoption name Hash value user_value
-
-        However if default_value and user_value are the same, we will not send
-        commands to set the option value because the value is default already.
-        """
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-            for p in data:
-                if p['name'] == self.engine_id_name:
-                    for n in p['options']:
-
-                        if n['name'].lower() == 'ownbook':
-                            self.is_ownbook = True
-
-                        # Ignore button type for a moment.
-                        if n['type'] == 'button':
-                            continue
-
-                        if n['type'] == 'spin':
-                            user_value = int(n['value'])
-                            default_value = int(n['default'])
-                        else:
-                            user_value = n['value']
-                            default_value = n['default']
-
-                        if user_value != default_value:
-                            try:
-                                self.engine.configure({n['name']: user_value})
-                                logging.info('Set ' + n['name'] + ' to ' + str(user_value))
-                            except Exception:
-                                logging.exception('Failed to configure engine.')
-
-    def run(self):
+    async def search(self):
         """Run engine to get search info and bestmove.
 
         If there is error we still send bestmove None.
         """
-        folder = Path(self.engine_path_and_file)
-        folder = folder.parents[0]
-
+        # Per move overhead, the process is only started on first use
+        ready_time = time.perf_counter()
         try:
-            if sys_os == 'Windows':
-                self.engine = chess.engine.SimpleEngine.popen_uci(
-                    self.engine_path_and_file, cwd=folder,
-                    creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                self.engine = chess.engine.SimpleEngine.popen_uci(
-                    self.engine_path_and_file, cwd=folder)
-        except chess.engine.EngineTerminatedError:
+            self.engine, is_started = await self.session.get_engine_async()
+        except chess.engine.EngineTerminatedError as e:
             logging.warning('Failed to start {}.'.format(self.engine_path_and_file))
-            self.eng_queue.put('bestmove {}'.format(self.bm))
+            self.put(EngineError, f'Failed to start: {e}')
+            self.put(BestMove, self.bm)
             return
-        except Exception:
+        except Exception as e:
             logging.exception('Failed to start {}.'.format(
                 self.engine_path_and_file))
-            self.eng_queue.put('bestmove {}'.format(self.bm))
+            self.put(EngineError, f'Failed to start: {e}')
+            self.put(BestMove, self.bm)
             return
-
-        # Set engine option values
-        try:
-            self.configure_engine()
-        except Exception:
-            logging.exception('Failed to configure engine.')
+        self.is_ownbook = self.session.is_ownbook
+        protocol = self.engine.protocol
+        logging.info('{} is ready in {:0.1f}ms, {}.'.format(
+            self.engine_id_name, 1000 * (time.perf_counter() - ready_time),
+            'started' if is_started else 'reused'))
 
         # Set search limits
         if self.tc_type == 'delay':
@@ -520,43 +1319,44 @@ class RunEngine(threading.Thread):
                 white_inc=self.inc_ms/1000,
                 black_inc=self.inc_ms/1000)
         start_time = time.perf_counter()
-        if self.analysis:
-            is_time_check = False
-
-            with self.engine.analysis(self.board, limit) as analysis:
-                for info in analysis:
 
-                    if self._kill.wait(0.1):
-                        break
+        if self.ponder is not None:
+            if self.ponder.is_hit(self.board):
+                self.is_ponder_hit = True
+            else:
+                logging.info('Ponder miss, expected {}.'.format(self.ponder.ponder_move))
+                await self.ponder.finish()
 
-                    try:
-                        if 'depth' in info:
-                            self.depth = int(info['depth'])
+        if self.is_ponder_hit:
+            await self.search_ponder_hit()
+        elif self.analysis:
+            is_time_check = False
 
-                        if 'score' in info:
-                            self.score = int(info['score'].relative.score(mate_score=32000))/100
+            # Info lines are read as fast as the engine writes them, only
+            # the latest snapshot is sent to the GUI every info_interval_sec.
+            snapshot = {}
+            sent_time = 0.0
 
-                        self.time = info['time'] if 'time' in info else time.perf_counter() - start_time
+            with await protocol.analysis(self.board, limit, game=self.game) as analysis:
+                self._search = analysis
+                if self._kill.is_set():
+                    analysis.stop()
 
-                        if 'pv' in info and not ('upperbound' in info or
-                                                 'lowerbound' in info):
-                            self.pv = info['pv'][0:self.pv_length]
+                async for info in analysis:
 
-                            if self.is_nomove_number_in_variation:
-                                spv = self.short_variation_san()
-                                self.pv = spv
-                            else:
-                                self.pv = self.board.variation_san(self.pv)
+                    if self._kill.is_set():
+                        break
 
-                            self.eng_queue.put('{} pv'.format(self.pv))
-                            self.bm = info['pv'][0]
+                    try:
+                        if 'upperbound' in info or 'lowerbound' in info:
+                            info = {k: v for k, v in info.items() if k not in
+                                    ('pv', 'upperbound', 'lowerbound')}
+                        snapshot.update(info)
 
-                        # score, depth, time, pv
-                        if self.score is not None and \
-                                self.pv is not None and self.depth is not None:
-                            info_to_send = '{:+5.2f} | {} | {:0.1f}s | {} info_all'.format(
-                                    self.score, self.depth, self.time, self.pv)
-                            self.eng_queue.put('{}'.format(info_to_send))
+                        if time.perf_counter() - sent_time >= self.info_interval_sec:
+                            self.send_info(snapshot, start_time)
+                            snapshot = {}
+                            sent_time = time.perf_counter()
 
                         # Send stop if movetime is exceeded
                         if not is_time_check and self.tc_type != 'fischer' \
@@ -575,8 +1375,18 @@ class RunEngine(threading.Thread):
                                 break
                     except Exception:
                         logging.exception('Failed to parse search info.')
+
+            self._search = None
+
+            # The last lines may not be sent yet, bm is taken from them
+            if snapshot:
+                try:
+                    self.send_info(snapshot, start_time)
+                except Exception:
+                    logging.exception('Failed to parse search info.')
         else:
-            result = self.engine.play(self.board, limit, info=chess.engine.INFO_ALL)
+            result = await protocol.play(self.board, limit, game=self.game,
+                                         info=chess.engine.INFO_ALL)
             logging.info('result: {}'.format(result))
             try:
                 self.depth = result.info['depth']
@@ -598,64 +1408,212 @@ class RunEngine(threading.Thread):
             try:
                 if 'pv' in result.info:
                     self.pv = result.info['pv'][0:self.pv_length]
+                self.ponder_move = result.ponder
 
-                if self.is_nomove_number_in_variation:
-                    spv = self.short_variation_san()
-                    self.pv = spv
-                else:
-                    self.pv = self.board.variation_san(self.pv)
+                self.pv = self.pv_renderer.render(
+                    self.board, self.pv, not self.is_nomove_number_in_variation)
             except Exception:
                 self.pv = None
                 logging.exception('pv is missing.')
 
             if self.pv is not None:
-                info_to_send = '{:+5.2f} | {} | {:0.1f}s | {} info_all'.format(
-                    self.score, self.depth, self.time, self.pv)
-                self.eng_queue.put('{}'.format(info_to_send))
+                self.put(SearchInfo, self.score, self.depth, self.time, self.pv)
             self.bm = result.move
 
         # Apply engine move delay if movetime is small
-        if self.is_move_delay:
+        if self.is_move_delay and not self.is_ponder_hit:
             while True:
                 if time.perf_counter() - start_time >= self.move_delay_sec:
                     break
                 logging.info('Delay sending of best move {}'.format(self.bm))
-                time.sleep(1.0)
+                await asyncio.sleep(1.0)
 
         # If bm is None, we will use engine.play()
         if self.bm is None:
             logging.info('bm is none, we will try engine,play().')
             try:
-                result = self.engine.play(self.board, limit)
+                result = await protocol.play(self.board, limit, game=self.game)
                 self.bm = result.move
-            except Exception:
+            except Exception as e:
                 logging.exception('Failed to get engine bestmove.')
-        self.eng_queue.put(f'bestmove {self.bm}')
+                self.put(EngineError, f'Failed to get bestmove: {e}')
+        self.put(BestMove, self.bm)
         logging.info(f'bestmove {self.bm}')
 
+    def put(self, message_type, *fields):
+        """Send a message of this search to the GUI."""
+        self.eng_queue.put(message_type(self.engine_id_name, self.search_id, *fields))
+
+    def send_info(self, info, start_time):
+        """Save search info and send it to the GUI."""
+        if 'depth' in info:
+            self.depth = int(info['depth'])
+
+        if 'score' in info:
+            self.score = int(info['score'].relative.score(mate_score=32000))/100
+
+        self.time = info['time'] if 'time' in info else time.perf_counter() - start_time
+
+        if 'pv' in info and not ('upperbound' in info or
+                                 'lowerbound' in info):
+            self.pv = self.pv_renderer.render(
+                self.board, info['pv'][0:self.pv_length],
+                not self.is_nomove_number_in_variation)
+
+            self.put(PvInfo, self.pv)
+            self.bm = info['pv'][0]
+            self.ponder_move = info['pv'][1] if len(info['pv']) > 1 else None
+
+        # score, depth, time, pv
+        if self.score is not None and \
+                self.pv is not None and self.depth is not None:
+            self.put(SearchInfo, self.score, self.depth, self.time, self.pv)
+
+    def get_move_time_sec(self) -> float:
+        """Estimated search time of this move under the time control."""
+        if self.tc_type == 'timepermove':
+            return self.base_ms / 1000
+        return self.base_ms / 1000 / self.moves_to_go + self.inc_ms / 1000
+
+    async def search_ponder_hit(self):
+        """Continue the ponder search until the time of this move is used.
+
+        The time spent pondering counts, so after a long think of the user
+        the engine moves right away with the deeper search.
+        """
+        move_time_sec = self.get_move_time_sec()
+        logging.info('Ponder hit after {:0.1f}s, move time is {:0.1f}s.'.format(
+            self.ponder.elapsed(), move_time_sec))
+
+        while not self._kill.is_set():
+            info = await self.ponder.get_info(self.info_interval_sec)
+            if info is not None:
+                try:
+                    self.send_info(info, self.ponder.start_time)
+                except Exception:
+                    logging.exception('Failed to parse search info.')
+
+            if self.ponder.is_done or self.ponder.elapsed() >= move_time_sec:
+                break
+
+            if self.depth is not None and self.depth >= self.max_depth \
+                    and self.max_depth != MAX_DEPTH:
+                logging.info('Max depth limit is reached.')
+                break
+
+        await self.ponder.finish()
+
     def quit_engine(self):
-        """Quit engine."""
-        logging.info('quit engine')
-        try:
-            self.engine.quit()
-        except AttributeError:
-            logging.info('AttributeError, self.engine is already None')
-        except Exception:
-            logging.exception('Failed to quit engine.')
+        """Quit engine, unless it belongs to a session that outlives this search."""
+        if self.is_own_session:
+            self.session.close()
 
     def short_variation_san(self):
         """Returns variation in san but without move numbers."""
-        if self.pv is None:
-            return None
+        return self.pv_renderer.render(self.board, self.pv)
+
 
-        short_san_pv = []
-        tmp_board = self.board.copy()
-        for pc_move in self.pv:
-            san_move = tmp_board.san(pc_move)
-            short_san_pv.append(san_move)
-            tmp_board.push(pc_move)
+class EngineAdviser:
+    info_interval_sec = 0.25  # Lines are sent to the GUI at most this often
+    pv_length = 6
 
-        return ' '.join(short_san_pv)
+    def __init__(self, eng_queue, session, multipv=3, game=None):
+        """Keeps one engine in infinite MultiPV analysis of the game.
+
+        follow() points the analysis at a new position, the engine keeps
+        its process and hash, so advice for the new position builds on
+        the search of the previous one. The top lines are sent to the GUI
+        as AdviserInfo messages. Everything runs on the EngineOrchestrator
+        loop.
+
+        Args:
+          eng_queue: GUI queue
+          session: EngineSession of the adviser engine
+          multipv: number of lines to show
+          game: object identifying the game, see RunEngine
+        """
+        self.eng_queue = eng_queue
+        self.session = session
+        self.multipv = multipv
+        self.game = game
+        self.search_id = None
+        self.orchestrator = EngineOrchestrator.get()
+        self._analysis = None
+        self._task = None
+
+    def follow(self, board):
+        """Analyse board from now on, can be called from any thread.
+
+        Returns:
+          The search_id of the AdviserInfo messages of this position.
+        """
+        search_id = next(RunEngine._search_ids)
+        self.search_id = search_id
+        self.orchestrator.call_soon(self._restart, board.copy(), search_id)
+        return search_id
+
+    def pause(self):
+        """Stop analysing, the engine keeps running."""
+        self.search_id = None
+        self.orchestrator.call_soon(self._restart, None, None)
+
+    def stop(self):
+        """Stop analysing and wait until the engine is idle."""
+        self.search_id = None
+        self.orchestrator.call(self._finish())
+
+    def _restart(self, board, search_id):
+        if self._analysis is not None:
+            self._analysis.stop()
+        if board is not None:
+            self._task = self.orchestrator.loop.create_task(
+                self._analyse(board, search_id, self._task))
+
+    async def _finish(self):
+        self._restart(None, None)
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _analyse(self, board, search_id, previous):
+        # The engine runs one command at a time, let the last analysis end
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+
+        # Already pointed at another position
+        if search_id != self.search_id:
+            return
+
+        try:
+            engine, _ = await self.session.get_engine_async()
+            renderers = [PvSanRenderer() for _ in range(self.multipv)]
+            sent_time = 0.0
+
+            with await engine.protocol.analysis(board, multipv=self.multipv,
+                                                game=self.game) as analysis:
+                self._analysis = analysis
+                async for _ in analysis:
+                    if search_id != self.search_id:
+                        break
+                    if time.perf_counter() - sent_time >= self.info_interval_sec:
+                        self.put(search_id, board, analysis.multipv, renderers)
+                        sent_time = time.perf_counter()
+        except Exception:
+            logging.exception('Adviser analysis failed.')
+        finally:
+            self._analysis = None
+
+    def put(self, search_id, board, multipv, renderers):
+        """Send the current lines to the GUI."""
+        lines = []
+        for info, renderer in zip(multipv, renderers):
+            if 'pv' not in info or 'score' not in info:
+                continue
+            score = int(info['score'].relative.score(mate_score=32000))/100
+            pv = renderer.render(board, info['pv'][0:self.pv_length])
+            lines.append('{:+5.2f} | {} | {}'.format(score, info.get('depth', 0), pv))
+
+        if lines:
+            self.eng_queue.put(AdviserInfo(self.session.engine_id_name, search_id, lines))
 
 
 class EasyChessGui:
@@ -669,6 +1627,7 @@ class EasyChessGui:
         self.theme = theme
         self.user_config_file = user_config_file
         self.engine_config_file = engine_config_file
+        self.engine_config = EngineConfigRegistry.for_file(engine_config_file)
         self.gui_book_file = gui_book_file
         self.computer_book_file = computer_book_file
         self.human_book_file = human_book_file
@@ -685,12 +1644,25 @@ class EasyChessGui:
         self.adviser_hash = 128
         self.adviser_threads = 1
         self.adviser_movetime_sec = 10
+        self.is_adviser_continuous = False
+        self.adviser_multipv = 3
+        self.adviser = None
+        self.adviser_lease = None
+        self.engine_pool = EnginePool(self.engine_config_file)
+        self.opp_lease = None
+        self.mentor_lease = None
         self.pecg_auto_save_game = 'pecg_auto_save_games.pgn'
         self.my_games = 'pecg_my_games.pgn'
         self.repertoire_file = {
             'white': 'pecg_white_repertoire.pgn',
             'black': 'pecg_black_repertoire.pgn'
         }
+        self.repertoire = {color: RepertoireIndex(pgn_file)
+                           for color, pgn_file in self.repertoire_file.items()}
+        self.repertoire_line = None
+        self.repertoire_cancel_event = None
+        self.game_store_file = 'pecg_games.sqlite3'
+        self.game_store = None
         self.init_game()
         self.fen = None
         self.psg_board = None
@@ -721,17 +1693,159 @@ class EasyChessGui:
 
         self.is_save_time_left = False
         self.is_save_user_comment = True
+        self.is_engine_ponder = False
 
-        # Initialize Chess Mentor for AI move evaluation
+        # Initialize Chess Mentor for AI move evaluation, it runs on a
+        # background worker so the board never waits for it.
         self.chess_mentor = None
+        self.mentor_worker = None
+        self.mentor_job_id = None
+        self.mentor_depth = 15
         self.use_ai_mentor = True
         try:
-            self.chess_mentor = ChessMentor(use_gemini=True)
+            self.chess_mentor = ChessMentor(
+                use_gemini=True, engine_provider=self.get_mentor_engine,
+                engine_submit=EngineOrchestrator.get().submit)
+            self.mentor_worker = MentorWorker(self.chess_mentor, self.queue)
             logging.info('ChessMentor initialized successfully')
         except Exception as e:
             logging.warning(f'Failed to initialize ChessMentor: {e}')
             self.use_ai_mentor = False
 
+    def get_opponent_session(self):
+        """Returns the engine session of the current opponent.
+
+        The lease is kept while the same opponent is selected, when the user
+        selects another engine the old one goes back to the pool.
+        """
+        if self.opp_lease is not None and (
+                self.opp_lease.session.engine_id_name != self.opp_id_name or
+                self.opp_lease.session.engine_path_and_file != self.opp_path_and_file):
+            self.opp_lease.release()
+            self.opp_lease = None
+
+        if self.opp_lease is None:
+            self.opp_lease = self.engine_pool.acquire(
+                self.opp_id_name, self.opp_path_and_file, 'opponent')
+
+        return self.opp_lease.session
+
+    def get_mentor_engine(self):
+        """Returns the running engine of the mentor, called from its worker.
+
+        The mentor uses the configured engine with the same executable as
+        its Stockfish, so options like Hash and Threads from
+        pecg_engines.json apply. An engine not in the config runs with
+        default options.
+        """
+        if self.mentor_lease is None:
+            path = self.chess_mentor.stockfish_path
+            if path is None:
+                return None
+
+            engine_id_name = path
+            for id_name in self.get_engine_id_name_list():
+                _, eng_path_and_file = self.get_engine_file(id_name)
+                if Path(eng_path_and_file).resolve() == Path(path).resolve():
+                    engine_id_name, path = id_name, eng_path_and_file
+                    break
+
+            self.mentor_lease = self.engine_pool.acquire(
+                engine_id_name, path, 'mentor')
+
+        engine, _ = self.mentor_lease.session.get_engine()
+        return engine
+
+    def follow_adviser(self, board):
+        """Points the continuous adviser at board, it is started if needed."""
+        if self.adviser_path_and_file is None:
+            return
+
+        if self.adviser is None:
+            self.adviser_lease = self.engine_pool.acquire(
+                self.adviser_id_name, self.adviser_path_and_file, 'adviser')
+            self.adviser = EngineAdviser(
+                self.queue, self.adviser_lease.session,
+                multipv=self.adviser_multipv, game=self.game)
+
+        self.adviser.follow(board)
+
+    def pause_adviser(self):
+        """Stops the continuous adviser analysis until the next follow."""
+        if self.adviser is not None:
+            self.adviser.pause()
+
+    def stop_adviser(self):
+        """Stops the continuous adviser and returns its engine to the pool."""
+        if self.adviser is None:
+            return
+        self.adviser.stop()
+        self.adviser = None
+        self.adviser_lease.release()
+        self.adviser_lease = None
+
+    def update_adviser_info(self, window, msg):
+        """Shows the lines of the continuous adviser for the current position."""
+        if self.adviser is None or msg.search_id != self.adviser.search_id:
+            return
+        window.Element('advise_info_k').Update('\n'.join(msg.lines))
+
+    def get_repertoire_line(self, window, board):
+        """Follows the game in the user's repertoire.
+
+        New games of the repertoire pgn are indexed in a thread, a changed
+        pgn may be indexed again. RepertoireReady is put in the queue when
+        it is done, the line is then refreshed by update_repertoire_line.
+        An update that is still running for an earlier line is cancelled.
+        """
+        repertoire = self.repertoire['white' if self.is_user_white else 'black']
+        repertoire_line = RepertoireLine(repertoire, board)
+        window.Element('repertoire_k').Update(repertoire_line.get_text())
+
+        if self.repertoire_cancel_event is not None:
+            self.repertoire_cancel_event.set()
+        cancel_event = threading.Event()
+
+        def update_index():
+            try:
+                if repertoire.update(cancel_event=cancel_event) is not None:
+                    self.queue.put(RepertoireReady(repertoire_line))
+            except Exception:
+                logging.exception(f'Failed to index {repertoire.pgn_file}.')
+
+        self.repertoire_line = repertoire_line
+        self.repertoire_cancel_event = cancel_event
+        threading.Thread(target=update_index, daemon=True).start()
+
+        return repertoire_line
+
+    def update_repertoire_line(self, window, msg):
+        """Follows the game again in the updated repertoire index."""
+        if msg.line is not self.repertoire_line:
+            return
+        msg.line.refresh()
+        window.Element('repertoire_k').Update(msg.line.get_text())
+
+    def follow_repertoire(self, window, repertoire_line, board, move):
+        """Checks a move against the repertoire, board is the position before the move.
+
+        The move is kept after the game left the repertoire, the line is
+        followed again when the index update of get_repertoire_line is done.
+        """
+        is_in_repertoire = repertoire_line.is_in_repertoire
+        repertoire_line.push(board, move)
+        if is_in_repertoire:
+            window.Element('repertoire_k').Update(repertoire_line.get_text())
+
+    def close_engines(self):
+        """Quit engine processes that are kept between searches."""
+        if self.mentor_worker:
+            self.mentor_worker.shutdown()
+        self.stop_adviser()
+        self.engine_pool.close()
+        self.opp_lease = None
+        self.mentor_lease = None
+
     def update_game(self, mc: int, user_move: str, time_left: int, user_comment: str):
         """Saves moves in the game.
 
@@ -809,6 +1923,10 @@ class EasyChessGui:
         """
         Delete games of player name in pgn.
 
+        Only the tags of the games are parsed, the games that are kept are
+        copied byte for byte. The original file stays as the .backup, a hard
+        link if the file system supports it.
+
         :param name:
         :param pgn:
         :param que:
@@ -822,72 +1940,181 @@ class EasyChessGui:
         file = PurePath(pgn)
         pgn_file = file.name
 
-        # Create backup of orig
+        # Create backup of orig, the orig is replaced and not modified so a
+        # hard link keeps its content.
         backup = pgn_file + '.backup'
         backup_path = Path(folder_path, backup)
-        backup_path.touch()
-        origfile_text = Path(pgn).read_text()
-        backup_path.write_text(origfile_text)
+        if backup_path.exists():
+            backup_path.unlink()
+        try:
+            os.link(pgn_path, backup_path)
+        except OSError:
+            shutil.copyfile(pgn_path, backup_path)
         logging.info(f'backup copy {backup_path} is successfully created.')
 
         # Define output file
         output = 'out_' + pgn_file
         output_path = Path(folder_path, output)
-        logging.info(f'output {output_path} is successfully created.')
 
         logging.info(f'Deleting player {name}.')
         gcnt = 0
-
-        # read pgn and save each game if player name to be deleted is not in
-        # the game, either white or black.
-        with open(output_path, 'a') as f:
-            with open(pgn_path) as h:
-                game = chess.pgn.read_game(h)
-                while game:
+        deleted = 0
+        report_time = time.perf_counter()
+
+        # Copy each game if player name to be deleted is not in the game,
+        # either white or black.
+        with open(output_path, 'wb') as f:
+            with open(pgn_path, 'rb') as h:
+                for headers, raw in pgn_tools.iter_raw_games(h):
                     gcnt += 1
-                    que.put('Delete, {}, processing game {}'.format(
-                        name, gcnt))
-                    wp = game.headers['White']
-                    bp = game.headers['Black']
+                    wp = headers.get('White', '?')
+                    bp = headers.get('Black', '?')
 
                     # If this game has no player with name to be deleted
                     if wp != name and bp != name:
-                        f.write('{}\n\n'.format(game))
-                    game = chess.pgn.read_game(h)
+                        f.write(raw)
+                    else:
+                        deleted += 1
 
-        if output_path.exists():
-            logging.info(f'Deleting player {name} is successful.')
+                    # Do not flood the gui with a message per game
+                    if time.perf_counter() - report_time >= 0.1:
+                        report_time = time.perf_counter()
+                        que.put('Delete, {}, processing game {}'.format(
+                            name, gcnt))
 
-            # Delete the orig file and rename the current output to orig file
-            pgn_path.unlink()
-            logging.info('Delete orig pgn file')
-            output_path.rename(pgn_path)
-            logging.info('Rename output to orig pgn file')
+        # Replace the orig file with the output
+        os.replace(output_path, pgn_path)
+        logging.info(f'Deleting player {name} is successful, {deleted} of {gcnt} games deleted.')
 
         que.put('Done')
 
-    def get_players(self, pgn, q):
+    def get_players(self, pgn, q, cancel_event=None):
+        """Puts the players and the number of games of a pgn in q.
+
+        The pgn is read only if its header index is missing or outdated, a
+        large pgn by a process pool. Progress is put in q as a string, and
+        None if cancel_event is set before the index is done.
+        """
         logging.info('Enters get_players()')
-        players = []
-        games = 0
-        with open(pgn) as h:
-            while True:
-                headers = chess.pgn.read_headers(h)
-                if headers is None:
-                    break
 
-                wp = headers['White']
-                bp = headers['Black']
+        def progress(done, total):
+            q.put('Display Players: reading pgn {:.0f}%'.format(100 * done / max(1, total)))
 
-                players.append(wp)
-                players.append(bp)
-                games += 1
+        index = PgnHeaderIndex.for_file(pgn)
+        if index.update(progress=progress, cancel_event=cancel_event) is None:
+            q.put(None)
+            return
 
-        p = list(set(players))
-        ret = [p, games]
+        p = list(index.get_players())
+        ret = [p, len(index)]
 
         q.put(ret)
 
+    def update_game_index(self, pgn):
+        """Adds the game just appended to pgn to its header index.
+
+        A pgn that has no index yet is indexed later by get_players, not
+        in the gui thread.
+        """
+        try:
+            PgnHeaderIndex.for_file(pgn).update(is_rebuild_allowed=False)
+        except Exception:
+            logging.exception(f'Failed to update the index of {pgn}.')
+
+    def open_game_store(self):
+        """Opens the game store, imports the pgn files and indexes the
+        positions of the imported games in a thread.
+
+        Pgn files that are already imported are skipped, an import that
+        was interrupted when the gui was closed goes on. Where each import
+        ends is recorded before the thread starts, so a game the gui saves
+        while the files are imported is not imported again.
+        """
+        try:
+            self.game_store = GameStore.for_file(self.game_store_file)
+        except Exception:
+            logging.exception(f'Failed to open {self.game_store_file}, games are saved to pgn only.')
+            return
+
+        store_pgn = [('auto_save', self.pecg_auto_save_game),
+                     ('my_games', self.my_games),
+                     ('white_repertoire', self.repertoire_file['white']),
+                     ('black_repertoire', self.repertoire_file['black'])]
+        try:
+            for collection, pgn in store_pgn:
+                self.game_store.begin_import(pgn, collection)
+        except Exception:
+            logging.exception(f'Failed to begin the import to {self.game_store_file}, '
+                              f'games are saved to pgn only.')
+            self.game_store = None
+            return
+
+        def import_games():
+            for collection, pgn in store_pgn:
+                try:
+                    if os.path.isfile(pgn) and not self.game_store.is_imported(pgn):
+                        self.game_store.import_pgn(pgn, collection)
+                except Exception:
+                    logging.exception(f'Failed to import {pgn} to the game store.')
+            try:
+                self.game_store.index_positions()
+            except Exception:
+                logging.exception('Failed to index the positions of the game store.')
+
+        threading.Thread(target=import_games, daemon=True).start()
+
+    def store_game(self, collection):
+        """Saves the game to a collection of the game store.
+
+        The pgn files are written before, so a failure here loses nothing.
+        """
+        if self.game_store is None:
+            return
+        try:
+            self.game_store.add_game(self.game, collection)
+        except Exception:
+            logging.exception(f'Failed to save the game to the {collection} games.')
+
+    def find_games(self, board):
+        """Shows the saved games that reached the position of board.
+
+        :param board: current board position
+        """
+        win_title = 'Game/Find Games'
+        if self.game_store is None:
+            sg.Popup('The game store is not available.', title=win_title,
+                     icon=ico_path[platform]['pecg'])
+            return
+
+        t1 = time.perf_counter()
+        try:
+            games = self.game_store.find_position(board, limit=200)
+        except Exception:
+            logging.exception('Failed to find games.')
+            return
+        elapse_ms = 1000 * (time.perf_counter() - t1)
+
+        game_list = ['{} {} - {} {}, ply {} ({})'.format(
+            row.date, row.white, row.black, row.result, ply, row.collection)
+            for row, ply in games]
+        layout = [
+            [sg.Text('{} games reached this position, {:.0f}ms'.format(
+                len(games) if len(games) < 200 else '200+', elapse_ms), size=(60, 1))],
+            [sg.Listbox(game_list, size=(70, 10), key='game_k', enable_events=True)],
+            [sg.Multiline('', size=(70, 12), key='pgn_k', disabled=True)],
+            [sg.Button('Close')]
+        ]
+
+        w = sg.Window(win_title, layout, modal=True, icon=ico_path[platform]['pecg'])
+        while True:
+            e, v = w.Read()
+            if e is None or e == 'Close':
+                break
+            if e == 'game_k' and v['game_k']:
+                row, _ = games[game_list.index(v['game_k'][0])]
+                w.Element('pgn_k').Update(self.game_store.get_pgn(row.id) or '')
+        w.Close()
+
     def get_engine_id_name(self, path_and_file, q):
         """ Returns id name of uci engine """
         id_name = None
@@ -896,11 +2123,11 @@ class EasyChessGui:
 
         try:
             if sys_os == 'Windows':
-                engine = chess.engine.SimpleEngine.popen_uci(
+                engine = EngineOrchestrator.get().popen_uci(
                     path_and_file, cwd=folder,
                     creationflags=subprocess.CREATE_NO_WINDOW)
             else:
-                engine = chess.engine.SimpleEngine.popen_uci(
+                engine = EngineOrchestrator.get().popen_uci(
                     path_and_file, cwd=folder)
             id_name = engine.id['name']
             engine.quit()
@@ -911,23 +2138,11 @@ class EasyChessGui:
 
     def get_engine_hash(self, eng_id_name):
         """ Returns hash value from engine config file """
-        eng_hash = None
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-            for p in data:
-                if p['name'] == eng_id_name:
-                    # There engines without options
-                    try:
-                        for n in p['options']:
-                            if n['name'].lower() == 'hash':
-                                return n['value']
-                    except KeyError:
-                        logging.info(f'This engine {eng_id_name} has no option.')
-                        break
-                    except Exception:
-                        logging.exception('Failed to get engine hash.')
+        config = self.engine_config.get(eng_id_name)
+        if config is None:
+            return None
 
-        return eng_hash
+        return config.option_value('hash')
 
     def get_engine_threads(self, eng_id_name):
         """
@@ -936,22 +2151,11 @@ class EasyChessGui:
         :param eng_id_name: the engine id name
         :return: number of threads
         """
-        eng_threads = None
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-            for p in data:
-                if p['name'] == eng_id_name:
-                    try:
-                        for n in p['options']:
-                            if n['name'].lower() == 'threads':
-                                return n['value']
-                    except KeyError:
-                        logging.info(f'This engine {eng_id_name} has no options.')
-                        break
-                    except Exception:
-                        logging.exception('Failed to get engine threads.')
+        config = self.engine_config.get(eng_id_name)
+        if config is None:
+            return None
 
-        return eng_threads
+        return config.option_value('threads')
 
     def get_engine_file(self, eng_id_name):
         """
@@ -960,17 +2164,11 @@ class EasyChessGui:
         :param eng_id_name: engine id name
         :return: engine file and its path
         """
-        eng_file, eng_path_and_file = None, None
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-            for p in data:
-                if p['name'] == eng_id_name:
-                    eng_file = p['command']
-                    eng_path_and_file = Path(p['workingDirectory'],
-                                             eng_file).as_posix()
-                    break
+        config = self.engine_config.get(eng_id_name)
+        if config is None:
+            return None, None
 
-        return eng_file, eng_path_and_file
+        return config.command, config.path_and_file
 
     def get_engine_id_name_list(self):
         """
@@ -978,16 +2176,7 @@ class EasyChessGui:
 
         :return: list of engine id names
         """
-        eng_id_name_list = []
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-            for p in data:
-                if p['protocol'] == 'uci':
-                    eng_id_name_list.append(p['name'])
-
-        eng_id_name_list = sorted(eng_id_name_list)
-
-        return eng_id_name_list
+        return self.engine_config.names('uci')
 
     def update_user_config_file(self, username):
         """
@@ -1053,8 +2242,7 @@ class EasyChessGui:
         file = PurePath(eng_path_file)
         file = file.name
 
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
+        data = self.engine_config.data()
 
         for p in data:
             command = p['command']
@@ -1081,8 +2269,7 @@ class EasyChessGui:
                 break
 
         # Save data to pecg_engines.json
-        with open(self.engine_config_file, 'w') as h:
-            json.dump(data, h, indent=4)
+        self.engine_config.save(data)
 
     def is_name_exists(self, name):
         """
@@ -1090,15 +2277,7 @@ class EasyChessGui:
         :param name: The name to check in pecg.engines.json file.
         :return:
         """
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
-
-        for p in data:
-            jname = p['name']
-            if jname == name:
-                return True
-
-        return False
+        return self.engine_config.exists(name)
 
     def add_engine_to_config_file(self, engine_path_and_file, pname, que):
         """
@@ -1114,16 +2293,15 @@ class EasyChessGui:
 
         option = []
 
-        with open(self.engine_config_file, 'r') as json_file:
-            data = json.load(json_file)
+        data = self.engine_config.data()
 
         try:
             if sys_os == 'Windows':
-                engine = chess.engine.SimpleEngine.popen_uci(
+                engine = EngineOrchestrator.get().popen_uci(
                     engine_path_and_file, cwd=folder,
                     creationflags=subprocess.CREATE_NO_WINDOW)
             else:
-                engine = chess.engine.SimpleEngine.popen_uci(
+                engine = EngineOrchestrator.get().popen_uci(
                     engine_path_and_file, cwd=folder)
         except Exception:
             logging.exception(f'Failed to add {pname} in config file.')
@@ -1180,8 +2358,7 @@ class EasyChessGui:
                      'options': option})
 
         # Save data to pecg_engines.json
-        with open(self.engine_config_file, 'w') as h:
-            json.dump(data, h, indent=4)
+        self.engine_config.save(data)
 
         que.put('Success')
 
@@ -1212,11 +2389,11 @@ class EasyChessGui:
 
             try:
                 if sys_os == 'Windows':
-                    engine = chess.engine.SimpleEngine.popen_uci(
+                    engine = EngineOrchestrator.get().popen_uci(
                         engine_path_and_file, cwd=folder,
                         creationflags=subprocess.CREATE_NO_WINDOW)
                 else:
-                    engine = chess.engine.SimpleEngine.popen_uci(
+                    engine = EngineOrchestrator.get().popen_uci(
                         engine_path_and_file, cwd=folder)
             except Exception:
                 logging.exception(f'Failed to start engine {fn}!')
@@ -1266,8 +2443,7 @@ class EasyChessGui:
                          'options': option})
 
         # Save data to pecg_engines.json
-        with open(self.engine_config_file, 'w') as h:
-            json.dump(data, h, indent=4)
+        self.engine_config.save(data)
 
     def get_time_mm_ss_ms(self, time_ms):
         """ Returns time in min:sec:millisec given time in millisec """
@@ -1295,20 +2471,19 @@ class EasyChessGui:
     def update_text_box(self, window, msg, is_hide):
         """ Update text elements """
         best_move = None
-        msg_str = str(msg)
-
-        if 'bestmove ' not in msg_str:
-            if 'info_all' in msg_str:
-                info_all = ' '.join(msg_str.split()[0:-1]).strip()
-                msg_line = '{}\n'.format(info_all)
-                window.find_element('search_info_all_k').Update(
-                        '' if is_hide else msg_line)
-        else:
+
+        if isinstance(msg, SearchInfo):
+            msg_line = '{:+5.2f} | {} | {:0.1f}s | {}\n'.format(
+                msg.score, msg.depth, msg.time, msg.pv)
+            window.find_element('search_info_all_k').Update(
+                    '' if is_hide else msg_line)
+        elif isinstance(msg, EngineError):
+            logging.warning(f'{msg.source} error: {msg.error}')
+        elif isinstance(msg, BestMove):
             # Best move can be None because engine dies
-            try:
-                best_move = chess.Move.from_uci(msg.split()[1])
-            except Exception:
-                logging.exception(f'Engine sent {best_move}')
+            best_move = msg.move
+            if best_move is None:
+                logging.error(f'{msg.source} sent no bestmove.')
                 sg.Popup(
                     f'Engine error, it sent a {best_move} bestmove.\n \
                     Back to Neutral mode, it is better to change engine {self.opp_id_name}.',
@@ -1318,6 +2493,29 @@ class EasyChessGui:
 
         return best_move
 
+    def update_mentor_comment(self, window, msg):
+        """Shows mentor analysis in the AI Coach box if it is for the last user move."""
+        if msg.job_id != self.mentor_job_id:
+            logging.info(f'Drop stale mentor analysis of {msg.san}.')
+            return
+        window.find_element('comment_k').Update(msg.text, disabled=True)
+
+    def poll_mentor_result(self, window):
+        """Shows mentor analysis that arrived while no engine is searching."""
+        try:
+            msg = self.queue.get_nowait()
+        except Exception:
+            return
+
+        if isinstance(msg, MentorResult):
+            self.update_mentor_comment(window, msg)
+        elif isinstance(msg, AdviserInfo):
+            self.update_adviser_info(window, msg)
+        elif isinstance(msg, RepertoireReady):
+            self.update_repertoire_line(window, msg)
+        else:
+            logging.info(f'Drop engine msg {type(msg).__name__} after its search.')
+
     def get_tag_date(self):
         """ Return date in pgn tag date format """
         return datetime.today().strftime('%Y.%m.%d')
@@ -1353,6 +2551,7 @@ class EasyChessGui:
         window.find_element('polyglot_book1_k').Update('')
         window.find_element('polyglot_book2_k').Update('')
         window.find_element('advise_info_k').Update('')
+        window.find_element('repertoire_k').Update('')
         window.find_element('comment_k').Update('')
         window.Element('w_base_time_k').Update('')
         window.Element('b_base_time_k').Update('')
@@ -1734,6 +2933,7 @@ class EasyChessGui:
 
         # Set engine search depth based on difficulty
         self.max_depth = search_depth
+        self.game.headers['Difficulty'] = difficulty
 
         window.find_element('_movelist_').Update(disabled=False)
         window.find_element('_movelist_').Update('', disabled=True)
@@ -1767,6 +2967,15 @@ class EasyChessGui:
         human_timer = self.define_timer(window)
         engine_timer = self.define_timer(window, 'engine')
 
+        # Opponent search of the expected user move, runs on the user's clock
+        ponder = None
+
+        # Whether the game still follows the user's repertoire
+        repertoire_line = self.get_repertoire_line(window, board)
+
+        # Right click Stop on the adviser pauses the continuous adviser
+        is_adviser_paused = False
+
         # Game loop
         while not board.is_game_over(claim_draw=True):
             moved_piece = None
@@ -1828,6 +3037,7 @@ class EasyChessGui:
                             continue
 
                         self.fen_to_psg_board(window)
+                        repertoire_line = self.get_repertoire_line(window, board)
 
                         # If user is black and side to move is black
                         if not self.is_user_white and not board.turn:
@@ -1865,6 +3075,18 @@ class EasyChessGui:
             if is_human_stm:
                 move_state = 0
 
+                # Let the mentor look at the position while the user thinks,
+                # unless the opponent is pondering, both would share the cpu.
+                if self.use_ai_mentor and self.mentor_worker and ponder is None:
+                    self.mentor_worker.pre_analyze(board, depth=self.mentor_depth)
+
+                # Continuous adviser follows the positions of the user
+                if self.is_adviser_continuous and not is_adviser_paused:
+                    self.follow_adviser(board)
+
+                # Keeps running if the loop is re-entered on the same move
+                human_timer.start()
+
                 while True:
                     button, value = window.Read(timeout=100)
 
@@ -1874,13 +3096,25 @@ class EasyChessGui:
                     if not self.is_user_white:
                         k = 'b_elapse_k'
                     window.Element(k).Update(elapse_str)
-                    human_timer.elapse += 100
 
                     if not is_human_stm:
                         break
 
+                    self.poll_mentor_result(window)
+
+                    # Mode: Play, Stm: User, Continuous adviser
+                    if self.is_adviser_continuous:
+                        if button == 'Start::right_adviser_k':
+                            is_adviser_paused = False
+                            self.follow_adviser(board)
+                        if button == 'Stop::right_adviser_k':
+                            is_adviser_paused = True
+                            self.pause_adviser()
+
                     # Mode: Play, Stm: User, Run adviser engine
-                    if button == 'Start::right_adviser_k':
+                    elif button == 'Start::right_adviser_k':
+                        if self.mentor_worker:
+                            self.mentor_worker.stop_pre_analysis()
                         self.adviser_threads = self.get_engine_threads(
                             self.adviser_id_name)
                         self.adviser_hash = self.get_engine_hash(
@@ -1888,16 +3122,19 @@ class EasyChessGui:
                         adviser_base_ms = self.adviser_movetime_sec * 1000
                         adviser_inc_ms = 0
 
+                        adviser_lease = self.engine_pool.acquire(
+                            self.adviser_id_name, self.adviser_path_and_file,
+                            'adviser')
                         search = RunEngine(
                             self.queue, self.engine_config_file,
                             self.adviser_path_and_file, self.adviser_id_name,
                             self.max_depth, adviser_base_ms, adviser_inc_ms,
                             tc_type='timepermove',
                             period_moves=0,
-                            is_stream_search_info=True
+                            is_stream_search_info=True,
+                            session=adviser_lease.session
                         )
                         search.get_board(board)
-                        search.daemon = True
                         search.start()
 
                         while True:
@@ -1912,14 +3149,29 @@ class EasyChessGui:
                                 is_search_stop_for_exit = True
                             try:
                                 msg = self.queue.get_nowait()
-                                if 'pv' in msg:
-                                    # Reformat msg, remove the word pv at the end
-                                    msg_line = ' '.join(msg.split()[0:-1])
-                                    window.Element('advise_info_k').Update(msg_line)
                             except Exception:
                                 continue
 
-                            if 'bestmove' in msg:
+                            if isinstance(msg, MentorResult):
+                                self.update_mentor_comment(window, msg)
+                                continue
+                            if isinstance(msg, AdviserInfo):
+                                self.update_adviser_info(window, msg)
+                                continue
+                            if isinstance(msg, RepertoireReady):
+                                self.update_repertoire_line(window, msg)
+                                continue
+
+                            # Messages of an earlier search
+                            if not isinstance(msg, ENGINE_MESSAGES) or \
+                                    msg.search_id != search.search_id:
+                                continue
+
+                            if isinstance(msg, PvInfo):
+                                msg_line = msg.pv
+                                window.Element('advise_info_k').Update(msg_line)
+
+                            if isinstance(msg, BestMove):
                                 # bestmove can be None so we do try/except
                                 try:
                                     # Shorten msg line to 3 ply moves
@@ -1938,7 +3190,7 @@ class EasyChessGui:
                                 break
 
                         search.join()
-                        search.quit_engine()
+                        adviser_lease.release()
                         break
 
                     # Mode: Play, Stm: user
@@ -1993,6 +3245,8 @@ class EasyChessGui:
                         with open(self.my_games, mode='a+') as f:
                             self.game.headers['Event'] = 'My Games'
                             f.write('{}\n\n'.format(self.game))
+                        self.update_game_index(self.my_games)
+                        self.store_game('my_games')
                         break
 
                     # Mode: Play, Stm: user
@@ -2000,6 +3254,8 @@ class EasyChessGui:
                         with open(self.repertoire_file['white'], mode='a+') as f:
                             self.game.headers['Event'] = 'White Repertoire'
                             f.write('{}\n\n'.format(self.game))
+                        self.store_game('white_repertoire')
+                        repertoire_line = self.get_repertoire_line(window, board)
                         break
 
                     # Mode: Play, Stm: user
@@ -2007,6 +3263,13 @@ class EasyChessGui:
                         with open(self.repertoire_file['black'], mode='a+') as f:
                             self.game.headers['Event'] = 'Black Repertoire'
                             f.write('{}\n\n'.format(self.game))
+                        self.store_game('black_repertoire')
+                        repertoire_line = self.get_repertoire_line(window, board)
+                        break
+
+                    # Mode: Play, stm: User
+                    if button == 'Find Games::find_games_k':
+                        self.find_games(board)
                         break
 
                     # Mode: Play, stm: User
@@ -2051,6 +3314,8 @@ class EasyChessGui:
 
                     # Mode: Play, stm: User
                     if button == 'Go':
+                        if self.mentor_worker:
+                            self.mentor_worker.stop_pre_analysis()
                         if is_human_stm:
                             is_human_stm = False
                         else:
@@ -2076,6 +3341,7 @@ class EasyChessGui:
                             continue
 
                         self.fen_to_psg_board(window)
+                        repertoire_line = self.get_repertoire_line(window, board)
 
                         is_human_stm = True if board.turn else False
                         is_engine_ready = True if is_human_stm else False
@@ -2166,32 +3432,24 @@ class EasyChessGui:
 
                                 board.push(user_move)
                                 move_cnt += 1
+                                self.follow_repertoire(window, repertoire_line,
+                                                       board_before_move, user_move)
 
-                                # Update clock, reset elapse to zero
+                                # Stop the clock and update the base time
                                 human_timer.update_base()
 
                                 # Update game, move from human
                                 time_left = human_timer.base
 
-                                # Get AI analysis of the move (display-only; keep PGN comments clean)
-                                user_comment_display = ''
+                                # Get AI analysis of the move in the background (display-only;
+                                # keep PGN comments clean). It replaces the analysis of the
+                                # previous move if that is not done yet.
                                 user_comment_to_save = ''
-                                if self.use_ai_mentor and self.chess_mentor:
-                                    try:
-                                        window.find_element('comment_k').Update('Analyzing move...')
-                                        window.refresh()
-
-                                        # Analyze the move
-                                        analysis = self.chess_mentor.analyze_move(board_before_move, user_move, depth=15, time_limit=1)
-                                        san_move = board_before_move.san(user_move)
-                                        user_comment_display = self.chess_mentor.format_output(san_move, analysis)
-
-                                        # Display AI analysis
-                                        window.find_element('comment_k').Update(user_comment_display, disabled=True)
-                                    except Exception as e:
-                                        logging.error(f'Error analyzing move: {e}')
-                                        user_comment_display = f'Analysis error: {str(e)}'
-                                        window.find_element('comment_k').Update(user_comment_display, disabled=True)
+                                if self.use_ai_mentor and self.mentor_worker:
+                                    window.find_element('comment_k').Update('Analyzing move...')
+                                    self.mentor_job_id = self.mentor_worker.submit(
+                                        board_before_move, user_move, depth=self.mentor_depth,
+                                        time_limit=1)
 
                                 # Do not save AI text into PGN comments; pass an empty comment string
                                 self.update_game(move_cnt, user_move, time_left, user_comment_to_save)
@@ -2219,7 +3477,7 @@ class EasyChessGui:
 
                                 # Update elapse box
                                 elapse_str = self.get_time_mm_ss_ms(
-                                    human_timer.elapse)
+                                    human_timer.last_elapse)
                                 window.Element(k1).Update(elapse_str)
 
                                 # Update remaining time box
@@ -2239,12 +3497,21 @@ class EasyChessGui:
                                 button_square.Update(button_color=('white', color))
                                 continue
 
+                # The adviser waits during the engine turn
+                self.pause_adviser()
+
                 if (is_new_game or is_exit_game or is_exit_app or
                         is_user_resigns or is_user_wins or is_user_draws):
+                    if ponder is not None:
+                        ponder.stop()
+                        ponder = None
                     break
 
             # Else if side to move is not human
             elif not is_human_stm and is_engine_ready:
+                # The user may hand the move to the engine with Engine->Go
+                human_timer.stop()
+
                 is_promote = False
                 best_move = None
                 is_book_from_gui = True
@@ -2266,10 +3533,13 @@ class EasyChessGui:
                         self.queue, self.engine_config_file, self.opp_path_and_file,
                         self.opp_id_name, self.max_depth, engine_timer.base,
                         engine_timer.inc, tc_type=engine_timer.tc_type,
-                        period_moves=board.fullmove_number
+                        period_moves=board.fullmove_number,
+                        session=self.get_opponent_session(), game=self.game,
+                        ponder=ponder
                     )
+                    ponder = None
                     search.get_board(board)
-                    search.daemon = True
+                    engine_timer.start()
                     search.start()
                     window.find_element('_gamestatus_').Update(
                             'Mode     Play, Engine is thinking ...')
@@ -2280,7 +3550,9 @@ class EasyChessGui:
                         if button == sg.WIN_CLOSED:
                             logging.warning('User closes the window while the engine is thinking.')
                             search.stop()
-                            sys.exit(0)  # the engine is run on daemon threads so it will quit as well
+                            search.join()
+                            self.close_engines()
+                            sys.exit(0)
 
                         # Update elapse box in m:s format
                         elapse_str = self.get_time_mm_ss_ms(engine_timer.elapse)
@@ -2288,7 +3560,6 @@ class EasyChessGui:
                         if not self.is_user_white:
                             k = 'w_elapse_k'
                         window.Element(k).Update(elapse_str)
-                        engine_timer.elapse += 100
 
                         # Hide/Unhide engine searching info while engine is thinking
                         if button == 'Show::right_search_info_k':
@@ -2367,14 +3638,28 @@ class EasyChessGui:
                         except Exception:
                             continue
 
-                        msg_str = str(msg)
+                        # Mentor analysis of the user move may arrive while the engine thinks
+                        if isinstance(msg, MentorResult):
+                            self.update_mentor_comment(window, msg)
+                            continue
+                        if isinstance(msg, AdviserInfo):
+                            self.update_adviser_info(window, msg)
+                            continue
+                        if isinstance(msg, RepertoireReady):
+                            self.update_repertoire_line(window, msg)
+                            continue
+
+                        # Messages of an earlier search
+                        if not isinstance(msg, ENGINE_MESSAGES) or \
+                                msg.search_id != search.search_id:
+                            continue
+
                         best_move = self.update_text_box(window, msg, is_hide_search_info)
-                        if 'bestmove' in msg_str:
-                            logging.info('engine msg: {}'.format(msg_str))
+                        if isinstance(msg, BestMove):
+                            logging.info('engine msg: {}'.format(msg))
                             break
 
                     search.join()
-                    search.quit_engine()
                     is_book_from_gui = False
 
                 # If engine failed to send a legal move
@@ -2414,12 +3699,23 @@ class EasyChessGui:
 
                 self.redraw_board(window)
 
+                self.follow_repertoire(window, repertoire_line, board, best_move)
                 board.push(best_move)
                 move_cnt += 1
 
                 # Update timer
                 engine_timer.update_base()
 
+                # Ponder on the user's time, on the reply the engine expects
+                if self.is_engine_ponder and not is_book_from_gui and \
+                        search.ponder_move is not None and \
+                        board.is_legal(search.ponder_move):
+                    ponder = EnginePonder(self.get_opponent_session(), board,
+                                          search.ponder_move, game=self.game,
+                                          max_depth=self.max_depth)
+                    ponder.start()
+                    logging.info(f'Ponder on {search.ponder_move}.')
+
                 # Update game, move from engine
                 time_left = engine_timer.base
                 if is_book_from_gui:
@@ -2447,7 +3743,7 @@ class EasyChessGui:
                     k2 = 'w_base_time_k'
 
                 # Update elapse box
-                elapse_str = self.get_time_mm_ss_ms(engine_timer.elapse)
+                elapse_str = self.get_time_mm_ss_ms(engine_timer.last_elapse)
                 window.Element(k1).Update(elapse_str)
 
                 # Update remaining time box
@@ -2456,6 +3752,10 @@ class EasyChessGui:
 
                 window.find_element('_gamestatus_').Update('Mode     Play')
 
+        if ponder is not None:
+            ponder.stop()
+        self.stop_adviser()
+
         # Auto-save game
         logging.info('Saving game automatically')
         if is_user_resigns:
@@ -2506,8 +3806,14 @@ class EasyChessGui:
             sg.Popup('Game is over.', title=BOX_TITLE,
                      icon=ico_path[platform]['pecg'])
 
+        # Analysis of the last user move is not needed anymore
+        if self.mentor_worker:
+            self.mentor_worker.cancel()
+            self.mentor_job_id = None
+
         if is_exit_app:
             window.Close()
+            self.close_engines()
             sys.exit(0)
 
         self.clear_elements(window)
@@ -2518,6 +3824,8 @@ class EasyChessGui:
         """ Save game in append mode """
         with open(self.pecg_auto_save_game, mode='a+') as f:
             f.write('{}\n\n'.format(self.game))
+        self.update_game_index(self.pecg_auto_save_game)
+        self.store_game('auto_save')
 
     def get_engines(self):
         """
@@ -2616,6 +3924,9 @@ class EasyChessGui:
                         ['Start::right_adviser_k', 'Stop::right_adviser_k']
                     ]),
              sg.Text('', font=('Consolas', 12), key='advise_info_k', relief='sunken',
+                     size=(55, 3))],
+            [sg.Text('Repertoire', size=(10, 1), font=('Consolas', 12)),
+             sg.Text('', font=('Consolas', 12), key='repertoire_k', relief='sunken',
                      size=(55, 1))],
 
             [sg.Text('Move list', size=(20, 1), font=('Consolas', 12))],
@@ -2708,6 +4019,7 @@ class EasyChessGui:
         self.set_default_adviser_engine()
 
         self.init_game()
+        self.open_game_store()
 
         # Initialize White and black boxes
         while True:
@@ -2760,27 +4072,47 @@ class EasyChessGui:
 
                         t1 = time.perf_counter()
                         que = queue.Queue()
+                        cancel_event = threading.Event()
                         t = threading.Thread(
                             target=self.get_players,
-                            args=(pgn, que,),
+                            args=(pgn, que, cancel_event,),
                             daemon=True
                         )
                         t.start()
                         msg = None
+                        is_window_closed = False
+                        w.Element('status_k').Update(
+                            'Display Players: processing ...')
                         while True:
                             e1, v1 = w.Read(timeout=100)
-                            w.Element('status_k').Update(
-                                'Display Players: processing ...')
+
+                            # Cancel or closing the window stops the scan
+                            if e1 is None or e1 == 'Cancel':
+                                is_window_closed = e1 is None
+                                cancel_event.set()
                             try:
                                 msg = que.get_nowait()
-                                elapse = int(time.perf_counter() - t1)
-                                w.Element('status_k').Update(
-                                    'Players are displayed. Done! in ' +
-                                    str(elapse) + 's')
-                                break
-                            except Exception:
+                            except queue.Empty:
+                                continue
+
+                            # Progress of the scan
+                            if isinstance(msg, str):
+                                w.Element('status_k').Update(msg)
                                 continue
+                            break
                         t.join()
+
+                        if is_window_closed:
+                            break
+                        if msg is None:
+                            w.Element('status_k').Update(
+                                'Display Players: cancelled')
+                            continue
+
+                        elapse = int(time.perf_counter() - t1)
+                        w.Element('status_k').Update(
+                            'Players are displayed. Done! in ' +
+                            str(elapse) + 's')
                         player_list = msg[0]
                         sum_games = msg[1]
                         w.Element('player_k').Update(sorted(player_list))
@@ -3178,8 +4510,7 @@ class EasyChessGui:
                             continue
 
                         # Read engine config file
-                        with open(self.engine_config_file, 'r') as json_file:
-                            data = json.load(json_file)
+                        data = self.engine_config.data()
 
                         # First option that can be set is the config name
                         option_layout.append(
@@ -3335,6 +4666,10 @@ class EasyChessGui:
                         orig_idname, ret_opt_name)
                     self.engine_id_name_list = self.get_engine_id_name_list()
 
+                    # Options are only set when the engine starts
+                    self.engine_pool.invalidate(orig_idname)
+                    self.engine_pool.invalidate(engine_id_name)
+
                 edit_win.Close()
                 window.UnHide()
                 continue
@@ -3368,8 +4703,7 @@ class EasyChessGui:
                                      title=button_title,
                                      icon=ico_path[platform]['pecg'])
                             continue
-                        with open(self.engine_config_file, 'r') as json_file:
-                            data = json.load(json_file)
+                        data = self.engine_config.data()
 
                         for i in range(len(data)):
                             if data[i]['name'] == engine_id_name:
@@ -3379,8 +4713,7 @@ class EasyChessGui:
                                 break
 
                         # Save data to pecg_engines.json
-                        with open(self.engine_config_file, 'w') as h:
-                            json.dump(data, h, indent=4)
+                        self.engine_config.save(data)
 
                         break
 
@@ -3466,6 +4799,17 @@ class EasyChessGui:
                          sg.Spin([t for t in range(1, 3600, 1)],
                                  initial_value=self.adviser_movetime_sec,
                                  size=(8, 1), key='adviser_movetime_k')],
+                        [sg.CBox('Continuous analysis',
+                                 key='adviser_continuous_k',
+                                 default=self.is_adviser_continuous,
+                                 tooltip='The adviser analyses every position\n' +
+                                         'where you are to move without a\n' +
+                                         'time limit. Right click Stop\n' +
+                                         'pauses it, Start resumes it.')],
+                        [sg.T('Lines', size=(12, 1)),
+                         sg.Spin([t for t in range(1, 4, 1)],
+                                 initial_value=self.adviser_multipv,
+                                 size=(8, 1), key='adviser_multipv_k')],
                         [sg.OK(), sg.Cancel()]
                 ]
 
@@ -3485,6 +4829,8 @@ class EasyChessGui:
                     if e == 'OK':
                         movetime_sec = int(v['adviser_movetime_k'])
                         self.adviser_movetime_sec = min(3600, max(1, movetime_sec))
+                        self.is_adviser_continuous = v['adviser_continuous_k']
+                        self.adviser_multipv = min(3, max(1, int(v['adviser_multipv_k'])))
 
                         # We use try/except because user can press OK without selecting an engine
                         try:
@@ -3575,6 +4921,13 @@ class EasyChessGui:
                              tooltip='[%clk h:mm:ss] will appear as\n' +
                                      'move comment and is shown in move\n' +
                                      'list and saved in pgn file.')],
+                    [sg.CBox('Engine ponders on user time',
+                             key='engine_ponder_k',
+                             default=self.is_engine_ponder,
+                             tooltip='The opponent engine keeps searching\n' +
+                                     'the move it expects from you while\n' +
+                                     'you think, and replies faster when\n' +
+                                     'you play that move.')],
                     [sg.OK(), sg.Cancel()],
                 ]
 
@@ -3588,6 +4941,7 @@ class EasyChessGui:
                         break
                     if e == 'OK':
                         self.is_save_time_left = v['save_time_left_k']
+                        self.is_engine_ponder = v['engine_ponder_k']
                         break
 
                 window.UnHide()
@@ -3696,6 +5050,7 @@ class EasyChessGui:
                 continue
 
         window.Close()
+        self.close_engines()
 
 
 def main():
@@ -3721,6 +5076,7 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     try:
         main()
     except Exception as e:
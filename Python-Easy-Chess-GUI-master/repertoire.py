@@ -0,0 +1,266 @@
+"""
+repertoire.py
+
+Position index of the repertoire pgn files, pecg_white_repertoire.pgn and
+pecg_black_repertoire.pgn, so play_game can tell after every move whether
+the game still follows the repertoire without reading pgn.
+
+The moves of all games and variations are stored by the zobrist key of the
+position before the move, which also finds transpositions. The index is
+kept in a sidecar file next to the pgn, e.g. pecg_white_repertoire.rep.
+It remembers how many bytes of the pgn it has read, so games appended by
+Save to White/Black Repertoire are the only ones parsed on the next update.
+A pgn that was changed in any other way is indexed again. The gui runs
+update() in a thread and reads the moves while it is running.
+"""
+
+import logging
+import os
+import struct
+import threading
+from collections import namedtuple
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+import pgn_tools
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PECGREP1'
+HEADER_STRUCT = struct.Struct('>8sHQIQ')  # magic, max ply, pgn offset, tail crc, records
+RECORD_STRUCT = struct.Struct('>QHI')  # zobrist key, move, count
+DEFAULT_MAX_PLY = 40
+
+Deviation = namedtuple('Deviation', ['move_number', 'is_white', 'move_san', 'expected_san'])
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(value):
+    return chess.Move(value & 63, value >> 6 & 63, value >> 12 or None)
+
+
+def index_game(game, max_ply, counts):
+    """Counts the (key, move) of a game and its variations up to max_ply."""
+    def visit(node, board):
+        if board.ply() - start_ply >= max_ply:
+            return
+        key = chess.polyglot.zobrist_hash(board)
+        for child in node.variations:
+            move = encode_move(child.move)
+            counts[(key, move)] = counts.get((key, move), 0) + 1
+            board.push(child.move)
+            visit(child, board)
+            board.pop()
+
+    board = game.board()
+    start_ply = board.ply()
+    visit(game, board)
+
+
+class RepertoireIndex:
+    def __init__(self, pgn_file, index_file=None, max_ply=DEFAULT_MAX_PLY) -> None:
+        """Moves of a repertoire pgn by position.
+
+        Args:
+          pgn_file: repertoire pgn filename
+          index_file: sidecar filename, default is the pgn with a .rep suffix
+          max_ply: number of plies indexed from the start of each game
+        """
+        self.pgn_file = pgn_file
+        self.index_file = index_file or os.path.splitext(pgn_file)[0] + '.rep'
+        self.max_ply = max_ply
+        self._moves = {}  # key: {move: count}
+        self._offset = 0
+        self._crc = 0
+        self._records = 0
+        self._is_loaded = False
+        self._update_lock = threading.Lock()  # one update at a time
+        self._lock = threading.Lock()  # _moves, held briefly for get_moves
+
+    def __len__(self):
+        """Number of positions in the repertoire."""
+        return len(self._moves)
+
+    def _add(self, key, move, count):
+        moves = self._moves.setdefault(key, {})
+        moves[move] = moves.get(move, 0) + count
+
+    def _add_counts(self, counts, is_rebuild) -> None:
+        with self._lock:
+            if is_rebuild:
+                self._moves.clear()
+            for (key, move), count in counts.items():
+                self._add(key, move, count)
+
+    def _load(self) -> None:
+        """Reads the sidecar, an unusable sidecar leaves the index empty."""
+        self._add_counts({}, True)
+        self._offset, self._crc, self._records = 0, 0, 0
+        try:
+            with open(self.index_file, 'rb') as f:
+                magic, max_ply, offset, crc, records = HEADER_STRUCT.unpack(
+                    f.read(HEADER_STRUCT.size))
+                if magic != MAGIC or max_ply != self.max_ply:
+                    return
+                data = f.read(records * RECORD_STRUCT.size)
+        except FileNotFoundError:
+            return
+        except (OSError, struct.error):
+            logger.warning(f'Repertoire index {self.index_file} is not readable, rebuilding.')
+            return
+
+        if len(data) != records * RECORD_STRUCT.size:
+            return
+        with self._lock:
+            for key, move, count in RECORD_STRUCT.iter_unpack(data):
+                self._add(key, move, count)
+        self._offset, self._crc, self._records = offset, crc, records
+
+    def _save(self, counts, is_rebuild) -> None:
+        """Appends counts to the sidecar and then commits the new header.
+
+        Records after the committed count are from an interrupted update,
+        they are overwritten.
+        """
+        mode = 'wb' if is_rebuild or not os.path.isfile(self.index_file) else 'r+b'
+        with open(self.index_file, mode) as f:
+            if mode == 'wb':
+                self._records = 0
+            f.seek(HEADER_STRUCT.size + self._records * RECORD_STRUCT.size)
+            for (key, move), count in counts.items():
+                f.write(RECORD_STRUCT.pack(key, move, count))
+            f.truncate()
+            f.flush()
+            self._records += len(counts)
+            f.seek(0)
+            f.write(HEADER_STRUCT.pack(MAGIC, self.max_ply, self._offset,
+                                       self._crc, self._records))
+
+    def update(self, cancel_event=None) -> int:
+        """Indexes the games added to the pgn since the last update.
+
+        Args:
+          cancel_event: threading.Event that stops the update, the index is
+            left as it was
+
+        Returns:
+          The number of games read from the pgn, None if cancelled.
+        """
+        with self._update_lock:
+            return self._update(cancel_event)
+
+    def _update(self, cancel_event):
+        if not self._is_loaded:
+            self._load()
+            self._is_loaded = True
+
+        if not os.path.isfile(self.pgn_file):
+            if self._offset:
+                self._add_counts({}, True)
+                self._offset, self._crc = 0, 0
+                self._save({}, True)
+            return 0
+
+        counts = {}
+        games = 0
+        with open(self.pgn_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            is_append = (self._offset <= size and
+                         pgn_tools.tail_crc(f, self._offset) == self._crc)
+            if is_append and size == self._offset:
+                return 0
+
+            reader = pgn_tools.PgnChunkReader(f, self._offset if is_append else 0, size)
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info(f'Indexing {self.pgn_file} is cancelled.')
+                    return None
+                game = chess.pgn.read_game(reader)
+                if game is None:
+                    break
+                index_game(game, self.max_ply, counts)
+                games += 1
+
+            self._offset = size
+            self._crc = pgn_tools.tail_crc(f, size)
+
+        self._add_counts(counts, not is_append)
+        try:
+            self._save(counts, not is_append)
+        except OSError:
+            logger.exception(f'Failed to save repertoire index {self.index_file}.')
+
+        logger.info(f'{games} games of {self.pgn_file} added to the repertoire index.')
+        return games
+
+    def get_moves(self, board) -> dict:
+        """Returns {chess.Move: count} of the repertoire in the position."""
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            moves = self._moves.get(key)
+            if not moves:
+                return {}
+            return {decode_move(move): count for move, count in moves.items()}
+
+
+class RepertoireLine:
+    def __init__(self, index, board) -> None:
+        """Follows a game through the repertoire, one move at a time.
+
+        Args:
+          index: RepertoireIndex of the user's color
+          board: position of the game, its move stack is replayed
+        """
+        self.index = index
+        self.root = board.root()
+        self.moves = list(board.move_stack)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Follows the moves of the game again, e.g. after the index is updated."""
+        self.ply = 0
+        self.deviation = None
+        board = self.root.copy()
+        self.is_in_repertoire = bool(self.index.get_moves(board))
+        for move in self.moves:
+            self._follow(board, move)
+            board.push(move)
+
+    def push(self, board, move) -> None:
+        """Checks a move, board is the position before the move."""
+        self.moves.append(move)
+        self._follow(board, move)
+
+    def _follow(self, board, move) -> None:
+        if not self.is_in_repertoire:
+            return
+
+        moves = self.index.get_moves(board)
+        if move in moves:
+            self.ply += 1
+            return
+
+        self.is_in_repertoire = False
+        if moves:
+            expected = sorted(moves, key=moves.get, reverse=True)
+            self.deviation = Deviation(
+                board.fullmove_number, board.turn == chess.WHITE,
+                board.san(move), [board.san(m) for m in expected])
+
+    def get_text(self) -> str:
+        if self.deviation is not None:
+            d = self.deviation
+            dots = '.' if d.is_white else '...'
+            return 'Left at {}{}{}, repertoire: {}'.format(
+                d.move_number, dots, d.move_san, ', '.join(d.expected_san[:4]))
+        if self.is_in_repertoire:
+            if self.ply == 0:
+                return 'In repertoire'
+            return 'In repertoire, {} {}'.format(self.ply, 'ply' if self.ply == 1 else 'plies')
+        return 'Not in repertoire'
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Checks that Delete Player keeps the games the chess.pgn filter kept.
+
+The streaming delete_player copies the raw bytes of the games it keeps,
+the earlier implementation parsed every game with chess.pgn and wrote it
+back. Both must keep the same games. Run with python test_delete_player.py
+or with pytest.
+"""
+import os
+import queue
+import tempfile
+
+import chess.pgn
+
+from python_easy_chess_gui import EasyChessGui
+from test_pgn_tools import make_pgn_bytes
+
+
+def chess_pgn_delete_player(name, pgn_file):
+    """Returns the games kept by the earlier delete_player, as text."""
+    kept = []
+    with open(pgn_file) as h:
+        game = chess.pgn.read_game(h)
+        while game:
+            if game.headers['White'] != name and game.headers['Black'] != name:
+                kept.append(str(game))
+            game = chess.pgn.read_game(h)
+    return kept
+
+
+def read_games(pgn_file):
+    with open(pgn_file) as f:
+        return [str(game) for game in iter(lambda: chess.pgn.read_game(f), None)]
+
+
+def test_delete_player_matches_chess_pgn():
+    data = make_pgn_bytes(120, seed=5)
+    gui = EasyChessGui.__new__(EasyChessGui)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        orig_file = os.path.join(tmp_dir, 'orig.pgn')
+        with open(orig_file, 'wb') as f:
+            f.write(data)
+        pgn_file = os.path.join(tmp_dir, 'games.pgn')
+        for name in ('Ann', 'Cid', 'Nobody'):
+            with open(pgn_file, 'wb') as f:
+                f.write(data)
+            que = queue.Queue()
+            gui.delete_player(name, pgn_file, que)
+            assert [que.get_nowait() for _ in range(que.qsize())][-1] == 'Done'
+
+            assert read_games(pgn_file) == chess_pgn_delete_player(name, orig_file)
+            with open(os.path.join(tmp_dir, 'games.pgn.backup'), 'rb') as f:
+                assert f.read() == data
+            assert not os.path.exists(os.path.join(tmp_dir, 'out_games.pgn'))
+
+        # Nothing is deleted, the file is copied byte for byte
+        with open(pgn_file, 'rb') as f:
+            assert f.read() == data
+
+
+if __name__ == '__main__':
+    test_delete_player_matches_chess_pgn()
+    print('All delete player tests passed.')
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Checks that the engine pool never runs more than max_processes engines.
+
+Sessions start their engine on first search, so the pool is checked
+without engine processes. Run with python test_engine_pool.py or with
+pytest.
+"""
+import threading
+import time
+
+from python_easy_chess_gui import EnginePool
+
+
+def test_full_pool_waits_for_release():
+    pool = EnginePool('pecg_engines.json', max_processes=2)
+    opponent = pool.acquire('Fish', 'fish', 'opponent')
+    mentor = pool.acquire('Fish', 'fish', 'mentor')
+    assert opponent.session is not mentor.session
+
+    leases = []
+    waiter = threading.Thread(
+        target=lambda: leases.append(pool.acquire('Other', 'other', 'adviser')))
+    waiter.start()
+    time.sleep(0.1)
+    assert leases == [] and len(pool._busy) == 2
+
+    # The released session is quit to make room for the other engine
+    mentor.release()
+    waiter.join(timeout=5)
+    assert leases[0].session.engine_id_name == 'Other'
+    assert pool._busy == [opponent.session, leases[0].session] and pool._idle == []
+
+    # The released opponent is kept warm and leased again
+    opponent.release()
+    assert pool.acquire('Fish', 'fish', 'opponent').session is opponent.session
+
+
+def test_full_pool_times_out():
+    pool = EnginePool('pecg_engines.json', max_processes=1)
+    pool.acquire('Fish', 'fish', 'opponent')
+    t0 = time.monotonic()
+    try:
+        pool.acquire('Fish', 'fish', 'mentor', timeout=0.2)
+    except RuntimeError as e:
+        assert 'mentor could not lease Fish' in str(e)
+    else:
+        assert False, 'acquire of a full pool did not time out'
+    assert time.monotonic() - t0 >= 0.2
+    assert len(pool._busy) == 1
+
+
+if __name__ == '__main__':
+    test_full_pool_waits_for_release()
+    test_full_pool_times_out()
+    print('All engine pool tests passed.')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Checks the import, export and position index of the game store.
+
+Games are imported in small batches so that batch and resume boundaries
+fall between many games. Run with python test_game_store.py or with pytest.
+"""
+import io
+import os
+import tempfile
+import threading
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+from game_store import GameStore
+from test_pgn_tools import make_games
+
+
+def write_pgn(tmp_dir, n_games, seed=1):
+    """Writes n_games the way save_game does, returns the pgn and the game texts."""
+    texts = []
+    for i, game in enumerate(make_games(n_games, seed)):
+        game.headers['WhiteTimeControl'] = '300+10'
+        game.headers['Difficulty'] = ['easy', 'medium', 'hard'][i % 3]
+        texts.append(str(game))
+    pgn_file = os.path.join(tmp_dir, 'games.pgn')
+    with open(pgn_file, 'w') as f:
+        f.write(''.join('{}\n\n'.format(text) for text in texts))
+    return pgn_file, texts
+
+
+def stored_texts(store):
+    return [row[0] for row in store._db.execute('SELECT pgn FROM game ORDER BY id')]
+
+
+def import_row(store, pgn_file):
+    return store._db.execute(
+        'SELECT offset, end FROM pgn_import WHERE pgn_file = ?',
+        (os.path.abspath(pgn_file),)).fetchone()
+
+
+def test_import_in_batches():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file, texts = write_pgn(tmp_dir, 25)
+        store = GameStore(os.path.join(tmp_dir, 'games.sqlite3'))
+        try:
+            assert store.import_pgn(pgn_file, 'my_games', batch_size=10) == 25
+            assert stored_texts(store) == texts
+            size = os.path.getsize(pgn_file)
+            assert import_row(store, pgn_file) == (size, size)
+            assert store.is_imported(pgn_file)
+            assert store.import_pgn(pgn_file, 'my_games', batch_size=10) == 0
+        finally:
+            store.close()
+
+
+def test_import_resume():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file, texts = write_pgn(tmp_dir, 37, seed=2)
+        db_file = os.path.join(tmp_dir, 'games.sqlite3')
+        store = GameStore(db_file)
+        cancel_event = threading.Event()
+        assert store.import_pgn(pgn_file, 'my_games', batch_size=7,
+                                progress=lambda done, total: cancel_event.set(),
+                                cancel_event=cancel_event) is None
+        assert store.count() == 7
+        assert not store.is_imported(pgn_file)
+
+        # A game saved by the gui while the import is not done
+        game = chess.pgn.read_game(io.StringIO(texts[0]))
+        with open(pgn_file, 'a') as f:
+            f.write('{}\n\n'.format(game))
+        store.add_game(game, 'my_games')
+        store.close()
+
+        store = GameStore(db_file)
+        try:
+            assert store.import_pgn(pgn_file, 'my_games', batch_size=7) == 30
+            texts_by_id = stored_texts(store)
+            assert texts_by_id[:7] + texts_by_id[8:] == texts
+            assert store.count() == 38
+            assert store.is_imported(pgn_file)
+        finally:
+            store.close()
+
+
+def test_game_saved_before_import():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file, texts = write_pgn(tmp_dir, 2, seed=5)
+        new_file = os.path.join(tmp_dir, 'new.pgn')
+        store = GameStore(os.path.join(tmp_dir, 'games.sqlite3'))
+        try:
+            # The gui begins the imports, then saves games to both files
+            # while the import of another file is running
+            store.begin_import(pgn_file, 'my_games')
+            store.begin_import(new_file, 'white_repertoire')
+            game = chess.pgn.read_game(io.StringIO(texts[0]))
+            for pgn, collection in [(pgn_file, 'my_games'), (new_file, 'white_repertoire')]:
+                with open(pgn, 'a') as f:
+                    f.write('{}\n\n'.format(game))
+                store.add_game(game, collection)
+
+            assert store.import_pgn(pgn_file, 'my_games') == 2
+            assert store.import_pgn(new_file, 'white_repertoire') == 0
+            assert store.count(collection='my_games') == 3
+            assert store.count(collection='white_repertoire') == 1
+            assert store.is_imported(pgn_file) and store.is_imported(new_file)
+
+            # A later begin_import keeps the recorded end
+            store.begin_import(pgn_file, 'my_games')
+            assert store.import_pgn(pgn_file, 'my_games') == 0
+            assert store.count() == 4
+        finally:
+            store.close()
+
+
+def test_export_round_trip():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file, texts = write_pgn(tmp_dir, 20, seed=3)
+        store = GameStore(os.path.join(tmp_dir, 'games.sqlite3'))
+        try:
+            store.import_pgn(pgn_file, 'my_games', batch_size=3)
+            out_file = os.path.join(tmp_dir, 'out.pgn')
+            assert store.export_pgn(out_file) == 20
+            with open(pgn_file) as f1, open(out_file) as f2:
+                assert f1.read() == f2.read()
+
+            n = store.export_pgn(out_file, difficulty='hard')
+            assert n == store.count(difficulty='hard') > 0
+            assert n == sum('[Difficulty "hard"]' in text for text in texts)
+            assert store.count(player='Ann') == sum(
+                '"Ann"]' in text.split('\n\n')[0] for text in texts)
+        finally:
+            store.close()
+
+
+def test_find_position():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file, texts = write_pgn(tmp_dir, 40, seed=4)
+        store = GameStore(os.path.join(tmp_dir, 'games.sqlite3'))
+        try:
+            store.import_pgn(pgn_file, 'my_games', batch_size=9)
+            assert store.index_positions(workers=1, chunk_games=6) == 40
+            game = chess.pgn.Game()
+            game.add_main_variation(chess.Move.from_uci('e2e4'))
+            saved_id = store.add_game(game, 'auto_save')
+
+            # Brute force: first ply of every game in every position
+            expected = {}
+            games = [chess.pgn.read_game(io.StringIO(text)) for text in texts] + [game]
+            for game_id, g in enumerate(games, 1):
+                board = g.board()
+                boards = [board.copy()]
+                for move in g.mainline_moves():
+                    board.push(move)
+                    boards.append(board.copy())
+                for ply, b in enumerate(boards):
+                    positions = expected.setdefault(chess.polyglot.zobrist_hash(b), (b, {}))
+                    positions[1].setdefault(game_id, ply)
+
+            assert saved_id == len(games)
+            for board, game_plies in expected.values():
+                found = {row.id: ply for row, ply in store.find_position(board, limit=1000)}
+                assert found == game_plies
+
+            board = chess.Board()
+            board.push_uci('e2e4')
+            found = store.find_position(board, collection='auto_save')
+            assert [(row.id, ply) for row, ply in found] == [(saved_id, 1)]
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    test_import_in_batches()
+    test_import_resume()
+    test_game_saved_before_import()
+    test_export_round_trip()
+    test_find_position()
+    print('All game store tests passed.')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Checks how the mentor uses Gemini and its caches without calling the API.
+
+Run with python test_mentor_gemini.py or with pytest.
+"""
+import json
+import os
+import tempfile
+import time
+
+import chess
+
+import ai_chess_mentor
+from ai_chess_mentor import ChessMentor, ExplanationCache
+
+
+def make_mentor(**kwargs):
+    return ChessMentor(stockfish_path='', use_gemini=False, explanation_cache_file=None,
+                       gemini_state_file=None, engine_provider=lambda: None, **kwargs)
+
+
+def test_no_cached_explanation_without_gemini():
+    mentor = make_mentor()
+    board = chess.Board()
+    move = chess.Move.from_uci('e2e4')
+    quality_info = {'quality': '= Neutral'}
+    mentor.explanation_cache.put(
+        ExplanationCache.make_key(board, move, quality_info['quality']), 'Controls the center.')
+
+    assert mentor.get_move_explanation(board, move, quality_info) is None
+    assert mentor.explanation_cache.stats()['memory_hits'] == 0
+
+    # With Gemini on, the cached explanation is used without an API call
+    mentor.use_gemini = True
+    assert mentor.get_move_explanation(board, move, quality_info) == 'Controls the center.'
+
+
+class PermanentError(Exception):
+    """Stands for an error like a bad API key."""
+
+
+class FailingModel:
+    def __init__(self, error) -> None:
+        self.error = error
+
+    def generate_content(self, prompt):
+        raise self.error
+
+
+def test_state_file_kept_on_temporary_errors():
+    saved_errors = ai_chess_mentor.GEMINI_PERMANENT_ERRORS
+    ai_chess_mentor.GEMINI_PERMANENT_ERRORS = (PermanentError,)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = os.path.join(tmp_dir, 'pecg_gemini_state.json')
+            with open(state_file, 'w') as f:
+                json.dump({'model': 'models/gemini-2.5-flash', 'time': time.time()}, f)
+
+            mentor = make_mentor()
+            mentor.gemini_state_file = state_file
+            mentor.use_gemini = True
+            board = chess.Board()
+            quality_info = {'quality': '= Neutral'}
+
+            for error in [TimeoutError('timed out'), RuntimeError('429 quota exceeded')]:
+                mentor.gemini_model = FailingModel(error)
+                assert mentor.get_move_explanation(
+                    board, chess.Move.from_uci('e2e4'), quality_info) is None
+                assert os.path.isfile(state_file)
+
+            mentor.gemini_model = FailingModel(PermanentError('API key not valid'))
+            assert mentor.get_move_explanation(
+                board, chess.Move.from_uci('d2d4'), quality_info) is None
+            assert not os.path.isfile(state_file)
+    finally:
+        ai_chess_mentor.GEMINI_PERMANENT_ERRORS = saved_errors
+
+
+if __name__ == '__main__':
+    test_no_cached_explanation_without_gemini()
+    test_state_file_kept_on_temporary_errors()
+    print('All Gemini tests passed.')
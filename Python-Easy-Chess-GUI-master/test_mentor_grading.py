@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Checks single search grading with a stub engine.
+
+The stub answers a MultiPV search with fixed iterations, like an engine
+that sends its lines in order and may run out of time_limit in the middle
+of an iteration. Run with python test_mentor_grading.py or with pytest.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import chess
+import chess.engine
+
+from ai_chess_mentor import ChessMentor, MentorCancelled
+
+
+def info(uci, cp, depth, multipv=1, turn=chess.WHITE):
+    return {'pv': [chess.Move.from_uci(uci)], 'depth': depth, 'multipv': multipv,
+            'score': chess.engine.PovScore(chess.engine.Cp(cp), turn)}
+
+
+def iteration(depth, *lines, board=chess.Board()):
+    """Returns the infos of one iteration from (uci, cp) in MultiPV order.
+
+    The other legal moves of board follow the lines at -500.
+    """
+    ucis = [uci for uci, _ in lines]
+    lines = list(lines) + [(move.uci(), -500) for move in board.legal_moves
+                           if move.uci() not in ucis]
+    return [info(uci, cp, depth, i) for i, (uci, cp) in enumerate(lines, 1)]
+
+
+class StubAnalysis:
+    def __init__(self, infos, multipv) -> None:
+        self.infos = infos
+        self.num_lines = multipv or 1
+        self.multipv = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    async def __aiter__(self):
+        # python-chess updates the line dicts in place
+        for line in self.infos:
+            i = line['multipv'] - 1
+            if i >= self.num_lines:
+                continue
+            if i < len(self.multipv):
+                self.multipv[i].clear()
+                self.multipv[i].update(line)
+            else:
+                self.multipv.append(dict(line))
+            yield dict(line)
+
+    def stop(self):
+        pass
+
+    def wait(self):
+        pass
+
+
+class StubEngine:
+    def __init__(self, infos) -> None:
+        """Answers every search with infos, the lines of all iterations in order."""
+        self.infos = infos
+        self.searches = []
+        self.protocol = self
+
+    async def analysis(self, board, limit, multipv=None):
+        self.searches.append(multipv)
+        return StubAnalysis(self.infos, multipv)
+
+
+def run_now(coro):
+    """Runs a search coroutine to the end, like submit() and waiting for it."""
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(asyncio.run(coro))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def make_mentor(engine):
+    return ChessMentor(stockfish_path='', use_gemini=False,
+                       explanation_cache_file=None, gemini_state_file=None,
+                       engine_provider=lambda: engine, engine_submit=run_now)
+
+
+def test_single_search_grades_move():
+    board = chess.Board()
+    h2h4 = chess.Move.from_uci('h2h4')
+    engine = StubEngine(iteration(12, ('e2e4', 100), ('d2d4', 90), ('g1f3', 80), ('h2h4', -300)))
+    mentor = make_mentor(engine)
+
+    result = mentor.evaluate_move(board, h2h4, depth=20, time_limit=1)
+    assert engine.searches == [20]
+    assert result['score_diff'] == -400
+    assert result['quality'] == '❌ Blunder'
+
+    entry = mentor.eval_cache.peek(board)
+    assert entry.score.white().score() == 100 and entry.depth == 12
+    assert set(entry.lines) == set(board.legal_moves)
+
+    # Another move of the same search is graded without a search
+    result = mentor.evaluate_move(board, chess.Move.from_uci('d2d4'), depth=12, time_limit=1)
+    assert result['score_diff'] == -10
+    assert engine.searches == [20]
+
+
+def test_incomplete_iteration_is_not_graded():
+    board = chess.Board()
+    e2e4 = chess.Move.from_uci('e2e4')
+    engine = StubEngine(iteration(8, ('e2e4', 30), ('d2d4', 20), ('h2h4', -90)) +
+                        # Out of time after two lines of depth 9
+                        iteration(9, ('d2d4', 60), ('e2e4', -200))[:2])
+    mentor = make_mentor(engine)
+
+    entry = mentor._analyse_lines(board, e2e4, 9, 1)
+    assert entry.depth == 8 and entry.score.white().score() == 30
+    scores = {move.uci(): score.white().score() for move, score in entry.lines.items()}
+    assert len(scores) == 20
+    assert scores['e2e4'] == 30 and scores['d2d4'] == 20 and scores['h2h4'] == -90
+
+
+def test_deeper_search_replaces_lines():
+    board = chess.Board()
+    e2e4 = chess.Move.from_uci('e2e4')
+    engine = StubEngine(iteration(10, ('e2e4', 100), ('d2d4', 90), ('c2c4', 60)))
+    mentor = make_mentor(engine)
+    mentor._analyse_lines(board, e2e4, 10, 1)
+
+    # Lines of a deeper search replace the shallower ones, scores of
+    # different depths are never compared
+    engine.infos = iteration(14, ('d2d4', 70), ('g1f3', 50), ('e2e4', 40))
+    entry = mentor._analyse_lines(board, e2e4, 14, 1)
+    assert mentor.eval_cache.peek(board) == entry
+    assert entry.depth == 14 and entry.score.white().score() == 70
+    scores = {move.uci(): score.white().score() for move, score in entry.lines.items()}
+    assert scores['e2e4'] == 40 and scores['d2d4'] == 70 and scores['g1f3'] == 50
+    assert scores['c2c4'] == -500
+
+    # A shallower search keeps the deeper entry in the cache
+    engine.infos = iteration(6, ('c2c4', 20), ('e2e4', 10))
+    mentor._analyse_lines(board, chess.Move.from_uci('c2c4'), 16, 1)
+    assert mentor.eval_cache.peek(board) == entry
+
+
+class EndlessAnalysis(StubAnalysis):
+    """Sends one iteration, then searches until it is left."""
+
+    def __exit__(self, *args):
+        self.is_left = True
+        return False
+
+    async def __aiter__(self):
+        async for info in super().__aiter__():
+            yield info
+        await asyncio.Event().wait()
+
+
+def test_stop_cancels_search_on_loop():
+    board = chess.Board()
+    engine = StubEngine(iteration(5, ('e2e4', 30)))
+    analyses = []
+
+    async def analysis(board, limit, multipv=None):
+        analyses.append(EndlessAnalysis(engine.infos, multipv))
+        return analyses[-1]
+
+    engine.analysis = analysis
+    engine.loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=engine.loop.run_forever, daemon=True)
+    loop_thread.start()
+    try:
+        # Searches go to the loop of the engine protocol
+        mentor = ChessMentor(stockfish_path='', use_gemini=False,
+                             explanation_cache_file=None, gemini_state_file=None,
+                             engine_provider=lambda: engine)
+        threading.Timer(0.2, mentor.stop).start()
+        t0 = time.monotonic()
+        try:
+            mentor.pre_analyze(board, depth=30, multipv=2)
+        except MentorCancelled:
+            pass
+        else:
+            assert False, 'stop() did not cancel the search'
+        assert time.monotonic() - t0 < 5
+
+        # The finished iteration is kept, the analysis is left on the loop
+        assert mentor.eval_cache.peek(board).depth == 5
+        for _ in range(100):
+            if getattr(analyses[0], 'is_left', False):
+                break
+            time.sleep(0.01)
+        assert analyses[0].is_left
+
+        # A stopped mentor does not search until clear_stop()
+        try:
+            mentor.pre_analyze(board, depth=30, multipv=2)
+        except MentorCancelled:
+            pass
+        assert len(analyses) == 1
+    finally:
+        engine.loop.call_soon_threadsafe(engine.loop.stop)
+        loop_thread.join()
+
+
+if __name__ == '__main__':
+    test_single_search_grades_move()
+    test_incomplete_iteration_is_not_graded()
+    test_deeper_search_replaces_lines()
+    test_stop_cancels_search_on_loop()
+    print('All grading tests passed.')
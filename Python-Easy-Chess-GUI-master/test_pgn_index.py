@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Checks that the pgn header index read in parts matches a full rebuild.
+
+Run with python test_pgn_index.py or with pytest.
+"""
+import os
+import tempfile
+import threading
+
+import chess.pgn
+
+import pgn_index
+import pgn_tools
+from pgn_index import PgnHeaderIndex
+from test_pgn_tools import CancelAfter, make_appended_pgn_bytes
+
+
+def write_pgn(pgn_file, data, mode='wb'):
+    with open(pgn_file, mode) as f:
+        f.write(data)
+
+
+def rebuilt_games(tmp_dir, pgn_file):
+    index = PgnHeaderIndex(pgn_file, os.path.join(tmp_dir, 'full.idx'))
+    index.update(workers=1)
+    return index._games
+
+
+def test_append_matches_rebuild():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'games.pgn')
+        write_pgn(pgn_file, make_appended_pgn_bytes(30, seed=6))
+        index = PgnHeaderIndex(pgn_file)
+        assert index.update(workers=1) == 32
+
+        # save_game appends a game at a time, the gui thread reads it
+        for i in range(5):
+            game = chess.pgn.Game()
+            game.headers['Event'] = f'Saved {i}'
+            game.headers['White'] = 'Ann'
+            game.add_main_variation(chess.Move.from_uci('e2e4'))
+            write_pgn(pgn_file, '{}\n\n'.format(game).encode(), 'ab')
+            assert index.update(is_rebuild_allowed=False) == 1
+        assert index.update() == 0
+        assert index._games == rebuilt_games(tmp_dir, pgn_file)
+        assert index.get_players()['Ann'] == sum(
+            'Ann' in (g.white, g.black) for g in index._games)
+
+        # Offsets point at the games
+        games = index.get_games('Ann')
+        assert [index.read_game(g).headers['Event'] for g in games] == [g.event for g in games]
+        assert games[-1].event == 'Saved 4'
+
+        # The sidecar is read back without reading the pgn
+        reloaded = PgnHeaderIndex(pgn_file)
+        assert reloaded.update(is_rebuild_allowed=False) == 0
+        assert reloaded._games == index._games
+
+
+def test_changed_pgn_is_rebuilt():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'games.pgn')
+        data = make_appended_pgn_bytes(20, seed=7)
+        write_pgn(pgn_file, data)
+        index = PgnHeaderIndex(pgn_file)
+        index.update(workers=1)
+        games = list(index._games)
+
+        # Delete Player rewrites the pgn, the gui thread leaves it for later
+        first_game = data.index(b'[Event "Game 0"]')
+        write_pgn(pgn_file, data[first_game:] + make_appended_pgn_bytes(3, seed=8))
+        assert index.update(is_rebuild_allowed=False) == 0
+        assert index._games == games
+
+        assert index.update(workers=1) == 21 + 5
+        assert index._games == rebuilt_games(tmp_dir, pgn_file)
+
+        os.remove(pgn_file)
+        assert index.update() == 0
+        assert len(index) == 0
+
+
+def test_parallel_matches_sequential():
+    saved_chunk_size = pgn_index.PARALLEL_CHUNK_SIZE
+    pgn_index.PARALLEL_CHUNK_SIZE = 2000
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pgn_file = os.path.join(tmp_dir, 'games.pgn')
+            write_pgn(pgn_file, make_appended_pgn_bytes(150, seed=9))
+            assert len(pgn_tools.split_pgn_chunks(pgn_file, 2000)) > 2
+
+            index = PgnHeaderIndex(pgn_file)
+            progress = []
+            assert index.update(workers=2, progress=lambda done, total: progress.append(
+                (done, total))) == 152
+            assert len(progress) > 2 and progress[-1][0] == progress[-1][1]
+            assert index._games == rebuilt_games(tmp_dir, pgn_file)
+
+            # Appended games are split from the indexed offset
+            write_pgn(pgn_file, make_appended_pgn_bytes(60, seed=10), 'ab')
+            assert index.update(workers=2) == 62
+            assert index._games == rebuilt_games(tmp_dir, pgn_file)
+    finally:
+        pgn_index.PARALLEL_CHUNK_SIZE = saved_chunk_size
+
+
+def test_cancel_leaves_index():
+    saved_chunk_size = pgn_index.PARALLEL_CHUNK_SIZE
+    pgn_index.PARALLEL_CHUNK_SIZE = 2000
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pgn_file = os.path.join(tmp_dir, 'games.pgn')
+            write_pgn(pgn_file, make_appended_pgn_bytes(100, seed=11))
+            index = PgnHeaderIndex(pgn_file)
+            cancel_event = threading.Event()
+            assert index.update(workers=2, progress=lambda done, total: cancel_event.set(),
+                                cancel_event=cancel_event) is None
+            assert len(index) == 0
+            assert not os.path.exists(index.index_file)
+
+            # Cancelled while the pool reads the chunks
+            assert index.update(workers=2, cancel_event=CancelAfter(1)) is None
+            assert len(index) == 0
+
+            assert index.update(workers=2) == 102
+            assert index._games == rebuilt_games(tmp_dir, pgn_file)
+    finally:
+        pgn_index.PARALLEL_CHUNK_SIZE = saved_chunk_size
+
+
+def test_cancel_inline_scan():
+    saved_check_games = pgn_tools.CANCEL_CHECK_GAMES
+    pgn_tools.CANCEL_CHECK_GAMES = 10
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pgn_file = os.path.join(tmp_dir, 'games.pgn')
+            write_pgn(pgn_file, make_appended_pgn_bytes(20, seed=13))
+            index = PgnHeaderIndex(pgn_file)
+            assert index.update(workers=1) == 22
+            games = list(index._games)
+
+            # Set at the third check, after 30 of the appended games are
+            # read, iter_raw_games stops and scan_chunk sees it set
+            write_pgn(pgn_file, make_appended_pgn_bytes(100, seed=14), 'ab')
+            cancel_event = CancelAfter(2)
+            assert index.update(workers=1, cancel_event=cancel_event) is None
+            assert cancel_event.n == -2
+            assert index._games == games
+            reloaded = PgnHeaderIndex(pgn_file)
+            assert reloaded.update(is_rebuild_allowed=False) == 102
+
+            assert index.update(workers=1) == 102
+            assert index._games == rebuilt_games(tmp_dir, pgn_file)
+    finally:
+        pgn_tools.CANCEL_CHECK_GAMES = saved_check_games
+
+
+if __name__ == '__main__':
+    test_append_matches_rebuild()
+    test_changed_pgn_is_rebuilt()
+    test_parallel_matches_sequential()
+    test_cancel_leaves_index()
+    test_cancel_inline_scan()
+    print('All pgn index tests passed.')
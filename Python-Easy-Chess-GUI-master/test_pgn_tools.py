@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Checks that pgn chunks split at game boundaries, and the book builder.
+
+The pgn has a BOM, comments over several lines, escape and rest of line
+comments, CRLF line ends and more than one empty line between games, so
+chunk boundaries fall in all of them. Run with python test_pgn_tools.py or
+with pytest.
+"""
+import io
+import os
+import random
+import tempfile
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+import book_builder
+import pgn_tools
+
+
+CASTLING_GAME = '''[Event "Castling"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 5. d3 O-O 1-0
+'''
+
+
+def make_games(n_games, seed=1, sideline_rate=0.0):
+    """Returns n_games chess.pgn.Game of random moves.
+
+    A move gets a sideline of another random move at sideline_rate.
+    """
+    rng = random.Random(seed)
+    games = []
+    for i in range(n_games):
+        game = chess.pgn.Game()
+        game.headers['Event'] = f'Game {i}'
+        game.headers['White'] = rng.choice(['Ann', 'Bob'])
+        game.headers['Black'] = rng.choice(['Ann', 'Cid'])
+        board = chess.Board()
+        node = game
+        for _ in range(rng.randint(0, 40)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            if rng.random() < sideline_rate:
+                sideline = rng.choice(moves)
+                if sideline != move:
+                    node.add_variation(sideline)
+            node = node.add_variation(move)
+            board.push(move)
+        game.headers['Result'] = rng.choice(['1-0', '0-1', '1/2-1/2', '*'])
+        games.append(game)
+    return games
+
+
+def make_pgn_bytes(n_games, seed=1, sideline_rate=0.0):
+    """Returns pgn bytes of random games with the odd formatting of real files."""
+    rng = random.Random(seed)
+    parts = [pgn_tools.BOM, CASTLING_GAME.encode(), b'\n']
+    for i, game in enumerate(make_games(n_games, seed, sideline_rate)):
+        for node in game.mainline():
+            if rng.random() < 0.05:
+                node.comment = 'a comment\nover [two] lines'
+        text = str(game) + '\n'
+        if i % 7 == 3:
+            text = '% escaped line\n' + text
+        if i % 11 == 5:
+            text = text.replace('\n', '\r\n')
+        parts.append(text.encode())
+        parts.append(b'\n' * rng.randint(1, 3))
+    parts.append(CASTLING_GAME.encode())
+    return b''.join(parts)
+
+
+def make_appended_pgn_bytes(n_games, seed=1, sideline_rate=0.0):
+    """Returns the bytes of make_pgn_bytes without the BOM, ending with an
+    empty line like save_game writes, so they can be appended to a pgn."""
+    return make_pgn_bytes(n_games, seed, sideline_rate)[len(pgn_tools.BOM):] + b'\n'
+
+
+def split_raw_games(data):
+    """Returns the raw bytes of every game of pgn bytes without a BOM."""
+    return [raw for _, raw in pgn_tools.iter_raw_games(io.BytesIO(data))]
+
+
+class CancelAfter:
+    """Stands in for a threading.Event that is set after n checks."""
+
+    def __init__(self, n) -> None:
+        self.n = n
+
+    def is_set(self):
+        self.n -= 1
+        return self.n < 0
+
+
+def read_all_games(data):
+    """Returns the text of every game of the pgn read from the start by chess.pgn."""
+    handle = io.StringIO(data.decode(pgn_tools.ENCODING))
+    return [str(game) for game in iter(lambda: chess.pgn.read_game(handle), None)]
+
+
+def read_chunks(pgn_file, chunks):
+    return [str(game) for start, end in chunks
+            for game in pgn_tools.iter_chunk_games(pgn_file, start, end)]
+
+
+def write_pgn(tmp_dir, data):
+    pgn_file = os.path.join(tmp_dir, 'games.pgn')
+    with open(pgn_file, 'wb') as f:
+        f.write(data)
+    return pgn_file
+
+
+def test_chunks_split_at_games():
+    data = make_pgn_bytes(60)
+    games = read_all_games(data)
+    assert len(games) == 62
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = write_pgn(tmp_dir, data)
+        for chunk_size in (1, 13, 200, 1000, 100000):
+            chunks = pgn_tools.split_pgn_chunks(pgn_file, chunk_size)
+            assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+            assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+            assert all(data[start:start + 1] == b'[' for start, _ in chunks[1:])
+            assert read_chunks(pgn_file, chunks) == games
+        assert len(pgn_tools.split_pgn_chunks(pgn_file, 1)) > 40
+
+
+def test_split_from_offset():
+    data = make_pgn_bytes(20, seed=2)
+    games = read_all_games(data)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = write_pgn(tmp_dir, data)
+
+        # An index that has read the games before start
+        with open(pgn_file, 'rb') as f:
+            start = pgn_tools.find_game_start(f, len(data) // 2, len(data))
+        n_before = len(read_chunks(pgn_file, [(0, start)]))
+        assert 0 < n_before < len(games)
+
+        chunks = pgn_tools.split_pgn_chunks(pgn_file, 150, start)
+        assert chunks[0][0] == start and chunks[-1][1] == len(data)
+        assert read_chunks(pgn_file, chunks) == games[n_before:]
+        assert pgn_tools.split_pgn_chunks(pgn_file, 150, len(data)) == []
+
+
+def test_raw_games_give_the_file_back():
+    data = make_pgn_bytes(40, seed=3)
+    games = [chess.pgn.read_game(io.StringIO(text)) for text in read_all_games(data)]
+    raw_games = list(pgn_tools.iter_raw_games(io.BytesIO(data)))
+    assert b''.join(raw for _, raw in raw_games) == data
+    assert len(raw_games) == len(games)
+    for (headers, raw), game in zip(raw_games, games):
+        assert headers.items() <= game.headers.items()
+        assert str(chess.pgn.read_game(io.StringIO(raw.decode()))) == str(game)
+
+    # Ranges of split_pgn_chunks give the same games
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = write_pgn(tmp_dir, data)
+        ranged = []
+        with open(pgn_file, 'rb') as f:
+            for start, end in pgn_tools.split_pgn_chunks(pgn_file, 300):
+                f.seek(start)
+                ranged.extend(pgn_tools.iter_raw_games(f, end - start))
+        assert ranged == raw_games
+
+
+def brute_force_book(data, options, min_count):
+    """Returns the boards by key and {(key, move): points} a book must have."""
+    # (key, move): [games, points] of the mainline of every game
+    counts = {}
+    boards = {}
+    for text in read_all_games(data):
+        game = chess.pgn.read_game(io.StringIO(text))
+        board = game.board()
+        for move in list(game.mainline_moves())[:options.max_ply]:
+            key = chess.polyglot.zobrist_hash(board)
+            boards[key] = board.copy()
+            points = book_builder.result_points(game.headers['Result'], board.turn, options)
+            value = counts.setdefault((key, move), [0, 0])
+            value[0] += 1
+            value[1] += points
+            board.push(move)
+
+    return boards, {k: v[1] for k, v in counts.items() if v[0] >= min_count and v[1] > 0}
+
+
+def read_book(book_file, boards):
+    with chess.polyglot.open_reader(book_file) as reader:
+        return {(key, entry.move): entry.weight
+                for key, board in boards.items() for entry in reader.find_all(board)}
+
+
+def test_book_matches_brute_force():
+    data = make_pgn_bytes(80, seed=4)
+    options = book_builder.BuildOptions(max_ply=12, color=None, win=2, draw=1,
+                                        loss=0, max_entries=50, shard_dir=None)
+    boards, expected = brute_force_book(data, options, min_count=2)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = write_pgn(tmp_dir, data)
+        book_file = os.path.join(tmp_dir, 'book.bin')
+        games, entries = book_builder.build_book(
+            [pgn_file], book_file, options, min_count=2, workers=2, chunk_size=500)
+        assert games == 82
+        assert entries == len(expected) == os.path.getsize(book_file) // 16
+        assert read_book(book_file, boards) == expected
+
+        # Polyglot stores castling as king takes rook, the reader gives O-O
+        board = chess.Board()
+        for san in 'e4 e5 Nf3 Nc6 Bc4 Bc5'.split():
+            board.push_san(san)
+        with chess.polyglot.open_reader(book_file) as reader:
+            assert [(e.move.uci(), e.weight) for e in reader.find_all(board)] == [('e1g1', 4)]
+
+
+def test_book_merges_in_passes():
+    data = make_pgn_bytes(120, seed=12)
+    options = book_builder.BuildOptions(max_ply=10, color=None, win=2, draw=1,
+                                        loss=0, max_entries=4, shard_dir=None)
+    boards, expected = brute_force_book(data, options, min_count=1)
+
+    # Shards being read now and at most
+    n_open = [0, 0]
+    saved_read_shard = book_builder.read_shard
+
+    def read_shard(shard_file):
+        n_open[0] += 1
+        n_open[1] = max(n_open)
+        try:
+            yield from saved_read_shard(shard_file)
+        finally:
+            n_open[0] -= 1
+
+    saved_fan_in = book_builder.MAX_MERGE_FAN_IN
+    book_builder.MAX_MERGE_FAN_IN = 3
+    book_builder.read_shard = read_shard
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pgn_file = write_pgn(tmp_dir, data)
+            chunks = pgn_tools.split_pgn_chunks(pgn_file, 300)
+            assert len(chunks) > 9
+
+            # Hundreds of shards, merged 3 at a time over several passes
+            shard_dir = os.path.join(tmp_dir, 'shards')
+            os.mkdir(shard_dir)
+            shards = [shard for start, end in chunks for shard in book_builder.count_chunk(
+                (pgn_file, start, end, options._replace(shard_dir=shard_dir))).shards]
+            assert len(shards) > 3 ** 4
+
+            book_file = os.path.join(tmp_dir, 'book.bin')
+            assert book_builder.write_book(shards, book_file, 1, shard_dir) == len(expected)
+            assert read_book(book_file, boards) == expected
+            assert n_open == [0, 3]
+            assert sorted(os.listdir(shard_dir)) == sorted(os.path.basename(f) for f in shards)
+    finally:
+        book_builder.MAX_MERGE_FAN_IN = saved_fan_in
+        book_builder.read_shard = saved_read_shard
+
+
+if __name__ == '__main__':
+    test_chunks_split_at_games()
+    test_split_from_offset()
+    test_raw_games_give_the_file_back()
+    test_book_matches_brute_force()
+    test_book_merges_in_passes()
+    print('All pgn tools tests passed.')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Checks that the repertoire index read in parts matches a full rebuild.
+
+Run with python test_repertoire.py or with pytest.
+"""
+import os
+import tempfile
+
+import chess
+import chess.pgn
+
+from repertoire import RepertoireIndex, RepertoireLine
+from test_pgn_tools import CancelAfter, make_appended_pgn_bytes, split_raw_games
+
+
+def make_games(n_games, seed=1):
+    """Returns the raw bytes of n_games games, some with variations."""
+    return split_raw_games(make_appended_pgn_bytes(n_games, seed, sideline_rate=0.2))
+
+
+def rebuilt_moves(tmp_dir, pgn_file):
+    index = RepertoireIndex(pgn_file, os.path.join(tmp_dir, 'full.rep'))
+    index.update()
+    return index._moves
+
+
+def test_append_matches_rebuild():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'rep.pgn')
+        texts = make_games(30)
+        with open(pgn_file, 'wb') as f:
+            f.writelines(texts[:20])
+        index = RepertoireIndex(pgn_file)
+        assert index.update() == 20
+
+        # Save to Repertoire appends a game at a time
+        for text in texts[20:]:
+            with open(pgn_file, 'ab') as f:
+                f.write(text)
+            assert index.update() == 1
+        assert index.update() == 0
+        assert index._moves == rebuilt_moves(tmp_dir, pgn_file)
+
+        # The sidecar is read back without parsing the pgn
+        reloaded = RepertoireIndex(pgn_file)
+        assert reloaded.update() == 0
+        assert reloaded._moves == index._moves
+
+
+def test_changed_pgn_is_rebuilt():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'rep.pgn')
+        texts = make_games(15, seed=2)
+        with open(pgn_file, 'wb') as f:
+            f.writelines(texts)
+        index = RepertoireIndex(pgn_file)
+        assert index.update() == 17
+
+        # A game deleted in an editor, the pgn is longer than before
+        other = make_games(20, seed=3)
+        with open(pgn_file, 'wb') as f:
+            f.writelines(texts[1:] + other)
+        assert index.update() == 16 + 22
+        assert index._moves == rebuilt_moves(tmp_dir, pgn_file)
+
+        os.remove(pgn_file)
+        assert index.update() == 0
+        assert len(index) == 0
+
+
+def test_cancel_leaves_index():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'rep.pgn')
+        texts = make_games(20, seed=4)
+        with open(pgn_file, 'wb') as f:
+            f.writelines(texts[:5])
+        index = RepertoireIndex(pgn_file)
+        index.update()
+        moves = {key: dict(m) for key, m in index._moves.items()}
+        with open(index.index_file, 'rb') as f:
+            sidecar = f.read()
+
+        # Cancelled after some of the appended games are read
+        with open(pgn_file, 'ab') as f:
+            f.writelines(texts[5:])
+        cancel_event = CancelAfter(8)
+        assert index.update(cancel_event=cancel_event) is None
+        assert cancel_event.n == -1
+        assert index._moves == moves
+        with open(index.index_file, 'rb') as f:
+            assert f.read() == sidecar
+
+        assert index.update() == 17
+        assert index._moves == rebuilt_moves(tmp_dir, pgn_file)
+
+
+def test_line_refresh():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pgn_file = os.path.join(tmp_dir, 'rep.pgn')
+        game = chess.pgn.Game()
+        game.add_line([chess.Move.from_uci(m) for m in ['e2e4', 'e7e5', 'g1f3', 'b8c6']])
+        with open(pgn_file, 'w') as f:
+            f.write('{}\n\n'.format(game))
+
+        # The line is made before the index is read, like the gui does
+        index = RepertoireIndex(pgn_file)
+        board = chess.Board()
+        board.push_uci('e2e4')
+        line = RepertoireLine(index, board)
+        assert line.get_text() == 'Not in repertoire'
+        line.push(board.copy(), chess.Move.from_uci('e7e5'))
+        board.push_uci('e7e5')
+
+        index.update()
+        line.refresh()
+        assert line.get_text() == 'In repertoire, 2 plies'
+
+        line.push(board.copy(), chess.Move.from_uci('d2d4'))
+        assert line.get_text() == 'Left at 2.d4, repertoire: Nf3'
+
+
+if __name__ == '__main__':
+    test_append_matches_rebuild()
+    test_changed_pgn_is_rebuilt()
+    test_cancel_leaves_index()
+    test_line_refresh()
+    print('All repertoire tests passed.')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Checks that the game clocks stay correct when the gui loop is slow.
+
+The loop of play_game() is simulated with iterations of random length,
+while other threads keep the cpu busy. Run with python test_timer.py or
+with pytest.
+"""
+import random
+import threading
+import time
+
+from python_easy_chess_gui import Timer
+
+
+TOLERANCE_MS = 20
+
+
+def cpu_load(stop_event):
+    """Keeps one cpu busy until stop_event is set."""
+    n = 0
+    while not stop_event.is_set():
+        n = (n * 31 + 7) % 1000003
+
+
+def play_move(timer, duration_sec, rng):
+    """Spins a fake gui loop with uneven iterations for duration_sec.
+
+    Returns the wall time of the move in ms and the number of iterations.
+    """
+    t0 = time.monotonic()
+    timer.start()
+    iterations = 0
+    while time.monotonic() - t0 < duration_sec:
+        # An event, a redraw or a busy machine, anything but 100ms
+        time.sleep(rng.choice([0.0, 0.01, 0.05, 0.1, 0.25]))
+        _ = timer.elapse  # the loop shows the running clock
+        iterations += 1
+    timer.update_base()
+    return int(1000 * (time.monotonic() - t0)), iterations
+
+
+def test_clock_under_load():
+    rng = random.Random(1)
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=cpu_load, args=(stop_event,), daemon=True)
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+
+    try:
+        timer = Timer('fischer', base=60000, inc=1000)
+        expected_base = timer.base
+        for duration_sec in [0.3, 0.7, 1.2]:
+            wall_ms, iterations = play_move(timer, duration_sec, rng)
+            expected_base += timer.inc - wall_ms
+            print(f'move {wall_ms}ms, {iterations} loop iterations, '
+                  f'clock {timer.last_elapse}ms, old clock {100 * iterations}ms')
+            assert abs(timer.last_elapse - wall_ms) <= TOLERANCE_MS
+            assert abs(timer.base - expected_base) <= 3 * TOLERANCE_MS
+    finally:
+        stop_event.set()
+        for t in threads:
+            t.join()
+
+
+def test_stop_and_resume():
+    # Upper bounds are the wall time measured around the clock, a busy
+    # machine makes both longer
+    timer = Timer('classical', base=10000, inc=0)
+    t0 = time.monotonic_ns()
+    timer.start()
+    time.sleep(0.2)
+    first_ms = timer.stop()
+    first_span_ns = time.monotonic_ns() - t0
+    assert 180 <= first_ms <= first_span_ns // 1000000
+
+    # Time while the clock is stopped does not count
+    time.sleep(0.2)
+    assert timer.elapse == first_ms
+
+    t0 = time.monotonic_ns()
+    timer.start()
+    timer.start()  # does not restart the move
+    time.sleep(0.1)
+    timer.update_base()
+    span_ns = first_span_ns + time.monotonic_ns() - t0
+    assert 280 <= timer.last_elapse <= span_ns // 1000000
+    assert timer.base == 10000 - timer.last_elapse
+    assert not timer.is_running and timer.elapse == 0
+
+
+def test_time_control_types():
+    timer = Timer('delay', base=5000, inc=1000)
+    timer.update_base()
+    assert timer.base == 5000
+
+    timer = Timer('timepermove', base=3000, inc=0)
+    timer.start()
+    time.sleep(0.05)
+    timer.update_base()
+    assert timer.base == 3000
+
+
+if __name__ == '__main__':
+    test_stop_and_resume()
+    test_time_control_types()
+    test_clock_under_load()
+    print('All timer tests passed.')